@@ -0,0 +1,348 @@
+"""
+Admission control for chat turns.
+
+Every /chat and /chat_stream turn goes through `scheduler.turn(session_id)`:
+
+  1. Turns for the same session run one at a time, in arrival order, so two
+     requests can't load the same history and overwrite each other's save.
+     A few can wait (ECOBOT_SESSION_MAX_QUEUED); beyond that, or after
+     ECOBOT_SESSION_WAIT seconds, the request gets a 429.
+  2. At most ECOBOT_MAX_IN_FLIGHT turns run at once per process. Up to
+     ECOBOT_MAX_QUEUED more wait in FIFO order for ECOBOT_QUEUE_TIMEOUT
+     seconds; past that the request gets a fast 503.
+
+Both come with a Retry-After estimated from the recent average turn time.
+
+Model calls are also rate limited per OpenAI API key and model with token
+buckets (`model_limiter`, applied by the transport in openai_clients.py):
+requests per minute and estimated prompt tokens per minute, configured with
+ECOBOT_MODEL_RPM / ECOBOT_MODEL_TPM and per model with ECOBOT_MODEL_LIMITS,
+e.g. '{"gpt-4.1": {"rpm": 500, "tpm": 30000}}'. A call waits for its tokens
+if that takes at most ECOBOT_RATE_LIMIT_WAIT seconds; otherwise it gets a
+local 429 with Retry-After, which the OpenAI client retries like a real one.
+
+Waiters can be on different event loops (Flask runs every request on its
+own loop and thread), so the bookkeeping is under a threading lock and
+waiters are woken with call_soon_threadsafe.
+"""
+import os
+import json
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+
+MAX_IN_FLIGHT = int(os.environ.get("ECOBOT_MAX_IN_FLIGHT", "32"))
+MAX_QUEUED = int(os.environ.get("ECOBOT_MAX_QUEUED", "64"))
+QUEUE_TIMEOUT = float(os.environ.get("ECOBOT_QUEUE_TIMEOUT", "15"))
+SESSION_MAX_QUEUED = int(os.environ.get("ECOBOT_SESSION_MAX_QUEUED", "2"))
+SESSION_WAIT = float(os.environ.get("ECOBOT_SESSION_WAIT", "120"))
+
+# 0 means unlimited
+MODEL_RPM = float(os.environ.get("ECOBOT_MODEL_RPM", "0"))
+MODEL_TPM = float(os.environ.get("ECOBOT_MODEL_TPM", "0"))
+RATE_LIMIT_WAIT = float(os.environ.get("ECOBOT_RATE_LIMIT_WAIT", "10"))
+
+
+class Overloaded(Exception):
+    """A turn that wasn't admitted. The handlers turn it into `status` with a Retry-After header."""
+
+    def __init__(self, status, reason, retry_after, message):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, min(120, int(math.ceil(retry_after))))
+        self.message = message
+
+    def as_response(self):
+        """(payload, status, headers) for the chat handlers."""
+        payload = {"error": self.message, "reason": self.reason, "retry_after": self.retry_after}
+        return payload, self.status, {"Retry-After": str(self.retry_after)}
+
+
+class GateFull(Exception):
+    pass
+
+
+class _Waiter:
+    __slots__ = ("loop", "future", "granted")
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Gate:
+    """
+    Counting semaphore with a bounded FIFO wait queue that works across
+    threads and event loops. A released slot is handed straight to the
+    oldest waiter, so a newcomer can't jump the queue.
+    """
+
+    def __init__(self, capacity, max_waiters):
+        self.capacity = capacity
+        self.max_waiters = max_waiters
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self, timeout):
+        """Raises GateFull if the wait queue is full and asyncio.TimeoutError after `timeout`."""
+        with self._lock:
+            if self.active < self.capacity and not self._waiters:
+                self.active += 1
+                return
+            if len(self._waiters) >= self.max_waiters:
+                raise GateFull()
+            waiter = _Waiter(asyncio.get_running_loop())
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except BaseException:
+            with self._lock:
+                if waiter.granted:
+                    # The slot was handed over just as we gave up; pass it on
+                    self._release_locked()
+                else:
+                    self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        with self._lock:
+            self._release_locked()
+
+    def _release_locked(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            try:
+                waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+            except RuntimeError:
+                continue  # its loop is gone
+            waiter.granted = True
+            return
+        self.active -= 1
+
+
+class AdmissionScheduler:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queued=MAX_QUEUED, queue_timeout=QUEUE_TIMEOUT,
+                 session_max_queued=SESSION_MAX_QUEUED, session_wait=SESSION_WAIT):
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.session_max_queued = session_max_queued
+        self.session_wait = session_wait
+        self._global = Gate(max_in_flight, max_queued)
+        self._sessions = {}  # session_id -> [Gate(1), turns using it]
+        self._lock = threading.Lock()
+        self._avg_turn = 10.0  # seconds, moving average of admitted turns
+        self._counts = {"admitted": 0, "waited": 0, "session_busy": 0, "overloaded": 0, "queue_timeout": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def retry_after(self, queued=0, per_slot=1):
+        """Seconds until a slot is likely free with `queued` turns ahead of us."""
+        return self._avg_turn * (queued + 1) / per_slot
+
+    def _enter_session(self, session_id):
+        # Gates are refcounted by the turns using them so one can't be dropped
+        # between being looked up and acquired
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = [Gate(1, self.session_max_queued), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _leave_session(self, session_id):
+        with self._lock:
+            entry = self._sessions[session_id]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._sessions[session_id]
+
+    @asynccontextmanager
+    async def turn(self, session_id):
+        """Hold the session and a global slot for one turn. Yields the ms spent waiting."""
+        queued_at = time.perf_counter()
+        session = self._enter_session(session_id)
+        try:
+            try:
+                await session.acquire(self.session_wait)
+            except (GateFull, asyncio.TimeoutError):
+                self._count("session_busy")
+                raise Overloaded(429, "session_busy", self.retry_after(session.waiting),
+                                 "Another message for this session is still being answered. Please retry shortly.")
+            try:
+                async with self._global_slot():
+                    started = time.perf_counter()
+                    try:
+                        yield round((started - queued_at) * 1000, 1)
+                    except Exception as e:
+                        # The model API (or model_limiter) still said no after the client's retries
+                        if getattr(e, "status_code", None) == 429:
+                            raise Overloaded(429, "rate_limited", retry_after_header(e) or self.retry_after(),
+                                             "EcoBot is rate limited right now. Please retry shortly.") from e
+                        raise
+                    finally:
+                        with self._lock:
+                            self._avg_turn = 0.9 * self._avg_turn + 0.1 * (time.perf_counter() - started)
+            finally:
+                session.release()
+        finally:
+            self._leave_session(session_id)
+
+    @asynccontextmanager
+    async def _global_slot(self):
+        if self._global.active >= self.max_in_flight:
+            self._count("waited")
+        try:
+            await self._global.acquire(self.queue_timeout)
+        except GateFull:
+            self._count("overloaded")
+            raise Overloaded(503, "overloaded", self.retry_after(self._global.waiting, self.max_in_flight),
+                             "EcoBot is busy right now. Please retry in a moment.")
+        except asyncio.TimeoutError:
+            self._count("queue_timeout")
+            raise Overloaded(503, "queue_timeout", self.retry_after(self._global.waiting, self.max_in_flight),
+                             "EcoBot is busy right now. Please retry in a moment.")
+        self._count("admitted")
+        try:
+            yield
+        finally:
+            self._global.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self._global.active,
+                "queued": self._global.waiting,
+                "max_in_flight": self.max_in_flight,
+                "active_sessions": len(self._sessions),
+                "avg_turn_s": round(self._avg_turn, 2),
+                **self._counts,
+            }
+
+
+def retry_after_header(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Reservation-style bucket: take() always debits and returns how long the
+    caller has to wait for its tokens, so concurrent callers queue up in
+    order without a background refill task.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def take(self, amount, max_wait):
+        """Seconds to wait, or None (nothing debited) if that would exceed max_wait."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, (amount - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= amount
+        return wait
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def load_model_limits():
+    limits = {}
+    raw = os.environ.get("ECOBOT_MODEL_LIMITS")
+    if raw:
+        try:
+            limits = json.loads(raw)
+        except ValueError:
+            print("ECOBOT_MODEL_LIMITS is not valid JSON, ignoring it")
+    return limits
+
+
+class ModelRateLimiter:
+    """Token buckets per (API key, model) for requests and prompt tokens per minute."""
+
+    def __init__(self, rpm=MODEL_RPM, tpm=MODEL_TPM, limits=None, max_wait=RATE_LIMIT_WAIT):
+        self.default = {"rpm": rpm, "tpm": tpm}
+        self.limits = load_model_limits() if limits is None else limits
+        self.max_wait = max_wait
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._counts = {"waited": 0, "limited": 0}
+
+    def _limits_for(self, model):
+        """(name, limits): the longest configured prefix, so gpt-4.1 covers gpt-4.1-2025-04-14."""
+        for name in sorted(self.limits, key=len, reverse=True):
+            if model.startswith(name):
+                return name, {**self.default, **self.limits[name]}
+        return model, self.default
+
+    def _bucket(self, key, kind, per_minute):
+        bucket = self._buckets.get((key, kind))
+        if bucket is None:
+            bucket = self._buckets[(key, kind)] = TokenBucket(per_minute)
+        return bucket
+
+    def reserve(self, api_key, model, prompt_tokens):
+        """Seconds to wait before sending, or raises Overloaded(429) if it's too long."""
+        name, limits = self._limits_for(model)
+        # Snapshots of a configured model share its buckets, like OpenAI's own limits
+        key = (api_key[-6:] if api_key else "", name)
+        with self._lock:
+            taken = []
+            wait = 0.0
+            for kind, amount in (("rpm", 1), ("tpm", prompt_tokens)):
+                if not limits.get(kind):
+                    continue
+                bucket = self._bucket(key, kind, float(limits[kind]))
+                # A single call bigger than the whole bucket can only ever wait for a full refill
+                amount = min(amount, bucket.capacity)
+                bucket_wait = bucket.take(amount, self.max_wait)
+                if bucket_wait is None:
+                    for done_bucket, done_amount in taken:
+                        done_bucket.refund(done_amount)
+                    self._counts["limited"] += 1
+                    retry_after = (amount - bucket.tokens) / bucket.rate
+                    raise Overloaded(429, "rate_limited", retry_after,
+                                     f"Rate limit for {model} reached. Please retry shortly.")
+                taken.append((bucket, amount))
+                wait = max(wait, bucket_wait)
+            if wait > 0:
+                self._counts["waited"] += 1
+            return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buckets": {f"{model} {kind}": round(bucket.tokens, 1)
+                            for ((_, model), kind), bucket in self._buckets.items()},
+                **self._counts,
+            }
+
+
+scheduler = AdmissionScheduler()
+model_limiter = ModelRateLimiter()
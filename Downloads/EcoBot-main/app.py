@@ -1,28 +1,52 @@
 import os
 import asyncio
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
-from flask import Flask, render_template, request, jsonify
-from test import run_workflow, WorkflowInput
+from flask import Flask, Response, render_template, request, jsonify
+from test import run_workflow, run_workflow_streamed, WorkflowInput
+import topic_classifier
+from water_cache import get_water_cache
+from watershed_index import get_watershed_index
+from gazetteer import get_gazetteer
+from response_cache import get_response_cache
+from location_cache import get_location_cache
+from session_store import create_session_store
+from evaluator import evaluate_response, usage_fields
+from usage_accounting import UsageCollector
+from eval_queue import EvaluationQueue
+import batch_eval
+from log_store import LogStore, decode_cursor, locked_append
+import pipeline_tracing
+import openai_clients
+import epa_client
+import admission
+import model_profiles
+import specialist_router
 
 app = Flask(__name__)
 
-# Simple in-memory session storage
-# Format: {session_id: [history_items]}
-sessions = {}
+# Session storage (memory/sqlite/redis, see session_store.py)
+# Each session holds the agent history plus {"last_topic": ...}
+session_store = create_session_store()
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 # Logging configuration
-LOG_FILE = os.path.join(os.path.dirname(__file__), 'logs', 'conversations.jsonl')
-CSV_LOG_FILE = os.path.join(os.path.dirname(__file__), 'all_responses.csv')
+# Overridable so benchmark runs (bench/) don't write into the real logs
+LOG_FILE = os.environ.get("ECOBOT_LOG_FILE", os.path.join(os.path.dirname(__file__), 'logs', 'conversations.jsonl'))
+CSV_LOG_FILE = os.environ.get("ECOBOT_CSV_LOG", os.path.join(os.path.dirname(__file__), 'all_responses.csv'))
 os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
 
-def log_interaction(session_id, user_message, bot_response, topic, evaluation=None):
-    import json
+# Indexed interaction log (SQLite, see log_store.py); the JSONL file is kept
+# as an append-only raw record
+log_store = LogStore(jsonl_path=LOG_FILE)
+
+def log_interaction(session_id, user_message, bot_response, topic, evaluation=None, write_csv=True, chart=None):
+    """Store an interaction (and append it to the CSV). Returns its record id."""
     from datetime import datetime
     
     entry = {
@@ -31,76 +55,283 @@ def log_interaction(session_id, user_message, bot_response, topic, evaluation=No
         "user_message": user_message,
         "bot_response": bot_response,
         "topic": topic,
-        "evaluation": evaluation
+        "evaluation": evaluation,
+        "chart": chart
     }
     
-    with open(LOG_FILE, 'a') as f:
-        f.write(json.dumps(entry) + '\n')
-        
-    # Write to CSV
-    import csv
-    file_exists = os.path.isfile(CSV_LOG_FILE)
+    with pipeline_tracing.span("log_write"):
+        record_id = log_store.append(entry)
+
+        if write_csv:
+            write_csv_row(entry, evaluation)
+    return record_id
+
+CSV_HEADER = ['Timestamp', 'Session ID', 'Topic', 'User Message', 'Bot Response', 'Fairness (0-100)', 'Accuracy (0-100)', 'Compliance', 'Explanation', 'Cost', 'Latency', 'Fallback', 'Prompt Tokens', 'Cached Tokens', 'Completion Tokens', 'Evaluator Cost']
+
+def csv_lock():
+    # A sidecar file, since update_csv_row swaps in a new CSV file; every
+    # writer (worker, thread) takes this before touching the CSV
+    return locked_append(CSV_LOG_FILE + '.lock')
+
+def csv_row(entry, evaluation):
+    eval_fairness = evaluation.get('fairness_score') if evaluation and not evaluation.get('error') else ''
+    eval_accuracy = evaluation.get('accuracy_score') if evaluation and not evaluation.get('error') else ''
+    eval_compliance = evaluation.get('compliance') if evaluation and not evaluation.get('error') else ''
+    eval_explanation = evaluation.get('explanation') if evaluation and not evaluation.get('error') else ''
     
-    with open(CSV_LOG_FILE, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(['Timestamp', 'Session ID', 'Topic', 'User Message', 'Bot Response', 'Fairness (0-100)', 'Accuracy (0-100)', 'Compliance', 'Explanation', 'Cost', 'Latency', 'Fallback'])
-            
-        eval_fairness = evaluation.get('fairness_score') if evaluation and not evaluation.get('error') else ''
-        eval_accuracy = evaluation.get('accuracy_score') if evaluation and not evaluation.get('error') else ''
-        eval_compliance = evaluation.get('compliance') if evaluation and not evaluation.get('error') else ''
-        eval_explanation = evaluation.get('explanation') if evaluation and not evaluation.get('error') else ''
-        
-        eval_cost = evaluation.get('cost', '') if evaluation else ''
-        eval_latency = evaluation.get('latency', '') if evaluation else ''
-        eval_fallback = evaluation.get('fallback', '') if evaluation else ''
-        
-        writer.writerow([
-            entry['timestamp'],
-            entry['session_id'],
-            entry['topic'],
-            entry['user_message'],
-            entry['bot_response'],
-            eval_fairness,
-            eval_accuracy,
-            eval_compliance,
-            eval_explanation,
-            eval_cost,
-            eval_latency,
-            eval_fallback
-        ])
-
-def get_logs():
-    import json
-    logs = []
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'r') as f:
-            for line in f:
-                try:
-                    logs.append(json.loads(line))
-                except json.JSONDecodeError:
-                    continue
-    return logs
+    eval_cost = evaluation.get('cost', '') if evaluation else ''
+    eval_latency = evaluation.get('latency', '') if evaluation else ''
+    eval_fallback = evaluation.get('fallback', '') if evaluation else ''
+    eval_prompt_tokens = evaluation.get('prompt_tokens', '') if evaluation else ''
+    eval_cached_tokens = evaluation.get('cached_tokens', '') if evaluation else ''
+    eval_completion_tokens = evaluation.get('completion_tokens', '') if evaluation else ''
+    eval_evaluator_cost = evaluation.get('evaluator_cost', '') if evaluation else ''
+    
+    return [
+        entry['timestamp'],
+        entry['session_id'],
+        entry['topic'],
+        entry['user_message'],
+        entry['bot_response'],
+        eval_fairness,
+        eval_accuracy,
+        eval_compliance,
+        eval_explanation,
+        eval_cost,
+        eval_latency,
+        eval_fallback,
+        eval_prompt_tokens,
+        eval_cached_tokens,
+        eval_completion_tokens,
+        eval_evaluator_cost
+    ]
+
+def write_csv_row(entry, evaluation):
+    import csv
+    with csv_lock():
+        file_exists = os.path.isfile(CSV_LOG_FILE)
+        with open(CSV_LOG_FILE, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if not file_exists:
+                writer.writerow(CSV_HEADER)
+            writer.writerow(csv_row(entry, evaluation))
+
+def update_csv_row(entry, evaluation):
+    """
+    Replace the row log_interaction wrote for this turn (matched on timestamp
+    and session) with one that has the scores; append it if it isn't there.
+    """
+    import csv
+    with csv_lock():
+        rows = []
+        if os.path.isfile(CSV_LOG_FILE):
+            with open(CSV_LOG_FILE, 'r', newline='', encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+        if not rows:
+            rows = [CSV_HEADER]
+        key = [entry['timestamp'], entry['session_id'] or '']
+        # The turn was logged moments ago, so look from the end
+        for i in range(len(rows) - 1, 0, -1):
+            if rows[i][:2] == key:
+                rows[i] = csv_row(entry, evaluation)
+                break
+        else:
+            rows.append(csv_row(entry, evaluation))
+        tmp_path = CSV_LOG_FILE + '.tmp'
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(rows)
+        os.replace(tmp_path, CSV_LOG_FILE)
+
+def update_log_evaluations(updates):
+    """
+    Set evaluations for many log entries in one transaction.
+    `updates` maps record id -> evaluation. Returns the updated entries.
+    """
+    return log_store.update_evaluations(updates)
 
 def update_log_evaluation(timestamp, evaluation):
-    import json
-    logs = get_logs()
-    updated = False
-    
-    # Simple linear scan implementation - in production use a real DB
-    # We will rewrite the file
-    new_logs = []
-    for log in logs:
-        if log.get("timestamp") == timestamp:
-            log["evaluation"] = evaluation
-            updated = True
-        new_logs.append(log)
-        
-    if updated:
-         with open(LOG_FILE, 'w') as f:
-            for log in new_logs:
-                f.write(json.dumps(log) + '\n')
-    return updated
+    """
+    Set the evaluation on the log entry with this timestamp, for /run_eval
+    callers that don't send the record id. Returns the updated entry or None.
+    """
+    entry = log_store.find_by_timestamp(timestamp)
+    return log_store.update_evaluation(entry["id"], evaluation) if entry else None
+
+def save_background_evaluation(record_id, evaluation):
+    """
+    Called by the evaluation queue (in a worker thread, off its loop) when a
+    /chat evaluation finishes or gives up: fills in the turn's scores.
+    """
+    with pipeline_tracing.span("log_write"):
+        entry = log_store.update_evaluation(record_id, evaluation)
+        if entry:
+            update_csv_row(entry, evaluation)
+
+# The queue's loop lives as long as the app, so its client is pooled for good
+evaluation_queue = EvaluationQueue(on_result=save_background_evaluation, client_factory=openai_clients.get_openai_client)
+
+
+
+def load_session_input(session_id, user_message):
+    """Returns (workflow_input, history, last_topic) for the next turn of a session."""
+    session = session_store.load(session_id)
+    history = session.history if session else []
+    last_topic = session.get("last_topic") if session else None
+    # Location from earlier turns; the workflow only re-runs location
+    # verification if the new message could name a different place
+    last_location = session.get("location") if session else None
+
+    # Create workflow input with history
+    workflow_input = WorkflowInput(input_as_text=user_message, history=history, previous_topic=last_topic, previous_location=last_location)
+    return workflow_input, history, last_topic
+
+def complete_turn(session_id, user_message, history, last_topic, result, latency_ms):
+    """
+    Everything after the workflow returns: save the session, compute metrics,
+    log the interaction and queue its evaluation. Returns the response payload.
+    """
+    # Update history
+    new_history = list(history)
+    new_history.append({
+        "role": "user",
+        "content": [{"type": "input_text", "text": user_message}]
+    })
+
+    response_text = ""
+    response_data = {}
+
+    current_topic = None
+    current_location = None
+    chart = None
+    usage = None
+    tokens_saved = 0
+    if isinstance(result, dict):
+        response_data = result
+        response_text = result.get("output_text", "")
+        current_topic = result.get("topic")
+        chart = result.get("chart")
+        current_location = result.get("location")
+        usage = result.get("usage")
+        # Prompt tokens the history compaction stage saved across all agent calls
+        tokens_saved = (result.get("compaction") or {}).get("tokens_saved", 0)
+
+        # Use the history returned from the agent runner if available
+        # This ensures we use the correct Types/Schemas for the agents library
+        if "history" in result and result["history"]:
+            new_history = result["history"]
+        else:
+             # Fallback if for some reason history is not returned (e.g. error case not handled)
+             if response_text:
+                 new_history.append({
+                    "role": "assistant",
+                    "content": [{"type": "output_text", "text": response_text}]
+                })
+    else:
+        response_text = str(result)
+        response_data = {'output_text': response_text}
+        if response_text:
+             new_history.append({
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": response_text}]
+            })
+
+    # Update last topic if we have one, otherwise keep previous (unless we switched?)
+    if current_topic:
+         last_topic = current_topic
+    session_meta = {"last_topic": last_topic}
+    if current_location:
+        session_meta["location"] = current_location
+    with pipeline_tracing.span("session_save"):
+        session_store.save(session_id, new_history, **session_meta)
+
+    # Metric Calculation
+    # Tokens and cost come from the API usage of every agent call the workflow
+    # made (see usage_accounting.py), priced per model
+    if usage is None:
+        # Nothing reported (e.g. an error result): fall back to the old
+        # estimate, 1 token ~= 4 chars at GPT-4o pricing
+        est_input_tokens = int(len(user_message) / 4)
+        est_output_tokens = int(len(response_text) / 4)
+        usage = {
+            "prompt_tokens": est_input_tokens,
+            "cached_tokens": 0,
+            "completion_tokens": est_output_tokens,
+            "total_tokens": est_input_tokens + est_output_tokens,
+            "cost": (est_input_tokens / 1_000_000 * 5.00) + (est_output_tokens / 1_000_000 * 15.00),
+            "agents": {},
+        }
+    cost_str = f"${usage['cost']:.6f}"
+
+    # Fallback detection
+    # Simple heuristic: if response indicates inability to classify or handle request
+    fallback = "No"
+    if response_data.get("fallback") or "I couldn't classify" in response_text or "provide a city name" in response_text:
+        fallback = "Yes"
+
+    metrics = {
+        "cost": cost_str,
+        "latency": f"{latency_ms}ms",
+        "fallback": fallback,
+        "prompt_tokens": usage["prompt_tokens"],
+        "cached_tokens": usage["cached_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "total_tokens": usage["total_tokens"],
+        "tokens_saved": tokens_saved,
+        # Per-agent breakdown: model, requests, prompt/cached/completion tokens, cost
+        "usage_by_agent": usage["agents"]
+    }
+
+    # Log the interaction (and its CSV row) now, so a restart before the
+    # evaluation doesn't lose the turn; the GPT-4o evaluation runs on the
+    # background queue and fills the scores into both when it's done.
+    log_id = log_interaction(session_id, user_message, response_text, last_topic, {**metrics, "status": "pending"}, chart=chart)
+    if not evaluation_queue.submit(log_id, user_message, response_text, metrics):
+        save_background_evaluation(log_id, {**metrics, "error": "Evaluation queue full"})
+
+    # Metrics go back to the UI straight away, scores via /evaluation/<id>
+    response_data['evaluation'] = metrics
+    response_data['evaluation_id'] = log_id
+
+    return response_data
+
+
+async def call_io(offload_io, fn, *args):
+    """
+    Session/log I/O for the chat handlers. Under Flask each request has its
+    own thread, so it runs inline; asgi.py passes offload_io=True so it goes
+    to a worker thread instead of stalling the shared event loop.
+    """
+    if offload_io:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+async def chat_turn(session_id, user_message, endpoint="/chat", offload_io=False):
+    """
+    One non-streaming chat turn, shared by the Flask view and asgi.py. Returns
+    the response payload; raises admission.Overloaded if the turn isn't admitted.
+    """
+    # Per-stage spans for /metrics and the slow trace file (pipeline_tracing.py)
+    with pipeline_tracing.request_trace("chat", endpoint=endpoint):
+        # One turn per session at a time and a bounded number in flight (admission.py)
+        async with admission.scheduler.turn(session_id) as queued_ms:
+            pipeline_tracing.tag_request(queued_ms=queued_ms)
+
+            # Retrieve history for this session
+            with pipeline_tracing.span("session_load"):
+                workflow_input, history, last_topic = await call_io(offload_io, load_session_input, session_id, user_message)
+
+            # Measure Latency
+            import time
+            start_time = time.time()
+
+            # Run the workflow (closes this request's pooled clients if it opened them)
+            async with openai_clients.request_scope(), epa_client.request_scope():
+                result = await run_workflow(workflow_input)
+
+            end_time = time.time()
+            latency_ms = round((end_time - start_time) * 1000, 2)
+
+            return await call_io(offload_io, complete_turn, session_id, user_message, history, last_topic, result, latency_ms)
 
 
 @app.route('/chat', methods=['POST'])
@@ -114,146 +345,13 @@ async def chat():
         if not user_message:
             return jsonify({'error': 'No message provided'}), 400
 
-        # Retrieve history for this session
-        history = sessions.get(session_id, {}).get("history", [])
-        last_topic = sessions.get(session_id, {}).get("last_topic")
-
-        # Create workflow input with history
-        workflow_input = WorkflowInput(input_as_text=user_message, history=history, previous_topic=last_topic)
-        
-        # Measure Latency
-        import time
-        start_time = time.time()
-        
-        # Run the workflow
-        result = await run_workflow(workflow_input)
-        
-        end_time = time.time()
-        latency_ms = round((end_time - start_time) * 1000, 2)
-        
-        # Update history
-        if session_id not in sessions:
-            sessions[session_id] = {"history": [], "last_topic": None}
-            
-        sessions[session_id]["history"].append({
-            "role": "user",
-            "content": [{"type": "input_text", "text": user_message}]
-        })
-        
-        response_text = ""
-        response_data = {}
-        
-        current_topic = None
-        if isinstance(result, dict):
-            response_data = result
-            response_text = result.get("output_text", "")
-            current_topic = result.get("topic")
-            
-            # Use the history returned from the agent runner if available
-            # This ensures we use the correct Types/Schemas for the agents library
-            if "history" in result and result["history"]:
-                sessions[session_id]["history"] = result["history"]
-            else:
-                 # Fallback if for some reason history is not returned (e.g. error case not handled)
-                 if response_text:
-                     sessions[session_id]["history"].append({
-                        "role": "assistant",
-                        "content": [{"type": "output_text", "text": response_text}]
-                    })
-        else:
-            response_text = str(result)
-            response_data = {'output_text': response_text}
-            if response_text:
-                 sessions[session_id]["history"].append({
-                    "role": "assistant",
-                    "content": [{"type": "output_text", "text": response_text}]
-                })
-            
-        # Update last topic if we have one, otherwise keep previous (unless we switched?)
-        if current_topic:
-             sessions[session_id]["last_topic"] = current_topic
-             
-        # Metric Calculation
-        # Cost Estimation (Approximate based on GPT-4o pricing: ~$5/1M in, ~$15/1M out)
-        # 1 token ~= 4 chars
-        input_chars = len(user_message)
-        output_chars = len(response_text)
-        est_input_tokens = input_chars / 4
-        est_output_tokens = output_chars / 4
-        cost = (est_input_tokens / 1_000_000 * 5.00) + (est_output_tokens / 1_000_000 * 15.00)
-        cost_str = f"${cost:.6f}"
-        
-        # Fallback detection
-        # Simple heuristic: if response indicates inability to classify or handle request
-        fallback = "No"
-        if "I couldn't classify" in response_text or "provide a city name" in response_text:
-            fallback = "Yes"
-            
-        # Run real-time evaluation
-        evaluation = None
-        try:
-            from openai import AsyncOpenAI
-            client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-            
-            eval_prompt = f"""
-            You are an AI evaluator. Evaluate the following response to the user query.
-            
-            User Query: {user_message}
-            Bot Response: {response_text}
-            
-            Evaluate on:
-            1. Fairness (0-100): Is the response unbiased?
-            2. Accuracy (0-100): Does it seem factually sound based on the context?
-            3. Compliance (Yes/No): Did it follow instructions (citations, brevity, etc.)?
-            
-            Return JSON format:
-            {{
-                "fairness_score": int,
-                "accuracy_score": int,
-                "compliance": "string",
-                "explanation": "string"
-            }}
-            """
-            
-            completion = await client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": eval_prompt}],
-                response_format={"type": "json_object"}
-            )
-            
-            eval_result = completion.choices[0].message.content
-            import json
-            evaluation = json.loads(eval_result)
-            
-            # Add new metrics to evaluation object for UI
-            evaluation['cost'] = cost_str
-            evaluation['latency'] = f"{latency_ms}ms"
-            evaluation['fallback'] = fallback
-            evaluation['prompt_tokens'] = int(est_input_tokens)
-            evaluation['completion_tokens'] = int(est_output_tokens)
-            evaluation['total_tokens'] = int(est_input_tokens + est_output_tokens)
-             
-        except Exception as eval_err:
-            print(f"Evaluation failed: {eval_err}")
-            evaluation = {
-                "error": "Evaluation failed", 
-                "cost": cost_str, 
-                "latency": f"{latency_ms}ms", 
-                "fallback": fallback,
-                "prompt_tokens": int(est_input_tokens),
-                "completion_tokens": int(est_output_tokens),
-                "total_tokens": int(est_input_tokens + est_output_tokens)
-            }
-            
-        # Log the interaction with evaluation
-        log_interaction(session_id, user_message, response_text, sessions[session_id].get("last_topic"), evaluation)
-        
-        # Add evaluation to response data for UI
-        response_data['evaluation'] = evaluation
-            
+        response_data = await chat_turn(session_id, user_message)
         return jsonify(response_data)
 
-
+    except admission.Overloaded as e:
+        # Fast 429 (session busy, rate limited) or 503 (too many turns in flight)
+        payload, status, headers = e.as_response()
+        return jsonify(payload), status, headers
 
     except Exception as e:
         import traceback
@@ -261,70 +359,309 @@ async def chat():
         print(f"Error processing request: {e}")
         return jsonify({'error': str(e)}), 500
 
+
+def iter_async(agen):
+    """
+    Drive an async generator on its own event loop thread and yield its items
+    synchronously, so Flask can stream it. Stops the generator if the client
+    goes away.
+    """
+    import queue
+    items = queue.Queue()
+    done = object()
+    stop = threading.Event()
+
+    async def pump():
+        try:
+            # The loop only lives for this stream, so close its OpenAI/EPA clients after
+            async with openai_clients.request_scope(), epa_client.request_scope():
+                async for item in agen:
+                    items.put(item)
+                    if stop.is_set():
+                        break
+        except Exception as e:
+            items.put(e)
+        finally:
+            await agen.aclose()
+            items.put(done)
+
+    threading.Thread(target=lambda: asyncio.run(pump()), name="chat-stream", daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def sse(event, data):
+    import json
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def chat_stream_events(session_id, user_message, offload_io=False):
+    """
+    SSE frames for one streamed turn. The first frame is "admitted" once the
+    turn gets past admission control; before that it raises admission.Overloaded,
+    which the handlers answer with a plain 429/503 instead of starting a stream.
+    """
+    import time
+    with pipeline_tracing.request_trace("chat", endpoint="/chat_stream"):
+        async with admission.scheduler.turn(session_id) as queued_ms:
+            pipeline_tracing.tag_request(queued_ms=queued_ms)
+            yield sse("admitted", {"queued_ms": queued_ms})
+
+            with pipeline_tracing.span("session_load"):
+                workflow_input, history, last_topic = await call_io(offload_io, load_session_input, session_id, user_message)
+            start_time = time.time()
+
+            async for event in run_workflow_streamed(workflow_input):
+                if event["event"] != "done":
+                    yield sse(event["event"], event["data"])
+                    continue
+
+                latency_ms = round((time.time() - start_time) * 1000, 2)
+                response_data = await call_io(offload_io, complete_turn, session_id, user_message, history, last_topic,
+                                              event["data"], latency_ms)
+                # The UI doesn't need the agent history, so leave it out of the final event
+                yield sse("done", {k: v for k, v in response_data.items() if k != "history"})
+
+
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream():
+    """
+    Same as /chat but streams Server-Sent Events: "topic" and "location" once
+    pre-routing is done, "delta" for each chunk of specialist output, and a
+    final "done" event with the full output, chart and metrics.
+    """
+    # Missing or non-JSON body -> the 400 below, not a 500
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    user_message = data.get('message')
+    session_id = data.get('session_id', 'default')
+
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+
+    stream = iter_async(chat_stream_events(session_id, user_message))
+    try:
+        # Wait for the "admitted" frame so an overloaded server answers with a
+        # status code rather than an error event
+        first = next(stream)
+    except admission.Overloaded as e:
+        payload, status, headers = e.as_response()
+        return jsonify(payload), status, headers
+
+    def generate():
+        try:
+            yield first
+            for chunk in stream:
+                yield chunk
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield sse("error", {"error": str(e)})
+        finally:
+            stream.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+EVALUATION_FILTERS = ('topic', 'session_id', 'since', 'until', 'fallback', 'compliance')
+
+def evaluation_filters():
+    return {key: request.args.get(key) or None for key in EVALUATION_FILTERS}
+
+def page_args():
+    """(cursor, limit) from the query string; ValueError on a bad limit or a tampered cursor."""
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    cursor = request.args.get('cursor') or None
+    if cursor:
+        decode_cursor(cursor)
+    return cursor, max(1, min(limit, 500))
+
 @app.route('/evaluations')
 def evaluations():
-    logs = get_logs()
-    # Sort by timestamp desc
-    logs.reverse()
-    return render_template('logs.html', logs=logs)
+    # One page at a time, newest first; ?cursor= comes from the "Older" link
+    filters = evaluation_filters()
+    try:
+        cursor, limit = page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    logs, next_cursor = log_store.query(cursor=cursor, limit=limit, **filters)
+    return render_template(
+        'logs.html',
+        logs=logs,
+        next_cursor=next_cursor,
+        filters=filters,
+        limit=limit,
+        aggregates=log_store.aggregates(**filters),
+    )
+
+@app.route('/evaluations/aggregates')
+def evaluation_aggregates():
+    return jsonify(log_store.aggregates(**evaluation_filters()))
+
+@app.route('/evaluation/<log_id>')
+def evaluation_status(log_id):
+    # Polled by the chat UI until the background evaluation for a response is in
+    job = evaluation_queue.status(log_id)
+    if job is None:
+        # Not in this worker's queue (another worker, or a restart): read the log record
+        entry = log_store.get(log_id)
+        if entry is None:
+            return jsonify({'error': 'Unknown evaluation'}), 404
+        evaluation = entry.get("evaluation") or {}
+        status = evaluation.get("status", "failed" if evaluation.get("error") else "done")
+        return jsonify({"status": status, "evaluation": evaluation})
+    return jsonify(job)
+
+@app.route('/stats')
+def stats():
+    return jsonify({
+        # Local topic classifier hit rate and agreement with the classifier agent
+        "classifier": topic_classifier.stats.snapshot(),
+        # EPA WATERS point/COMID cache
+        "water_cache": get_water_cache().stats(),
+        # Prefetched service-area index in front of the cache (watershed_index.py)
+        "watershed_index": get_watershed_index().stats(),
+        # Local gazetteer lookups that gave the water agent its coordinates (gazetteer.py)
+        "gazetteer": get_gazetteer().stats(),
+        # Cached specialist answers (exact/semantic hit rate)
+        "response_cache": get_response_cache().stats(),
+        # Location verification agent calls vs. sticky/cached locations
+        "location": get_location_cache().snapshot(),
+        "sessions": session_store.stats(),
+        "evaluation_queue": evaluation_queue.stats(),
+        # Pooled AsyncOpenAI clients (openai_clients.py)
+        "openai_pool": openai_clients.pool_stats(),
+        # Turns in flight/queued/rejected and the per-model token buckets (admission.py)
+        "admission": admission.scheduler.stats(),
+        "model_rate_limits": admission.model_limiter.stats(),
+        # Single vs. speculative specialist dispatch and who won (specialist_router.py)
+        "routing": specialist_router.stats.snapshot(),
+        # Model per agent role and how often pre-routing escalated to a bigger model (model_profiles.py)
+        "model_profiles": model_profiles.stats.snapshot(),
+    })
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape endpoint: per-stage and end-to-end latency histograms
+    return Response(pipeline_tracing.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_response_cache():
+    # e.g. after changing a specialist prompt: {"topic": "food"}, or {} for everything
+    topic = (request.json or {}).get('topic')
+    removed = get_response_cache().invalidate(topic)
+    return jsonify({'topic': topic, 'removed': removed})
 
 @app.route('/about')
 def about():
     return render_template('about.html')
 
+async def evaluate_logged_response(data, offload_io=False):
+    """Score one logged response for /run_eval. Returns (payload, status)."""
+    record_id = data.get('id')
+    timestamp = data.get('timestamp')
+    query = data.get('query')
+    response = data.get('response')
+
+    if not all([record_id or timestamp, query, response]):
+        return {'error': 'Missing data'}, 400
+
+    # Run evaluation using OpenAI
+    usage = UsageCollector()
+    async with openai_clients.request_scope():
+        eval_json = await evaluate_response(openai_clients.get_openai_client(), query, response,
+                                            scale="five_point", usage=usage)
+    eval_json.update(usage_fields(usage))
+
+    # Update log
+    if record_id:
+        await call_io(offload_io, log_store.update_evaluation, record_id, eval_json)
+    else:
+        await call_io(offload_io, update_log_evaluation, timestamp, eval_json)
+
+    return eval_json, 200
+
 @app.route('/run_eval', methods=['POST'])
 async def run_eval():
     try:
-        data = request.json
-        timestamp = data.get('timestamp')
-        query = data.get('query')
-        response = data.get('response')
-        
-        if not all([timestamp, query, response]):
-            return jsonify({'error': 'Missing data'}), 400
-            
-        # Run evaluation using OpenAI
-        from openai import AsyncOpenAI
-        client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        
-        eval_prompt = f"""
-        You are an AI evaluator. Evaluate the following response to the user query.
-        
-        User Query: {query}
-        Bot Response: {response}
-        
-        Evaluate on:
-        1. Fairness (1-5): Is the response unbiased?
-        2. Accuracy (1-5): Does it seem factually sound based on the context?
-        3. Compliance (Yes/No): Did it follow instructions (e.g. was it brief if it was supposed to be)?
-        
-        Return JSON format:
-        {{
-            "fairness_score": float,
-            "accuracy_score": float,
-            "compliance": "string",
-            "explanation": "string"
-        }}
-        """
-        
-        completion = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": eval_prompt}],
-            response_format={"type": "json_object"}
-        )
-        
-        eval_result = completion.choices[0].message.content
-        import json
-        eval_json = json.loads(eval_result)
-        
-        # Update log
-        update_log_evaluation(timestamp, eval_json)
-        
-        return jsonify(eval_json)
+        payload, status = await evaluate_logged_response(request.json)
+        return jsonify(payload), status
 
     except Exception as e:
         print(e)
         return jsonify({'error': str(e)}), 500
 
+# batch_id -> BatchProgress for batches started from /run_eval_batch
+eval_batches = {}
+
+@app.route('/run_eval_batch', methods=['POST'])
+def run_eval_batch():
+    """
+    Re-score a filtered slice of the log in the background.
+    Body: {"since", "until", "topic", "session_id", "unevaluated_only", "limit"} (all optional).
+    Posting the same filters again resumes an interrupted batch from its checkpoint.
+    """
+    data = request.json or {}
+    try:
+        limit = int(data['limit']) if data.get('limit') not in (None, "") else None
+        concurrency = int(data.get('concurrency') or batch_eval.BATCH_EVAL_CONCURRENCY)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit and concurrency must be integers'}), 400
+    if (limit is not None and limit < 1) or concurrency < 1:
+        return jsonify({'error': 'limit and concurrency must be at least 1'}), 400
+    filters = {
+        "since": data.get('since'),
+        "until": data.get('until'),
+        "topic": data.get('topic'),
+        "session_id": data.get('session_id'),
+        "unevaluated_only": bool(data.get('unevaluated_only')),
+        "limit": limit,
+    }
+    batch_id = batch_eval.batch_id_for(filters)
+
+    running = eval_batches.get(batch_id)
+    if running and running.status == "running":
+        return jsonify(running.as_dict()), 202
+
+    progress = batch_eval.BatchProgress(batch_id, total=0, resumed=0)
+    eval_batches[batch_id] = progress
+
+    async def run_batch():
+        async with openai_clients.request_scope():
+            # Only the rows this batch needs, straight from the indexed store
+            logs = log_store.select_for_eval(**filters)
+            await batch_eval.run_batch(openai_clients.get_openai_client(), logs, update_log_evaluations,
+                                       filters, concurrency, progress)
+
+    def worker():
+        try:
+            asyncio.run(run_batch())
+        except Exception as e:
+            progress.status = "error"
+            progress.error = str(e)
+
+    threading.Thread(target=worker, name=f"batch-eval-{batch_id}", daemon=True).start()
+    return jsonify(progress.as_dict()), 202
+
+@app.route('/run_eval_batch/<batch_id>')
+def run_eval_batch_status(batch_id):
+    progress = eval_batches.get(batch_id)
+    if progress is None:
+        return jsonify({'error': 'Unknown batch'}), 404
+    return jsonify(progress.as_dict())
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
@@ -0,0 +1,139 @@
+"""
+ASGI entry point for production serving.
+
+`python app.py` runs Flask's dev server, where every async view gets a fresh
+event loop on a sync worker thread: pooled clients only live for one request
+and each in-flight chat holds a thread while it waits on the model. Here each
+uvicorn worker runs one long-lived event loop instead:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 4
+
+/chat, /chat_stream and /run_eval are served natively on that loop (same code
+as the Flask views, see chat_turn / chat_stream_events / evaluate_logged_response
+in app.py), with session and log I/O pushed to a thread pool so it doesn't
+block other requests. Every other route and the templates are the existing
+Flask app, mounted as WSGI.
+
+Startup opens the pooled OpenAI and EPA clients on the worker's loop and
+starts the evaluation queue; shutdown drains the queue and closes them.
+
+Needs `starlette` and `uvicorn` on top of the Flask requirements. Capacity
+numbers per worker: bench/capacity.py (see README).
+"""
+import asyncio
+import contextlib
+
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import admission
+import app as flask_app
+import epa_client
+import openai_clients
+
+
+async def read_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def chat(request: Request):
+    try:
+        data = await read_json(request)
+        user_message = data.get('message')
+        session_id = data.get('session_id', 'default')
+
+        if not user_message:
+            return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+        response_data = await flask_app.chat_turn(session_id, user_message, offload_io=True)
+        return JSONResponse(response_data)
+
+    except admission.Overloaded as e:
+        payload, status, headers = e.as_response()
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"Error processing request: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def chat_stream(request: Request):
+    data = await read_json(request)
+    user_message = data.get('message')
+    session_id = data.get('session_id', 'default')
+
+    if not user_message:
+        return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+    events = flask_app.chat_stream_events(session_id, user_message, offload_io=True)
+    try:
+        # "admitted" frame, or a 429/503 before the stream starts (see app.py)
+        first = await anext(events)
+    except admission.Overloaded as e:
+        await events.aclose()
+        payload, status, headers = e.as_response()
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    async def generate():
+        try:
+            yield first
+            async for chunk in events:
+                yield chunk
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield flask_app.sse("error", {"error": str(e)})
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+async def run_eval(request: Request):
+    try:
+        payload, status = await flask_app.evaluate_logged_response(await read_json(request), offload_io=True)
+        return JSONResponse(payload, status_code=status)
+    except Exception as e:
+        print(e)
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    # Created before the first request so request_scope() treats them as
+    # worker-scoped and every request shares the same pools
+    openai_clients.get_openai_client()
+    epa_client.get_epa_client()
+    flask_app.evaluation_queue.start()
+    try:
+        yield
+    finally:
+        # Blocking (waits for queued evaluations), so off the loop
+        await asyncio.to_thread(flask_app.evaluation_queue.stop)
+        await openai_clients.aclose_openai_client()
+        await epa_client.close_epa_client()
+        flask_app.session_store.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat_stream', chat_stream, methods=['POST']),
+        Route('/run_eval', run_eval, methods=['POST']),
+        # Everything else (pages, logs, stats, metrics, batch evals) is the Flask app
+        Mount('/', WSGIMiddleware(flask_app.app)),
+    ],
+    lifespan=lifespan,
+)
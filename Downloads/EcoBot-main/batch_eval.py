@@ -0,0 +1,204 @@
+"""
+Batch (re-)scoring of the conversation log.
+
+Selects log entries by date range / topic / session / unevaluated-only, fans
+the evaluator calls out with a concurrency limit, checkpoints every finished
+result so an interrupted run picks up where it left off, and commits all the
+updates to the log in a single write pass at the end.
+
+Used by the /run_eval_batch endpoint and from the command line:
+
+    python batch_eval.py --since 2026-01-01 --topic food --unevaluated-only
+"""
+import os
+import json
+import asyncio
+import hashlib
+import argparse
+import threading
+
+from evaluator import evaluate_response, usage_fields
+from usage_accounting import UsageCollector
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHECKPOINT_DIR = os.path.join(BASE_DIR, 'logs', 'batch_eval')
+BATCH_EVAL_CONCURRENCY = int(os.environ.get("ECOBOT_BATCH_EVAL_CONCURRENCY", "8"))
+
+# Metrics recorded at chat time that a re-score should keep
+METRIC_KEYS = ("cost", "latency", "fallback", "prompt_tokens", "cached_tokens", "completion_tokens", "total_tokens",
+               "tokens_saved", "usage_by_agent")
+
+
+def is_evaluated(log):
+    evaluation = log.get("evaluation") or {}
+    return "fairness_score" in evaluation and not evaluation.get("error")
+
+
+def select_logs(logs, since=None, until=None, topic=None, session_id=None, unevaluated_only=False, limit=None):
+    """Filter log entries. since/until are ISO dates or timestamps compared as strings."""
+    selected = []
+    for log in logs:
+        timestamp = log.get("timestamp") or ""
+        if since and timestamp < since:
+            continue
+        # A bare date as the upper bound should include that whole day
+        if until and timestamp[:len(until)] > until:
+            continue
+        if topic and log.get("topic") != topic:
+            continue
+        if session_id and log.get("session_id") != session_id:
+            continue
+        if unevaluated_only and is_evaluated(log):
+            continue
+        if not log.get("user_message") or not log.get("bot_response"):
+            continue
+        selected.append(log)
+        if limit and len(selected) >= limit:
+            break
+    return selected
+
+
+def batch_id_for(filters):
+    """Same filters -> same batch id -> same checkpoint, so re-running a batch resumes it."""
+    key = json.dumps({k: v for k, v in filters.items() if v not in (None, False, "")}, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+class Checkpoint:
+    """Append-only JSONL of {"id", "evaluation"} for every finished item. Keyed by record id: timestamps repeat."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def load(self):
+        done = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A half-written last line from an interrupted run
+                        continue
+                    if "id" in row:
+                        done[row["id"]] = row["evaluation"]
+        return done
+
+    def append(self, record_id, evaluation):
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({"id": record_id, "evaluation": evaluation}) + '\n')
+                f.flush()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BatchProgress:
+    def __init__(self, batch_id, total, resumed):
+        self.batch_id = batch_id
+        self.total = total
+        self.resumed = resumed
+        self.done = resumed
+        self.failed = 0
+        self.status = "running"
+        self.error = None
+
+    def as_dict(self):
+        return {
+            "batch_id": self.batch_id,
+            "status": self.status,
+            "total": self.total,
+            "resumed": self.resumed,
+            "done": self.done,
+            "failed": self.failed,
+            "error": self.error,
+        }
+
+
+async def run_batch(client, logs, commit, filters, concurrency=BATCH_EVAL_CONCURRENCY, progress=None):
+    """
+    Evaluate the selected logs and commit them with commit({record id: evaluation}).
+    `logs` can be the whole log or already narrowed down by the store
+    (LogStore.select_for_eval). Returns the BatchProgress. Items already in
+    the checkpoint are not re-scored.
+    """
+    batch_id = batch_id_for(filters)
+    checkpoint = Checkpoint(os.path.join(CHECKPOINT_DIR, f"{batch_id}.jsonl"))
+    results = checkpoint.load()
+
+    selected = select_logs(logs, **filters)
+    todo = [log for log in selected if log["id"] not in results]
+
+    if progress is None:
+        progress = BatchProgress(batch_id, len(selected), len(selected) - len(todo))
+    else:
+        progress.total, progress.resumed, progress.done = len(selected), len(selected) - len(todo), len(selected) - len(todo)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def score(log):
+        async with semaphore:
+            usage = UsageCollector()
+            try:
+                scores = await evaluate_response(client, log["user_message"], log["bot_response"], usage=usage)
+            except Exception as e:
+                progress.failed += 1
+                print(f"Batch evaluation failed for {log['id']} ({log['timestamp']}): {e}")
+                return
+        old = log.get("evaluation") or {}
+        evaluation = {**{k: old[k] for k in METRIC_KEYS if k in old}, **scores, **usage_fields(usage)}
+        results[log["id"]] = evaluation
+        checkpoint.append(log["id"], evaluation)
+        progress.done += 1
+
+    await asyncio.gather(*(score(log) for log in todo))
+
+    # One write pass for the whole batch
+    wanted = {log["id"] for log in selected}
+    commit({record_id: evaluation for record_id, evaluation in results.items() if record_id in wanted})
+
+    if progress.failed == 0:
+        checkpoint.remove()
+        progress.status = "done"
+    else:
+        # Keep the checkpoint; re-running the same filters retries only the failures
+        progress.status = "partial"
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score logged conversations in bulk.")
+    parser.add_argument("--since", help="ISO date/timestamp lower bound (inclusive)")
+    parser.add_argument("--until", help="ISO date/timestamp upper bound (inclusive)")
+    parser.add_argument("--topic")
+    parser.add_argument("--session-id")
+    parser.add_argument("--unevaluated-only", action="store_true")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--concurrency", type=int, default=BATCH_EVAL_CONCURRENCY)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    import openai_clients
+    from app import log_store, update_log_evaluations
+
+    filters = {
+        "since": args.since, "until": args.until, "topic": args.topic,
+        "session_id": args.session_id, "unevaluated_only": args.unevaluated_only, "limit": args.limit,
+    }
+
+    async def run():
+        async with openai_clients.request_scope():
+            return await run_batch(openai_clients.get_openai_client(), log_store.select_for_eval(**filters),
+                                   update_log_evaluations, filters, args.concurrency)
+
+    progress = asyncio.run(run())
+    print(json.dumps(progress.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
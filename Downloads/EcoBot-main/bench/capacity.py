@@ -0,0 +1,160 @@
+"""
+Capacity benchmark: how many concurrent /chat sessions one worker sustains.
+
+For each server (Flask dev server via app.py, uvicorn via asgi.py) this starts
+one app process against the stub model and EPA servers and runs a closed-loop
+sweep: at each level N, N sessions send their logged turns back to back for
+--duration seconds. Per level it reports throughput, latency percentiles and
+error rate. A worker's capacity is the highest level whose p95 stays within
+--slo-factor of the lowest level's p95 with under --max-error-rate errors.
+
+    python bench/capacity.py --servers flask,asgi --levels 1,4,16,32,64 --duration 30
+    python bench/capacity.py --servers asgi --levels 32,64,128,256 --latency-ms 1000
+
+The stub model's latency is what makes requests "wait on the model", so keep
+it realistic (--latency-ms, --tokens-per-sec). Results go to
+bench/results/capacity-<timestamp>.json unless --out is given.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import load  # noqa: E402
+import run_bench  # noqa: E402
+import stub_epa  # noqa: E402
+import stub_openai  # noqa: E402
+
+
+async def closed_loop(url, sessions, level, duration, stream=False):
+    """`level` sessions sending turns back to back until `duration` runs out."""
+    run = load.LoadRun(url, sessions, rps=1, duration=duration, concurrency=level, stream=stream)
+    deadline = time.perf_counter() + duration
+
+    async def session(client, index):
+        turns = sessions[index % len(sessions)]
+        while time.perf_counter() < deadline:
+            session_id = f"capacity-{uuid.uuid4().hex[:12]}"
+            for message in turns:
+                if time.perf_counter() >= deadline:
+                    return
+                await run.send(client, session_id, message)
+
+    limits = httpx.Limits(max_connections=level + 4, max_keepalive_connections=level + 4)
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=httpx.Timeout(300, connect=10), limits=limits) as client:
+        await asyncio.gather(*(session(client, i) for i in range(level)))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in run.results if r["ok"]]
+    done = run.results
+    return {
+        "sessions": level,
+        "requests": len(done),
+        "ok": len(ok),
+        "error_rate": round((len(done) - len(ok)) / len(done), 4) if done else 0.0,
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": load.percentiles([r["latency_ms"] for r in ok]),
+    }
+
+
+def capacity(levels, slo_factor, max_error_rate):
+    """Highest level that kept p95 within slo_factor of the baseline level's p95."""
+    baseline = next((level["latency_ms"]["p95"] for level in levels if level["latency_ms"]["p95"]), None)
+    best = None
+    for level in levels:
+        p95 = level["latency_ms"]["p95"]
+        if p95 is None or baseline is None:
+            continue
+        if p95 <= baseline * slo_factor and level["error_rate"] <= max_error_rate:
+            best = level["sessions"]
+    return best
+
+
+def sweep(server, args, openai_url, epa_url):
+    workdir = tempfile.mkdtemp(prefix=f"ecobot-capacity-{server}-")
+    port = run_bench.free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = run_bench.app_env(openai_url, epa_url, workdir, args.app_env)
+    process = run_bench.start_app(port, env, os.path.join(workdir, "app.log"), server)
+    sessions = load.load_sessions(args.log)
+    if not sessions:
+        raise SystemExit(f"No sessions to replay in {args.log}")
+
+    levels = []
+    try:
+        run_bench.wait_for(f"{url}/about", process=process)
+        for level in args.levels:
+            result = asyncio.run(closed_loop(url, sessions, level, args.duration, args.stream))
+            print(f"{server:6} {level:5} sessions  {result['throughput_rps']:8.2f} rps  "
+                  f"p50 {result['latency_ms']['p50']} ms  p95 {result['latency_ms']['p95']} ms  "
+                  f"errors {result['error_rate']:.2%}")
+            levels.append(result)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    return {"levels": levels, "capacity_sessions": capacity(levels, args.slo_factor, args.max_error_rate),
+            "workdir": workdir}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent /chat sessions per worker, Flask vs. ASGI.")
+    parser.add_argument("--servers", default="flask,asgi")
+    parser.add_argument("--levels", default="1,4,16,32,64", help="concurrent sessions to try, in order")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--stream", action="store_true", help="use /chat_stream instead of /chat")
+    parser.add_argument("--slo-factor", type=float, default=1.5,
+                        help="p95 allowed relative to the lowest level's p95")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--log", default=load.DEFAULT_LOG)
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--tokens-per-sec", type=float, default=80)
+    parser.add_argument("--output-tokens", type=int, default=300)
+    parser.add_argument("--handshake-ms", type=float, default=50)
+    parser.add_argument("--epa-latency-ms", type=float, default=250)
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--out")
+    args = parser.parse_args(argv)
+    args.levels = [int(level) for level in args.levels.split(",")]
+
+    openai_url = run_bench.serve_in_thread(stub_openai.make_server(
+        latency_ms=args.latency_ms, tokens_per_sec=args.tokens_per_sec,
+        output_tokens=args.output_tokens, handshake_ms=args.handshake_ms,
+    ))
+    epa_url = run_bench.serve_in_thread(stub_epa.make_server(latency_ms=args.epa_latency_ms))
+
+    results = {
+        "started_at": datetime.now().isoformat(),
+        "config": {"levels": args.levels, "duration": args.duration, "stream": args.stream,
+                   "slo_factor": args.slo_factor, "max_error_rate": args.max_error_rate,
+                   "latency_ms": args.latency_ms, "tokens_per_sec": args.tokens_per_sec,
+                   "output_tokens": args.output_tokens, "handshake_ms": args.handshake_ms,
+                   "epa_latency_ms": args.epa_latency_ms, "app_env": args.app_env},
+        "servers": {},
+    }
+    for server in args.servers.split(","):
+        results["servers"][server] = sweep(server, args, openai_url, epa_url)
+
+    out = args.out or os.path.join(BENCH_DIR, "results", f"capacity-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    for server, result in results["servers"].items():
+        print(f"{server}: capacity {result['capacity_sessions']} concurrent sessions per worker")
+    print(f"Results: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Connection reuse benchmark for openai_clients.py.
+
+Sends the same model calls against the stub OpenAI server three ways and
+counts how many connections (and simulated handshakes) each one opens:
+
+  per_call     a new AsyncOpenAI for every call (what /run_eval and the
+               agents' default provider used to do)
+  per_request  one pooled client per turn on its own event loop (Flask's
+               per-request loops with the registry)
+  shared       one pooled client on a long-lived loop (the evaluation
+               queue, or an ASGI server)
+
+A turn is --calls-per-turn calls in a row, like location + classifier +
+specialist in one /chat request.
+
+    python bench/client_pool.py --turns 50 --handshake-ms 80
+    python bench/client_pool.py --base-url https://api.openai.com/v1 --turns 10   # real API, costs money
+
+Results go to bench/results/client_pool-<timestamp>.json unless --out is given.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from datetime import datetime
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import load  # noqa: E402
+import stub_openai  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "How much CO2 does a 20 mile commute produce?"}]
+
+
+async def call(client, model):
+    start = time.perf_counter()
+    await client.chat.completions.create(model=model, messages=MESSAGES)
+    return (time.perf_counter() - start) * 1000
+
+
+async def per_call_turn(calls, model):
+    import openai_clients
+    timings = []
+    for _ in range(calls):
+        client = openai_clients.create_openai_client()
+        try:
+            timings.append(await call(client, model))
+        finally:
+            await client.close()
+    return timings
+
+
+async def per_request_turn(calls, model):
+    import openai_clients
+    async with openai_clients.request_scope():
+        client = openai_clients.get_openai_client()
+        return [await call(client, model) for _ in range(calls)]
+
+
+def run_mode(mode, turns, calls, concurrency, model):
+    """Latencies (ms) of every call, running `concurrency` turns at a time."""
+    import openai_clients
+    timings = []
+    lock = threading.Lock()
+
+    if mode == "shared":
+        async def shared():
+            client = openai_clients.get_openai_client()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def turn():
+                async with semaphore:
+                    timings.extend([await call(client, model) for _ in range(calls)])
+
+            await asyncio.gather(*(turn() for _ in range(turns)))
+            await openai_clients.aclose_openai_client()
+
+        asyncio.run(shared())
+        return timings
+
+    # Every turn gets its own event loop, like a Flask async view
+    turn_fn = per_call_turn if mode == "per_call" else per_request_turn
+    remaining = list(range(turns))
+
+    def worker():
+        while True:
+            with lock:
+                if not remaining:
+                    return
+                remaining.pop()
+            result = asyncio.run(turn_fn(calls, model))
+            with lock:
+                timings.extend(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings
+
+
+def connections(stats_url):
+    if not stats_url:
+        return None
+    return httpx.get(stats_url, timeout=5).json()["connections"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pooled vs. per-call OpenAI clients.")
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--calls-per-turn", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--modes", default="per_call,per_request,shared")
+    parser.add_argument("--handshake-ms", type=float, default=80, help="stub delay per new connection")
+    parser.add_argument("--latency-ms", type=float, default=50, help="stub time per call")
+    parser.add_argument("--base-url", help="use a real endpoint instead of the stub")
+    parser.add_argument("--out")
+    args = parser.parse_args(argv)
+
+    stats_url = None
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+    else:
+        server = stub_openai.make_server(latency_ms=args.latency_ms, tokens_per_sec=10_000,
+                                         handshake_ms=args.handshake_ms)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        os.environ["OPENAI_BASE_URL"] = f"{base}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "bench-stub")
+        stats_url = f"{base}/stats"
+
+    results = {"turns": args.turns, "calls_per_turn": args.calls_per_turn, "concurrency": args.concurrency,
+               "handshake_ms": None if args.base_url else args.handshake_ms,
+               "latency_ms": None if args.base_url else args.latency_ms,
+               "base_url": os.environ["OPENAI_BASE_URL"], "modes": {}}
+    for mode in args.modes.split(","):
+        before = connections(stats_url)
+        start = time.perf_counter()
+        timings = run_mode(mode, args.turns, args.calls_per_turn, args.concurrency, args.model)
+        elapsed = time.perf_counter() - start
+        after = connections(stats_url)
+        results["modes"][mode] = {
+            "calls": len(timings),
+            "elapsed_s": round(elapsed, 2),
+            "calls_per_sec": round(len(timings) / elapsed, 2) if elapsed else None,
+            "connections_opened": None if before is None else after - before,
+            "call_ms": load.percentiles(timings),
+        }
+        print(f"{mode:12} {json.dumps(results['modes'][mode])}")
+
+    out = args.out or os.path.join(BENCH_DIR, "results", f"client_pool-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    print(f"Results: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Load generator: replays logged sessions against a running EcoBot.
+
+Sessions are rebuilt from logs/conversations.jsonl (entries grouped by
+session_id, split where the gap between turns is over --session-gap seconds)
+and replayed under fresh session ids. Turns within a session are sent in
+order; new turns are started at --rps, with at most --concurrency sessions in
+flight. Per-stage numbers come from the app's /metrics histograms, scraped
+before and after the run.
+
+    python bench/load.py --url http://127.0.0.1:5001 --rps 2 --duration 60 --out results.json
+    python bench/load.py --compare bench/results/old.json bench/results/new.json
+
+Results are JSON (see `summarize`), so runs can be diffed between releases.
+bench/run_bench.py starts the stub servers and the app and calls this.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from datetime import datetime
+
+import httpx
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LOG = os.path.join(BASE_DIR, 'logs', 'conversations.jsonl')
+
+_METRIC_LINE = re.compile(r'^(\w+)\{(.*)\}\s+([0-9.eE+-]+|\+Inf)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def load_sessions(path=DEFAULT_LOG, session_gap=1800):
+    """List of sessions, each a list of user messages in order."""
+    by_session = {}
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("user_message"):
+                by_session.setdefault(entry.get("session_id") or "default", []).append(entry)
+
+    sessions = []
+    for entries in by_session.values():
+        entries.sort(key=lambda e: e.get("timestamp") or "")
+        current, last = [], None
+        for entry in entries:
+            try:
+                ts = datetime.fromisoformat(entry["timestamp"]).timestamp()
+            except (KeyError, ValueError):
+                ts = last
+            if current and last is not None and ts is not None and ts - last > session_gap:
+                sessions.append(current)
+                current = []
+            current.append(entry["user_message"])
+            last = ts
+        if current:
+            sessions.append(current)
+    return sessions
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+            "mean": round(sum(ordered) / len(ordered), 1), "max": round(ordered[-1], 1)}
+
+
+def parse_metrics(text):
+    """{(name, frozenset(labels)): value} from Prometheus text format."""
+    samples = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line.strip())
+        if match:
+            name, labels, value = match.groups()
+            samples[(name, frozenset(_LABEL.findall(labels)))] = float(value)
+    return samples
+
+
+def stage_summary(before, after):
+    """Per-stage count, percentile estimates (ms) and errors from two /metrics scrapes."""
+    buckets, errors = {}, {}
+    for (name, labels), value in after.items():
+        delta = value - before.get((name, labels), 0)
+        labels = dict(labels)
+        if name == "ecobot_stage_duration_seconds_bucket":
+            le = float("inf") if labels["le"] == "+Inf" else float(labels["le"])
+            stage = buckets.setdefault(labels["stage"], {})
+            stage[le] = stage.get(le, 0) + delta
+        elif name == "ecobot_stage_errors_total":
+            errors[labels["stage"]] = errors.get(labels["stage"], 0) + delta
+
+    summary = {}
+    for stage, counts in buckets.items():
+        bounds = sorted(counts)
+        total = counts[float("inf")]
+        if total <= 0:
+            continue
+
+        def estimate(q):
+            # Linear interpolation inside the bucket holding the q-th observation
+            target, lower, below = q * total, 0.0, 0
+            for bound in bounds:
+                if counts[bound] >= target:
+                    if bound == float("inf"):
+                        return round(lower * 1000, 1)
+                    inside = counts[bound] - below
+                    frac = (target - below) / inside if inside else 1.0
+                    return round((lower + (bound - lower) * frac) * 1000, 1)
+                lower, below = bound, counts[bound]
+            return None
+
+        summary[stage] = {
+            "count": int(total),
+            "p50_ms": estimate(0.50), "p95_ms": estimate(0.95), "p99_ms": estimate(0.99),
+            "errors": int(errors.get(stage, 0)),
+            "error_rate": round(errors.get(stage, 0) / total, 4),
+        }
+    return summary
+
+
+class LoadRun:
+    def __init__(self, url, sessions, rps, duration, concurrency, stream=False, max_turns=None):
+        self.url = url.rstrip("/")
+        self.sessions = sessions
+        self.rps = rps
+        self.duration = duration
+        self.concurrency = concurrency
+        self.stream = stream
+        self.max_turns = max_turns
+        self.results = []
+        self.in_flight = 0
+        self.dropped = 0
+
+    async def send(self, client, session_id, message):
+        record = {"session_id": session_id, "ok": False}
+        start = time.perf_counter()
+        try:
+            if self.stream:
+                async with client.stream("POST", f"{self.url}/chat_stream",
+                                         json={"message": message, "session_id": session_id}) as resp:
+                    record["status"] = resp.status_code
+                    event = None
+                    async for line in resp.aiter_lines():
+                        if line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:") and event == "delta" and "ttft_ms" not in record:
+                            record["ttft_ms"] = (time.perf_counter() - start) * 1000
+                        elif line.startswith("data:") and event == "done":
+                            data = json.loads(line[5:])
+                            record.update(ok=True, topic=data.get("topic"), cache=data.get("cache"))
+                        elif line.startswith("data:") and event == "error":
+                            record["error"] = json.loads(line[5:]).get("error")
+            else:
+                resp = await client.post(f"{self.url}/chat", json={"message": message, "session_id": session_id})
+                record["status"] = resp.status_code
+                data = resp.json()
+                record.update(ok=resp.status_code == 200 and "error" not in data,
+                              topic=data.get("topic"), cache=data.get("cache"), error=data.get("error"))
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["latency_ms"] = (time.perf_counter() - start) * 1000
+        self.results.append(record)
+        return record
+
+    async def replay(self, client, turns, slots, tick):
+        session_id = f"bench-{uuid.uuid4().hex[:12]}"
+        try:
+            for message in turns:
+                await tick.get()
+                self.in_flight += 1
+                try:
+                    await self.send(client, session_id, message)
+                finally:
+                    self.in_flight -= 1
+        finally:
+            slots.release()
+
+    async def run(self):
+        tick = asyncio.Queue()
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        sent = 0
+        self.started = time.perf_counter()
+
+        async with httpx.AsyncClient(timeout=httpx.Timeout(300, connect=10)) as client:
+            async def spawn_sessions():
+                index = 0
+                while True:
+                    await slots.acquire()
+                    tasks.append(asyncio.create_task(
+                        self.replay(client, self.sessions[index % len(self.sessions)], slots, tick)
+                    ))
+                    index += 1
+
+            spawner = asyncio.create_task(spawn_sessions())
+            # Release one turn every 1/rps seconds; sessions pick them up in order
+            while time.perf_counter() - self.started < self.duration:
+                if self.max_turns and sent >= self.max_turns:
+                    break
+                tick.put_nowait(None)
+                sent += 1
+                await asyncio.sleep(1 / self.rps)
+            spawner.cancel()
+            # Turns no session was free to pick up count as dropped
+            self.dropped = tick.qsize()
+            while not tick.empty():
+                tick.get_nowait()
+            # Let in-flight turns finish, then stop sessions waiting for their next turn
+            while self.in_flight:
+                await asyncio.sleep(0.1)
+            self.elapsed = time.perf_counter() - self.started
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.offered = sent
+
+
+def summarize(run, stages, config):
+    done = run.results
+    ok = [r for r in done if r["ok"]]
+    errors = {}
+    for r in done:
+        if not r["ok"]:
+            key = str(r.get("status") or (r.get("error") or "error").split(":")[0])
+            errors[key] = errors.get(key, 0) + 1
+    by_topic = {}
+    for r in ok:
+        by_topic.setdefault(r.get("topic") or "", []).append(r["latency_ms"])
+    return {
+        "config": config,
+        "started_at": datetime.now().isoformat(),
+        "duration_s": round(run.elapsed, 2),
+        "offered_turns": run.offered,
+        "dropped_turns": run.dropped,
+        "requests": len(done),
+        "ok": len(ok),
+        "errors": errors,
+        "error_rate": round((len(done) - len(ok)) / len(done), 4) if done else 0.0,
+        "throughput_rps": round(len(ok) / run.elapsed, 3) if run.elapsed else 0.0,
+        "latency_ms": percentiles([r["latency_ms"] for r in ok]),
+        "ttft_ms": percentiles([r["ttft_ms"] for r in ok if "ttft_ms" in r]),
+        "cache_hits": sum(1 for r in ok if r.get("cache")),
+        "by_topic": {topic: percentiles(values) for topic, values in by_topic.items()},
+        "stages": stages,
+    }
+
+
+async def scrape(url):
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            resp = await client.get(f"{url.rstrip('/')}/metrics")
+            return parse_metrics(resp.text) if resp.status_code == 200 else {}
+    except httpx.HTTPError:
+        return {}
+
+
+async def run_load(url, rps=1.0, duration=60, concurrency=8, stream=False, log=DEFAULT_LOG,
+                   session_gap=1800, max_turns=None):
+    sessions = load_sessions(log, session_gap)
+    if not sessions:
+        raise SystemExit(f"No sessions to replay in {log}")
+    before = await scrape(url)
+    run = LoadRun(url, sessions, rps, duration, concurrency, stream, max_turns)
+    await run.run()
+    after = await scrape(url)
+    config = {"url": url, "rps": rps, "duration": duration, "concurrency": concurrency,
+              "stream": stream, "sessions": len(sessions), "log": log}
+    return summarize(run, stage_summary(before, after), config)
+
+
+def compare(old, new):
+    """Print the headline numbers of two result files side by side."""
+    rows = [("throughput_rps", old["throughput_rps"], new["throughput_rps"]),
+            ("error_rate", old["error_rate"], new["error_rate"])]
+    for key in ("p50", "p95", "p99"):
+        rows.append((f"latency {key} ms", old["latency_ms"][key], new["latency_ms"][key]))
+    for stage in sorted(set(old["stages"]) | set(new["stages"])):
+        a, b = old["stages"].get(stage, {}), new["stages"].get(stage, {})
+        rows.append((f"{stage} p95 ms", a.get("p95_ms"), b.get("p95_ms")))
+    print(f"{'metric':32} {'old':>12} {'new':>12} {'change':>9}")
+    for name, a, b in rows:
+        change = f"{(b - a) / a * 100:+.1f}%" if isinstance(a, (int, float)) and isinstance(b, (int, float)) and a else ""
+        print(f"{name:32} {str(a):>12} {str(b):>12} {change:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay logged sessions against EcoBot and report latency.")
+    parser.add_argument("--url", default="http://127.0.0.1:5001")
+    parser.add_argument("--rps", type=float, default=1.0, help="target turns per second")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to offer load for")
+    parser.add_argument("--concurrency", type=int, default=8, help="max sessions in flight")
+    parser.add_argument("--stream", action="store_true", help="use /chat_stream instead of /chat")
+    parser.add_argument("--log", default=DEFAULT_LOG)
+    parser.add_argument("--session-gap", type=float, default=1800)
+    parser.add_argument("--max-turns", type=int)
+    parser.add_argument("--out", help="write the results JSON here")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as a, open(args.compare[1]) as b:
+            compare(json.load(a), json.load(b))
+        return
+
+    results = asyncio.run(run_load(args.url, args.rps, args.duration, args.concurrency, args.stream,
+                                   args.log, args.session_gap, args.max_turns))
+    output = json.dumps(results, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Model profile benchmark: pre-routing latency, cost and agreement per profile set.
+
+Runs the location verification and topic classifier agents on the logged
+user messages once per profile set (see model_profiles.py), the way
+run_pre_routing does (both concurrently, with the escalation policy), and
+reports per set:
+
+  - latency percentiles per agent and for the pair (what a turn waits)
+  - cost per query from the real usage numbers, and the total
+  - how often each agent escalated or failed outright
+  - agreement with the first set on topic and location
+
+Profile sets: "legacy" (gpt-4.1 everywhere, as before profiles), "default"
+(DEFAULT_PROFILES), "env" (ECOBOT_MODEL_PROFILES) or NAME=path/to/profiles.json.
+
+    python bench/model_tiers.py --profiles legacy,default --limit 200
+    python bench/model_tiers.py --profiles legacy,default,mini=bench/mini.json --base-url https://api.openai.com/v1
+
+Without --base-url it runs against the stub model server, whose per-model
+latencies and malformed-JSON rates (--model-latency-ms, --malformed-rate)
+stand in for the real ones - good for checking the escalation path, but
+only the real API gives numbers worth comparing. That costs money and
+needs OPENAI_API_KEY. Results go to bench/results/model_tiers-<timestamp>.json
+unless --out is given.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import load  # noqa: E402
+import stub_openai  # noqa: E402
+
+DEFAULT_STUB_LATENCY = ["gpt-4.1-nano=150", "gpt-4.1-mini=250", "gpt-4.1=450"]
+DEFAULT_STUB_MALFORMED = ["gpt-4.1-nano=0.03"]
+
+
+def logged_queries(path, limit):
+    seen, queries = set(), []
+    for session in load.load_sessions(path):
+        for message in session:
+            if message not in seen:
+                seen.add(message)
+                queries.append(message)
+    return queries[:limit] if limit else queries
+
+
+def profile_set(spec):
+    import model_profiles
+    name, _, path = spec.partition("=")
+    if name == "legacy":
+        return name, {role: dict(p) for role, p in model_profiles.LEGACY_PROFILES.items()}
+    if name == "default":
+        return name, model_profiles.load_profiles("")
+    if name == "env":
+        return name, model_profiles.load_profiles()
+    if not path:
+        raise SystemExit(f"Unknown profile set {spec!r}; use legacy, default, env or NAME=file.json")
+    return name, model_profiles.load_profiles(path)
+
+
+async def run_query(text, agents, profiles, run_config):
+    import model_profiles
+    from usage_accounting import UsageCollector
+
+    usage = UsageCollector()
+    pre_routing_input = [{"role": "user", "content": [{"type": "input_text", "text": text}]}]
+
+    async def timed(role, agent):
+        start = time.perf_counter()
+        try:
+            answered, result = await model_profiles.run_structured(agent, role, pre_routing_input, run_config,
+                                                                   usage, profiles)
+        except Exception as e:
+            return {"ms": (time.perf_counter() - start) * 1000, "error": str(e)}
+        usage.add_run(answered, result)
+        return {"ms": (time.perf_counter() - start) * 1000, "model": answered.model,
+                "escalated": answered is not agent, "output": result.final_output.model_dump()}
+
+    start = time.perf_counter()
+    location, classifier = await asyncio.gather(timed("location", agents["location"]),
+                                                timed("classifier", agents["classifier"]))
+    return {"query": text, "ms": (time.perf_counter() - start) * 1000, "cost": usage.as_dict()["cost"],
+            "location": location, "classifier": classifier}
+
+
+async def run_profile_set(queries, profiles, concurrency):
+    import model_profiles
+    import openai_clients
+    import test
+
+    agents = {
+        "location": model_profiles.configure(test.location_verification, "location", profiles=profiles),
+        "classifier": model_profiles.configure(test.topic_classifier_agent, "classifier", profiles=profiles),
+    }
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(text):
+        async with slots:
+            return await run_query(text, agents, profiles, test.workflow_run_config())
+
+    try:
+        return await asyncio.gather(*(one(text) for text in queries))
+    finally:
+        await openai_clients.aclose_openai_client()
+
+
+def summarize(runs, baseline=None):
+    summary = {"queries": len(runs), "turn_ms": load.percentiles([r["ms"] for r in runs]),
+               "cost_per_query": round(sum(r["cost"] for r in runs) / len(runs), 6) if runs else 0.0,
+               "total_cost": round(sum(r["cost"] for r in runs), 6)}
+    for role in ("location", "classifier"):
+        calls = [r[role] for r in runs]
+        models = {}
+        for call in calls:
+            if "model" in call:
+                models[call["model"]] = models.get(call["model"], 0) + 1
+        summary[role] = {
+            "ms": load.percentiles([c["ms"] for c in calls if "error" not in c]),
+            "escalated": sum(1 for c in calls if c.get("escalated")),
+            "failed": sum(1 for c in calls if "error" in c),
+            "answered_by": models,
+        }
+
+    if baseline is not None:
+        def agreement(role, key, normalize=lambda v: (v or "").strip().lower()):
+            pairs = [(a[role].get("output"), b[role].get("output")) for a, b in zip(runs, baseline)]
+            pairs = [(a, b) for a, b in pairs if a is not None and b is not None]
+            if not pairs:
+                return None
+            return round(sum(1 for a, b in pairs if normalize(a.get(key)) == normalize(b.get(key))) / len(pairs), 4)
+
+        summary["agreement"] = {"topic": agreement("classifier", "classifier"),
+                                "location": agreement("location", "location")}
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare model profiles on the pre-routing agents.")
+    parser.add_argument("--profiles", default="legacy,default",
+                        help="comma-separated: legacy, default, env or NAME=profiles.json; the first is the baseline")
+    parser.add_argument("--log", default=load.DEFAULT_LOG)
+    parser.add_argument("--limit", type=int, default=200, help="logged queries to use (0 for all)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--base-url", help="use a real endpoint instead of the stub")
+    parser.add_argument("--latency-ms", type=float, default=400, help="stub latency for unlisted models")
+    parser.add_argument("--model-latency-ms", action="append", metavar="MODEL=MS")
+    parser.add_argument("--malformed-rate", action="append", metavar="MODEL=RATE")
+    parser.add_argument("--out")
+    args = parser.parse_args(argv)
+
+    queries = logged_queries(args.log, args.limit)
+    if not queries:
+        raise SystemExit(f"No logged queries in {args.log}")
+
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+        model_latency = malformed = None
+    else:
+        model_latency = args.model_latency_ms or DEFAULT_STUB_LATENCY
+        malformed = args.malformed_rate or DEFAULT_STUB_MALFORMED
+        server = stub_openai.make_server(latency_ms=args.latency_ms, tokens_per_sec=200,
+                                         model_latency_ms=stub_openai.parse_model_table(model_latency),
+                                         malformed_rate=stub_openai.parse_model_table(malformed))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "bench-stub")
+    os.environ.setdefault("OPENAI_AGENTS_DISABLE_TRACING", "1")
+
+    results = {"started_at": datetime.now().isoformat(), "base_url": os.environ["OPENAI_BASE_URL"],
+               "queries": len(queries), "stub_model_latency_ms": model_latency,
+               "stub_malformed_rate": malformed, "profiles": {}}
+    baseline = None
+    for spec in args.profiles.split(","):
+        name, profiles = profile_set(spec)
+        runs = asyncio.run(run_profile_set(queries, profiles, args.concurrency))
+        summary = summarize(runs, baseline)
+        baseline = runs if baseline is None else baseline
+        results["profiles"][name] = {"profiles": profiles, "summary": summary}
+        print(f"{name:10} p50 {summary['turn_ms']['p50']} ms  p95 {summary['turn_ms']['p95']} ms  "
+              f"${summary['cost_per_query']:.6f}/query  escalated {summary['location']['escalated']}"
+              f"+{summary['classifier']['escalated']}  agreement {summary.get('agreement')}")
+
+    out = args.out or os.path.join(BENCH_DIR, "results", f"model_tiers-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    print(f"Results: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+One-shot benchmark: stub OpenAI + stub EPA servers, the app pointed at them,
+and the load generator replaying logged sessions. Nothing is sent to OpenAI.
+
+    python bench/run_bench.py --rps 2 --duration 60
+    python bench/run_bench.py --rps 2 --duration 60 --stream --baseline bench/results/last-release.json
+    python bench/run_bench.py --app-env ECOBOT_RESPONSE_CACHE=0 --latency-ms 800 --tokens-per-sec 50
+    python bench/run_bench.py --server asgi --rps 5 --concurrency 32
+
+The app runs in a subprocess with its logs, log database and session store in
+a temp directory, so the real logs/ and all_responses.csv are untouched.
+Results go to bench/results/<timestamp>.json unless --out is given.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import load  # noqa: E402
+import stub_epa  # noqa: E402
+import stub_openai  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_in_thread(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# Started as `python -c APP_RUNNER port`; no reloader so the process we kill is the server
+APP_RUNNER = "import sys, app; app.app.run(host='127.0.0.1', port=int(sys.argv[1]), debug=False, threaded=True)"
+
+
+def app_command(server, port):
+    if server == "asgi":
+        # One worker, so the numbers are per worker (see asgi.py)
+        return [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", "1", "--no-access-log"]
+    return [sys.executable, "-c", APP_RUNNER, str(port)]
+
+
+def start_app(port, env, log_path, server="flask"):
+    log = open(log_path, "w")
+    return subprocess.Popen(app_command(server, port), cwd=BASE_DIR, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def app_env(openai_url, epa_url, workdir, extra=()):
+    """Environment for an app pointed at the stubs, with all its files in workdir."""
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "OPENAI_API_KEY": "bench-stub",
+        "OPENAI_AGENTS_DISABLE_TRACING": "1",
+        "EPA_WATERS_BASE_URL": epa_url,
+        "EPA_CACHE_DB": "",
+        "ECOBOT_SESSION_STORE": "memory",
+        "ECOBOT_LOG_DB": os.path.join(workdir, "conversations.sqlite3"),
+        "ECOBOT_LOG_FILE": os.path.join(workdir, "conversations.jsonl"),
+        "ECOBOT_CSV_LOG": os.path.join(workdir, "all_responses.csv"),
+        "ECOBOT_TRACE_FILE": os.path.join(workdir, "slow_traces.jsonl"),
+    }
+    for item in extra:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+def wait_for(url, timeout=60, process=None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"App exited with code {process.returncode} before it was ready")
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"{url} not ready after {timeout}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline EcoBot benchmark.")
+    parser.add_argument("--rps", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--log", default=load.DEFAULT_LOG, help="conversation log to replay")
+    parser.add_argument("--latency-ms", type=float, default=300, help="stub model time to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=80)
+    parser.add_argument("--output-tokens", type=int, default=500)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--handshake-ms", type=float, default=0, help="stub delay per new model connection")
+    parser.add_argument("--epa-latency-ms", type=float, default=250)
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the app (repeatable)")
+    parser.add_argument("--app-url", help="benchmark an already running app instead of starting one")
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask",
+                        help="Flask dev server (app.py) or uvicorn (asgi.py)")
+    parser.add_argument("--out")
+    parser.add_argument("--baseline", help="result file to compare against")
+    args = parser.parse_args(argv)
+
+    openai_url = serve_in_thread(stub_openai.make_server(
+        latency_ms=args.latency_ms, tokens_per_sec=args.tokens_per_sec,
+        output_tokens=args.output_tokens, error_rate=args.error_rate, handshake_ms=args.handshake_ms,
+    ))
+    epa_url = serve_in_thread(stub_epa.make_server(latency_ms=args.epa_latency_ms))
+
+    workdir = tempfile.mkdtemp(prefix="ecobot-bench-")
+    process = None
+    app_url = args.app_url
+    if app_url is None:
+        port = free_port()
+        app_url = f"http://127.0.0.1:{port}"
+        env = app_env(openai_url, epa_url, workdir, args.app_env)
+        process = start_app(port, env, os.path.join(workdir, "app.log"), args.server)
+
+    try:
+        wait_for(f"{app_url}/about", process=process)
+        results = asyncio.run(load.run_load(app_url, args.rps, args.duration, args.concurrency,
+                                            args.stream, args.log))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    results["stub"] = {"latency_ms": args.latency_ms, "tokens_per_sec": args.tokens_per_sec,
+                       "output_tokens": args.output_tokens, "error_rate": args.error_rate,
+                       "handshake_ms": args.handshake_ms,
+                       "epa_latency_ms": args.epa_latency_ms}
+    results["app_env"] = args.app_env
+    results["server"] = args.server
+    results["workdir"] = workdir
+
+    out = args.out or os.path.join(BENCH_DIR, "results", f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    print(json.dumps({k: results[k] for k in ("throughput_rps", "error_rate", "latency_ms", "stages")}, indent=2))
+    print(f"Results: {out} (app log and traces in {workdir})")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            load.compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
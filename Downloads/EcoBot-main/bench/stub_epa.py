@@ -0,0 +1,82 @@
+"""
+Stub EPA WATERS server for benchmarks.
+
+Serves the two calls epa_client.py makes:
+
+  GET /v4/upstreamdownstream  -> one stream feature with a COMID derived from the point
+  GET /v2_5/streamcat_json    -> a small StreamCat payload for that COMID
+
+    python bench/stub_epa.py --port 8102 --latency-ms 250
+
+Then run the app with EPA_WATERS_BASE_URL=http://127.0.0.1:8102.
+"""
+import json
+import time
+import random
+import argparse
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubEPAHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency_ms = 0
+    error_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        time.sleep(self.latency_ms / 1000)
+        if random.random() < self.error_rate:
+            self._json(503, {"error": "stub injected error"})
+            return
+
+        if url.path.rstrip("/") == "/v4/upstreamdownstream":
+            lon, lat = json.loads(params.get("start_point", "{}")).get("coordinates", [0, 0])
+            # Same ~1km cell -> same COMID, like real streams
+            comid = abs(hash((round(lat, 2), round(lon, 2)))) % 10_000_000
+            self._json(200, {"output": {"features": [
+                {"type": "Feature", "properties": {"comid": comid, "GNIS_NAME": "Stub Creek"}}
+            ]}})
+        elif url.path.rstrip("/") == "/v2_5/streamcat_json":
+            comid = params.get("comid")
+            self._json(200, {"items": [{
+                "comid": comid, "wsareasqkm": 812.4, "pcturbmd2019ws": 11.2,
+                "pctcrop2019ws": 54.7, "pctforest2019ws": 6.1, "runoffws": 121.0,
+            }]})
+        else:
+            self._json(404, {"error": "not found"})
+
+
+def make_server(port=0, latency_ms=0, error_rate=0.0):
+    handler = type("ConfiguredStubEPAHandler", (StubEPAHandler,), {"latency_ms": latency_ms, "error_rate": error_rate})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub EPA WATERS server.")
+    parser.add_argument("--port", type=int, default=8102)
+    parser.add_argument("--latency-ms", type=float, default=250)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.latency_ms, args.error_rate)
+    print(f"Stub EPA WATERS server on http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
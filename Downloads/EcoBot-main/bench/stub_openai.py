@@ -0,0 +1,296 @@
+"""
+Stub OpenAI server for benchmarks.
+
+Implements the two endpoints EcoBot calls:
+
+  POST /v1/responses         (agents library, streaming and non-streaming)
+  POST /v1/chat/completions  (the GPT-4o evaluator)
+
+Structured-output requests (location verification, topic classifier) get a
+JSON object built from the requested schema; everything else gets a markdown
+answer of roughly --output-tokens tokens ending in a chart block. Latency is
+--latency-ms to the first token plus output tokens / --tokens-per-sec, and
+--error-rate of requests fail with a 500. --model-latency-ms MODEL=MS
+overrides the first-token latency per model (prefix match, so small models
+can be made faster), and --malformed-rate MODEL=RATE makes that share of a
+model's structured outputs invalid JSON, for the escalation policy in
+model_profiles.py. Usage numbers are reported so the
+usage accounting sees realistic token counts. Each new connection waits
+--handshake-ms first, standing in for the TCP + TLS setup a real client pays,
+and GET /stats counts connections so pooling can be checked.
+
+    python bench/stub_openai.py --port 8101 --latency-ms 400 --tokens-per-sec 80
+
+Then point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8101/v1 (and
+OPENAI_AGENTS_DISABLE_TRACING=1 so no traces are exported).
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOPIC_WORDS = {
+    "water": ("water", "shower", "bath", "lawn", "drought", "river"),
+    "transport": ("drive", "car", "commute", "flight", "fly", "bus", "train", "mile"),
+    "energy": ("electric", "energy", "solar", "kwh", "heating", "bill", "power"),
+    "food": ("eat", "beef", "food", "meat", "chicken", "diet", "milk"),
+}
+
+FILLER = (
+    "Your choices add up over a year, and small changes make a measurable difference. "
+    "Compared with the national average this is on the higher side. "
+    "Switching part of the routine to a lower-impact option cuts emissions noticeably. "
+)
+
+
+class StubConfig:
+    def __init__(self, latency_ms=300, tokens_per_sec=80, output_tokens=500, error_rate=0.0, handshake_ms=0,
+                 model_latency_ms=None, malformed_rate=None):
+        self.latency_ms = latency_ms
+        self.model_latency_ms = model_latency_ms or {}
+        self.malformed_rate = malformed_rate or {}
+        self.handshake_ms = handshake_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.connections = 0
+
+    def for_model(self, table, model, default):
+        """Longest-prefix entry of a per-model table."""
+        for name in sorted(table, key=len, reverse=True):
+            if model.startswith(name):
+                return table[name]
+        return default
+
+    def count(self, key):
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+
+def estimate_tokens(value):
+    return max(1, len(json.dumps(value)) // 4)
+
+
+def last_user_text(body):
+    items = body.get("input") if "input" in body else body.get("messages")
+    if isinstance(items, str):
+        return items
+    for item in reversed(items or []):
+        if item.get("role") != "user":
+            continue
+        content = item.get("content")
+        if isinstance(content, str):
+            return content
+        return " ".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+    return ""
+
+
+def guess_topic(text):
+    text = text.lower()
+    for topic, words in TOPIC_WORDS.items():
+        if any(word in text for word in words):
+            return topic
+    return "food"
+
+
+def guess_location(text):
+    match = re.search(r"\b(?:in|from)\s+([a-z]+)", text.lower())
+    return f"{match.group(1).title()}, NE, USA" if match else ""
+
+
+def structured_output(schema, text):
+    result = {}
+    for name, prop in (schema.get("properties") or {}).items():
+        if name == "classifier":
+            result[name] = guess_topic(text)
+        elif name == "scores":
+            topic = guess_topic(text)
+            result[name] = {t: 1.0 if t == topic else 0.0 for t in TOPIC_WORDS}
+        elif name == "location":
+            result[name] = guess_location(text)
+        elif prop.get("type") in ("integer", "number"):
+            result[name] = 1
+        else:
+            result[name] = "stub"
+    return json.dumps(result)
+
+
+def specialist_answer(tokens):
+    words = (FILLER * (tokens // 40 + 1)).split()
+    body = " ".join(words[:max(10, int(tokens * 0.75) - 40)])
+    chart = {"chart": {"type": "bar", "labels": ["You", "Average"], "values": [120, 100],
+                       "label": "CO2 (kg)", "title": "Your Footprint vs Average"}}
+    return f"## Direct Answer\n{body}\n\n```json\n{json.dumps(chart)}\n```"
+
+
+def response_object(model, text, input_tokens, output_tokens, status="completed"):
+    message = {
+        "type": "message", "id": f"msg_{uuid.uuid4().hex}", "status": status, "role": "assistant",
+        "content": [{"type": "output_text", "text": text, "annotations": []}] if text is not None else [],
+    }
+    return {
+        "id": f"resp_{uuid.uuid4().hex}", "object": "response", "created_at": int(time.time()),
+        "status": status, "model": model, "output": [message] if text is not None else [],
+        "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+        "error": None, "incomplete_details": None, "instructions": None, "metadata": {},
+        "temperature": 1.0, "top_p": 1.0,
+        "usage": {
+            "input_tokens": input_tokens, "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens, "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None  # set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.config._lock:
+            self.config.connections += 1
+        time.sleep(self.config.handshake_ms / 1000)
+
+    def _json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._json(200, {"requests": dict(self.config.requests), "connections": self.config.connections})
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        model = body.get("model", "gpt-4.1")
+        self.config.count(f"{path} {model}")
+
+        if random.random() < self.config.error_rate:
+            self._json(500, {"error": {"message": "stub injected error", "type": "server_error"}})
+            return
+        if path.endswith("/responses"):
+            self.handle_responses(body, model)
+        elif path.endswith("/chat/completions"):
+            self.handle_chat_completions(body, model)
+        else:
+            self._json(404, {"error": {"message": f"unknown endpoint {path}"}})
+
+    def _output_for(self, body):
+        text_format = ((body.get("text") or {}).get("format") or {})
+        user_text = last_user_text(body)
+        if text_format.get("type") == "json_schema":
+            text = structured_output(text_format.get("schema") or {}, user_text)
+            if random.random() < self.config.for_model(self.config.malformed_rate, body.get("model", ""), 0.0):
+                text = text[:len(text) // 2]  # cut off like a max_tokens stop
+        else:
+            text = specialist_answer(self.config.output_tokens)
+        return text, estimate_tokens(body.get("input")) + estimate_tokens(body.get("instructions") or ""), estimate_tokens(text)
+
+    def handle_responses(self, body, model):
+        text, input_tokens, output_tokens = self._output_for(body)
+        time.sleep(self.config.for_model(self.config.model_latency_ms, model, self.config.latency_ms) / 1000)
+        if not body.get("stream"):
+            time.sleep(output_tokens / self.config.tokens_per_sec)
+            self._json(200, response_object(model, text, input_tokens, output_tokens))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        seq = iter(range(1_000_000))
+        final = response_object(model, text, input_tokens, output_tokens)
+        item = final["output"][0]
+        item_id = item["id"]
+
+        def send(event_type, **payload):
+            data = json.dumps({"type": event_type, "sequence_number": next(seq), **payload})
+            self.wfile.write(f"event: {event_type}\ndata: {data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send("response.created", response={**final, "status": "in_progress", "output": [], "usage": None})
+        send("response.output_item.added", output_index=0, item={**item, "status": "in_progress", "content": []})
+        send("response.content_part.added", item_id=item_id, output_index=0, content_index=0,
+             part={"type": "output_text", "text": "", "annotations": []})
+        # Roughly 4 tokens per delta, paced at the configured token rate
+        chunk = 16
+        for start in range(0, len(text), chunk):
+            time.sleep(4 / self.config.tokens_per_sec)
+            send("response.output_text.delta", item_id=item_id, output_index=0, content_index=0,
+                 delta=text[start:start + chunk], logprobs=[])
+        send("response.output_text.done", item_id=item_id, output_index=0, content_index=0, text=text, logprobs=[])
+        send("response.content_part.done", item_id=item_id, output_index=0, content_index=0,
+             part=item["content"][0])
+        send("response.output_item.done", output_index=0, item=item)
+        send("response.completed", response=final)
+
+    def handle_chat_completions(self, body, model):
+        text = json.dumps({"fairness_score": 85, "accuracy_score": 80, "compliance": "Yes",
+                           "explanation": "Stub evaluation."})
+        input_tokens, output_tokens = estimate_tokens(body.get("messages")), estimate_tokens(text)
+        time.sleep(self.config.latency_ms / 1000 + output_tokens / self.config.tokens_per_sec)
+        self._json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens},
+        })
+
+
+def parse_model_table(pairs):
+    """["gpt-4.1-nano=120", ...] -> {"gpt-4.1-nano": 120.0}"""
+    table = {}
+    for pair in pairs:
+        model, _, value = pair.partition("=")
+        table[model] = float(value)
+    return table
+
+
+def make_server(port=0, **config):
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": StubConfig(**config)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI Responses/Chat Completions server.")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--latency-ms", type=float, default=300, help="time to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=80)
+    parser.add_argument("--output-tokens", type=int, default=500, help="length of specialist answers")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--handshake-ms", type=float, default=0, help="delay on each new connection")
+    parser.add_argument("--model-latency-ms", action="append", default=[], metavar="MODEL=MS")
+    parser.add_argument("--malformed-rate", action="append", default=[], metavar="MODEL=RATE")
+    args = parser.parse_args()
+
+    server = make_server(args.port, latency_ms=args.latency_ms, tokens_per_sec=args.tokens_per_sec,
+                         output_tokens=args.output_tokens, error_rate=args.error_rate,
+                         handshake_ms=args.handshake_ms, model_latency_ms=parse_model_table(args.model_latency_ms),
+                         malformed_rate=parse_model_table(args.malformed_rate))
+    print(f"Stub OpenAI server on http://127.0.0.1:{server.server_address[1]}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
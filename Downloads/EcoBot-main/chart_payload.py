@@ -0,0 +1,112 @@
+"""
+Chart extraction for specialist answers.
+
+The specialist prompts ask the model to append a ```json {"chart": {...}}```
+block at the very end of its answer. index.html used to find that block with
+two regexes over the whole response and fell over on anything malformed.
+run_workflow now pulls it out here instead: the block is located, parsed,
+validated against `Chart`, and stripped from the text, and the chart goes back
+as its own `chart` field (None if there wasn't a usable one).
+
+A block that mentions "chart" but doesn't parse or validate is still stripped,
+so users never see raw JSON at the end of an answer.
+"""
+import re
+import json
+from typing import Literal
+
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+
+# Fenced ```json blocks; the chart one is normally the last
+FENCED_JSON = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+
+MAX_POINTS = 20
+
+
+class Chart(BaseModel):
+    type: Literal["bar", "line", "pie", "doughnut"] = "bar"
+    labels: list[str] = Field(min_length=1, max_length=MAX_POINTS)
+    values: list[float] = Field(min_length=1, max_length=MAX_POINTS)
+    label: str = ""
+    title: str = ""
+
+    @field_validator("type", mode="before")
+    @classmethod
+    def lowercase_type(cls, value):
+        return value.lower().strip() if isinstance(value, str) else value
+
+    @field_validator("values", mode="before")
+    @classmethod
+    def strip_units(cls, values):
+        # The model sometimes writes "120 kg" or "1,200" instead of a number
+        if not isinstance(values, list):
+            return values
+        cleaned = []
+        for value in values:
+            if isinstance(value, str):
+                match = re.search(r"-?\d+(?:\.\d+)?", value.replace(",", ""))
+                value = float(match.group()) if match else value
+            cleaned.append(value)
+        return cleaned
+
+    @model_validator(mode="after")
+    def same_length(self):
+        if len(self.labels) != len(self.values):
+            raise ValueError(f"{len(self.labels)} labels but {len(self.values)} values")
+        return self
+
+
+def _trailing_object(text):
+    """A bare {...} at the very end of the text (no code fence), as (start, parsed) or None."""
+    stripped = text.rstrip()
+    if not stripped.endswith("}"):
+        return None
+    decoder = json.JSONDecoder()
+    # Walk back through the opening braces until one parses to the end
+    start = stripped.rfind("{")
+    while start != -1:
+        try:
+            parsed, end = decoder.raw_decode(stripped, start)
+        except json.JSONDecodeError:
+            parsed, end = None, -1
+        if end == len(stripped) and isinstance(parsed, dict) and "chart" in parsed:
+            return start, parsed
+        start = stripped.rfind("{", 0, start)
+    return None
+
+
+def extract_chart(text):
+    """
+    Returns (text_without_chart_block, chart_dict_or_None).
+    chart_dict is a validated Chart dumped to plain JSON types.
+    """
+    if not text or "chart" not in text:
+        return text, None
+
+    block, payload = None, None
+    for match in FENCED_JSON.finditer(text):
+        if '"chart"' in match.group(1):
+            block = match
+    if block is not None:
+        span = block.span()
+        try:
+            payload = json.loads(block.group(1))
+        except json.JSONDecodeError as e:
+            print(f"Chart block isn't valid JSON: {e}")
+    else:
+        trailing = _trailing_object(text)
+        if trailing is None:
+            return text, None
+        start, payload = trailing
+        span = (start, len(text))
+
+    cleaned = (text[:span[0]] + text[span[1]:]).strip()
+
+    if not isinstance(payload, dict) or not isinstance(payload.get("chart"), dict):
+        return cleaned, None
+    try:
+        chart = Chart.model_validate(payload["chart"])
+    except ValidationError as e:
+        print(f"Dropping invalid chart: {e.errors()[0].get('msg')}")
+        return cleaned, None
+    return cleaned, chart.model_dump(mode="json")
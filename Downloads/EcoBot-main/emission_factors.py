@@ -0,0 +1,288 @@
+"""
+Local emissions-factor dataset and calculator.
+
+The food, energy and transport agents used to work out every CO2 figure from
+the EPA/EIA/OWID pages in their instructions, so each detailed answer spent
+tokens re-deriving the same factors (and sometimes got them wrong). The
+factors now live in data/emission_factors.json:
+
+    food         kg CO2e per kg, per food (Poore & Nemecek via OWID)
+    fuel         kg CO2 per gallon / therm (EPA equivalencies, EIA)
+    electricity  kg CO2 per kWh by eGRID subregion, with a state -> subregion map
+    transport    kg CO2 per vehicle- or passenger-mile (EPA GHG Factors Hub);
+                 electric cars use kWh/mile x the local grid factor
+
+and the agents call calculate_emissions (a function_tool in test.py), which
+multiplies a whole list of activities against them in one vectorized step.
+Every result carries the dataset version and the source of each factor so
+the answer can cite it.
+
+The file is versioned: bump "version" when updating the numbers. Point
+ECOBOT_EMISSION_FACTORS at another file to try a new version. Works without
+numpy, just slower for big batches.
+"""
+import os
+import re
+import json
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMISSION_FACTORS_PATH = os.environ.get("ECOBOT_EMISSION_FACTORS", os.path.join(BASE_DIR, 'data', 'emission_factors.json'))
+
+# unit -> (dimension, size in the dimension's base unit)
+UNITS = {
+    "kg": ("mass", 1.0), "g": ("mass", 0.001), "lb": ("mass", 0.45359237), "oz": ("mass", 0.028349523),
+    "tonne": ("mass", 1000.0),
+    "gallon": ("volume", 1.0), "liter": ("volume", 0.264172052),
+    "kwh": ("electricity", 1.0), "mwh": ("electricity", 1000.0),
+    "therm": ("gas", 1.0), "ccf": ("gas", 1.037), "mcf": ("gas", 10.37), "mmbtu": ("gas", 10.0),
+    "mile": ("distance", 1.0), "km": ("distance", 0.621371192),
+}
+UNIT_ALIASES = {
+    "kilogram": "kg", "kgs": "kg", "gram": "g", "pound": "lb", "lbs": "lb", "ounce": "oz", "ton": "tonne",
+    "gal": "gallon", "litre": "liter", "l": "liter", "kilowatt hour": "kwh", "kilowatt-hour": "kwh",
+    "megawatt hour": "mwh", "mi": "mile", "kilometer": "km", "kilometre": "km",
+}
+# Occurrences per year
+PERIODS = {"once": 1, "trip": 1, "day": 365, "week": 52, "month": 12, "year": 1}
+PERIOD_ALIASES = {"daily": "day", "weekly": "week", "monthly": "month", "yearly": "year",
+                  "annually": "year", "annual": "year", "": "year"}
+
+# Location verification writes states either way ("Omaha, NE, USA" / "Omaha, Nebraska, USA")
+US_STATES = {
+    "alabama": "AL", "alaska": "AK", "arizona": "AZ", "arkansas": "AR", "california": "CA", "colorado": "CO",
+    "connecticut": "CT", "delaware": "DE", "district of columbia": "DC", "florida": "FL", "georgia": "GA",
+    "hawaii": "HI", "idaho": "ID", "illinois": "IL", "indiana": "IN", "iowa": "IA", "kansas": "KS",
+    "kentucky": "KY", "louisiana": "LA", "maine": "ME", "maryland": "MD", "massachusetts": "MA",
+    "michigan": "MI", "minnesota": "MN", "mississippi": "MS", "missouri": "MO", "montana": "MT",
+    "nebraska": "NE", "nevada": "NV", "new hampshire": "NH", "new jersey": "NJ", "new mexico": "NM",
+    "new york": "NY", "north carolina": "NC", "north dakota": "ND", "ohio": "OH", "oklahoma": "OK",
+    "oregon": "OR", "pennsylvania": "PA", "rhode island": "RI", "south carolina": "SC", "south dakota": "SD",
+    "tennessee": "TN", "texas": "TX", "utah": "UT", "vermont": "VT", "virginia": "VA", "washington": "WA",
+    "west virginia": "WV", "wisconsin": "WI", "wyoming": "WY", "puerto rico": "PR",
+}
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def normalize_unit(unit):
+    unit = (unit or "").strip().lower().rstrip(".")
+    unit = UNIT_ALIASES.get(unit, unit)
+    if unit not in UNITS and unit.endswith("s"):
+        unit = UNIT_ALIASES.get(unit[:-1], unit[:-1])
+    return unit if unit in UNITS else None
+
+
+def normalize_period(per):
+    per = (per or "").strip().lower().removeprefix("per ").removeprefix("a ").removeprefix("every ")
+    per = PERIOD_ALIASES.get(per, per.rstrip("s"))
+    return per if per in PERIODS else None
+
+
+class Category:
+    """One category's items as parallel arrays, plus the label -> item lookup."""
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.basis = spec.get("basis", "")
+        self.items = []
+        self.units = []
+        self.values = []
+        self.sources = []
+        # Items whose factor is kWh of grid power per unit x the local grid factor
+        self.grid_kwh = {}
+        self.aliases = {}
+        for item, entry in spec.get("factors", {}).items():
+            index = len(self.items)
+            self.items.append(item)
+            self.units.append(entry.get("unit") or spec.get("unit"))
+            self.values.append(float(entry.get("value", 0.0)))
+            self.sources.append(entry.get("source"))
+            grid_kwh = entry.get("grid_kwh", entry.get("kwh_per_mile"))
+            if grid_kwh is not None:
+                self.grid_kwh[index] = float(grid_kwh)
+            for alias in (item, item.replace("_", " "), *entry.get("aliases", ())):
+                self.aliases[alias.lower()] = index
+        self._factors = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, label):
+        """Item index for a label like "Ground beef" or "gallons of gas", or None."""
+        label = (label or "").strip().lower().replace("_", " ")
+        if label in self.aliases:
+            return self.aliases[label]
+        words = _WORD_RE.findall(label)
+        # Longest alias contained in the label: "electric car" before "car"
+        for alias in sorted(self.aliases, key=len, reverse=True):
+            alias_words = alias.split()
+            if any(words[i:i + len(alias_words)] == alias_words for i in range(len(words))):
+                return self.aliases[alias]
+        for word in words:
+            for alias, index in self.aliases.items():
+                if len(alias) >= 4 and word.startswith(alias):
+                    return index
+        return None
+
+    def factors(self, grid_factor=None):
+        """Factor per item as an array, with grid-dependent items at `grid_factor`."""
+        key = grid_factor if self.grid_kwh else None
+        with self._lock:
+            cached = self._factors.get(key)
+            if cached is None:
+                values = list(self.values)
+                for index, kwh in self.grid_kwh.items():
+                    values[index] = kwh * (grid_factor or 0.0)
+                cached = np.asarray(values, dtype=np.float64) if np is not None else values
+                self._factors[key] = cached
+        return cached
+
+
+class EmissionFactors:
+    def __init__(self, data):
+        self.version = data.get("version", "unversioned")
+        self.sources = data.get("sources", {})
+        self.averages = data.get("averages", {})
+        categories = data.get("categories", {})
+        electricity = categories.get("electricity", {})
+        self.regions = {code: float(value) for code, value in electricity.get("regions", {}).items()}
+        self.states = electricity.get("states", {})
+        self.cities = electricity.get("cities", {})
+        self.grid_source = electricity.get("source")
+        self.categories = {name: Category(name, spec) for name, spec in categories.items() if spec.get("factors")}
+        # Electricity has a single item whose factor is the region's
+        self.categories["electricity"] = Category("electricity", {
+            "basis": electricity.get("basis", ""), "unit": electricity.get("unit", "kwh"),
+            "factors": {"grid": {"grid_kwh": 1.0, "source": self.grid_source,
+                                 "aliases": ["electricity", "power", "electric", "kwh"]}},
+        })
+
+    @classmethod
+    def load(cls, path=EMISSION_FACTORS_PATH):
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def region_for(self, location):
+        """eGRID subregion for "Omaha, NE, USA", an explicit subregion code, or the US average."""
+        location = location or ""
+        upper = location.strip().upper()
+        if upper in self.regions:
+            return upper
+        lowered = location.lower()
+        for city, region in self.cities.items():
+            if city in lowered:
+                return region
+        # City, State, Country: the state is any part after the first
+        for part in [p.strip() for p in location.split(",")][1:]:
+            code = part.upper() if len(part) == 2 else US_STATES.get(part.lower())
+            if code in self.states:
+                return self.states[code]
+        return "US"
+
+    def calculate(self, category, activities, location=None):
+        """
+        CO2 for a list of {"item", "amount", "unit", "per"} activities in one
+        category: per occurrence, per year, and the yearly total.
+        """
+        name = (category or "").strip().lower()
+        table = self.categories.get(name)
+        if table is None:
+            return {"error": f"Unknown category {category!r}; use one of {', '.join(sorted(self.categories))}",
+                    "dataset_version": self.version}
+
+        region = self.region_for(location)
+        grid_factor = self.regions.get(region, self.regions.get("US"))
+        factors = table.factors(grid_factor)
+
+        indices, amounts, scales, per_year, rows, errors = [], [], [], [], [], []
+        for activity in activities:
+            label = activity.get("item", "")
+            index = table.resolve(label)
+            unit = normalize_unit(activity.get("unit"))
+            per = normalize_period(activity.get("per"))
+            if index is None:
+                errors.append(f"No {name} factor for {label!r}; known items: {', '.join(table.items)}")
+                continue
+            base_unit = table.units[index]
+            if unit is None or UNITS[unit][0] != UNITS[base_unit][0]:
+                errors.append(f"{label!r}: unit {activity.get('unit')!r} doesn't convert to {base_unit}")
+                continue
+            if per is None:
+                errors.append(f"{label!r}: unknown period {activity.get('per')!r}; use once, day, week, month or year")
+                continue
+            indices.append(index)
+            amounts.append(float(activity.get("amount") or 0.0))
+            scales.append(UNITS[unit][1] / UNITS[base_unit][1])
+            per_year.append(PERIODS[per])
+            rows.append((label, index, unit, per))
+
+        if np is not None and indices:
+            kg = np.asarray(amounts) * np.asarray(scales) * factors[np.asarray(indices)]
+            annual = kg * np.asarray(per_year, dtype=np.float64)
+            kg, annual = kg.tolist(), annual.tolist()
+        else:
+            kg = [a * s * factors[i] for a, s, i in zip(amounts, scales, indices)]
+            annual = [k * p for k, p in zip(kg, per_year)]
+
+        results, used_sources = [], set()
+        grid_dependent = False
+        for (label, index, unit, per), amount, item_kg, item_annual in zip(rows, amounts, kg, annual):
+            source = table.sources[index]
+            used_sources.add(source)
+            grid_dependent = grid_dependent or index in table.grid_kwh
+            results.append({
+                "item": label, "matched": table.items[index], "amount": amount, "unit": unit, "per": per,
+                "factor": round(float(factors[index]), 4), "factor_unit": f"kg CO2 per {table.units[index]}",
+                "kg_co2": round(item_kg, 3), "annual_kg_co2": round(item_annual, 3), "source": source,
+            })
+
+        result = {
+            "dataset_version": self.version,
+            "category": name,
+            "basis": table.basis,
+            "results": results,
+            "total_annual_kg_co2": round(sum(annual), 3),
+        }
+        if grid_dependent:
+            result["grid_region"] = region
+            result["grid_kg_co2_per_kwh"] = grid_factor
+            if region == "US" and (location or "").strip():
+                result["grid_note"] = f"No regional grid factor for {location!r}; used the US average"
+        average = self.average(name, grid_factor)
+        if average is not None:
+            result["average"] = average
+            used_sources.add(average["source"])
+        result["sources"] = {key: self.sources.get(key, key) for key in sorted(used_sources) if key}
+        if errors:
+            result["errors"] = errors
+        return result
+
+    def average(self, category, grid_factor=None):
+        """The dataset's yearly average for a category, in kg CO2, if it has one."""
+        entry = self.averages.get(category)
+        if entry is None:
+            return None
+        kg_co2 = entry.get("kg_co2")
+        if kg_co2 is None:
+            table = self.categories[category]
+            index = table.resolve(entry.get("item"))
+            scale = UNITS[normalize_unit(entry["unit"])][1] / UNITS[table.units[index]][1]
+            kg_co2 = entry["amount"] * scale * float(table.factors(grid_factor)[index])
+        return {"label": entry.get("label", ""), "annual_kg_co2": round(kg_co2 * PERIODS[entry.get("per", "year")], 3),
+                "source": entry.get("source")}
+
+
+_factors = None
+_factors_lock = threading.Lock()
+
+
+def get_emission_factors():
+    global _factors
+    with _factors_lock:
+        if _factors is None:
+            _factors = EmissionFactors.load()
+        return _factors
@@ -0,0 +1,197 @@
+"""
+Async client for the US EPA WATERS API.
+
+Used by the `get_epa_water_data` tool in test.py. All calls go through a pooled
+httpx.AsyncClient with keep-alive, per-call timeouts and bounded retries so a
+slow EPA response no longer blocks the event loop the agents are running on.
+
+The real API needs a key in EPA_WATERS_API_KEY (https://api.data.gov/signup/).
+Point EPA_WATERS_BASE_URL at a local stub server to run without the real API;
+stubs don't need a key.
+"""
+import os
+import json
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+import httpx
+
+from water_cache import get_water_cache
+from watershed_index import get_watershed_index
+
+DEFAULT_BASE_URL = "https://api.epa.gov/waters"
+EPA_WATERS_BASE_URL = os.environ.get("EPA_WATERS_BASE_URL", DEFAULT_BASE_URL)
+EPA_WATERS_API_KEY = os.environ.get("EPA_WATERS_API_KEY", "")
+
+# Seconds per attempt. Navigation is the slow call, so it gets its own read timeout.
+EPA_CONNECT_TIMEOUT = float(os.environ.get("EPA_CONNECT_TIMEOUT", "3"))
+EPA_READ_TIMEOUT = float(os.environ.get("EPA_READ_TIMEOUT", "10"))
+EPA_MAX_RETRIES = int(os.environ.get("EPA_MAX_RETRIES", "2"))
+EPA_RETRY_BACKOFF = float(os.environ.get("EPA_RETRY_BACKOFF", "0.5"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class EPAWatersError(Exception):
+    """Raised when the WATERS API can't be reached after all retries."""
+
+
+class EPAWatersClient:
+    def __init__(self, base_url=EPA_WATERS_BASE_URL, api_key=EPA_WATERS_API_KEY,
+                 connect_timeout=EPA_CONNECT_TIMEOUT, read_timeout=EPA_READ_TIMEOUT,
+                 max_retries=EPA_MAX_RETRIES, backoff=EPA_RETRY_BACKOFF, transport=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30),
+            transport=transport,
+        )
+
+    async def get(self, path, params):
+        """GET with retries on connection errors, timeouts and 429/5xx responses."""
+        if self.api_key:
+            params = {**params, "api_key": self.api_key}
+        elif self.base_url == DEFAULT_BASE_URL:
+            raise EPAWatersError("EPA_WATERS_API_KEY is not set; it's required for the EPA WATERS API")
+        url = f"{self.base_url}{path}"
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = await self._http.get(url, params=params)
+                if resp.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return resp
+                last_error = EPAWatersError(f"HTTP {resp.status_code}")
+            except httpx.TransportError as e:
+                last_error = e
+
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+        raise EPAWatersError(f"{url} failed after {self.max_retries + 1} attempts: {last_error}")
+
+    async def find_nearest_feature(self, latitude, longitude):
+        """
+        Use the Upstream/Downstream service (Downstream Main) to find the stream
+        a point drains to. Returns (response, properties-of-first-feature or None).
+        """
+        start_point = {
+            "type": "Point",
+            "coordinates": [longitude, latitude]
+        }
+        resp = await self.get("/v4/upstreamdownstream", {
+            "start_point": json.dumps(start_point),
+            "navigation_type": "DM",  # Downstream Main
+        })
+        if resp.status_code != 200:
+            return resp, None
+
+        data = resp.json()
+        features = (data.get("output") or {}).get("features") or []
+        return resp, (features[0].get("properties", {}) if features else None)
+
+    async def get_streamcat(self, comid):
+        """Returns the StreamCat payload for a COMID, or None if unavailable."""
+        resp = await self.get("/v2_5/streamcat_json", {"comid": comid})
+        if resp.status_code != 200:
+            return None
+        return resp.json()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+# One pooled client per event loop. httpx connections are tied to the loop that
+# opened them, so under Flask's per-request loops this still gives reuse within a
+# request; with a long-lived loop it's shared by every request.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_epa_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = EPAWatersClient()
+        _clients[loop] = client
+    return client
+
+
+async def close_epa_client():
+    """Close the current loop's client, e.g. on ASGI shutdown."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+@asynccontextmanager
+async def request_scope():
+    """
+    Like openai_clients.request_scope(): a client opened by this request's
+    own loop (Flask's per-request loops) is closed on the way out, one that
+    already existed (ASGI worker loop) is kept.
+    """
+    existed = asyncio.get_running_loop() in _clients
+    try:
+        yield
+    finally:
+        if not existed:
+            await close_epa_client()
+
+
+async def fetch_water_data(latitude, longitude, client=None, cache=None):
+    """
+    Look up the local stream and its StreamCat metrics and format them for the agent.
+
+    Points in a prefetched service area are answered from the local index
+    (watershed_index.py) without any HTTP. Otherwise both hops go through the
+    water cache first, so repeat questions for the same area never leave the box.
+    """
+    indexed = get_watershed_index().lookup(latitude, longitude)
+    if indexed is not None:
+        feature, streamcat_data = indexed
+        return format_water_data(feature, streamcat_data)
+
+    cache = cache or get_water_cache()
+
+    feature = await cache.get_feature(latitude, longitude)
+    if feature is None:
+        client = client or get_epa_client()
+        resp, props = await client.find_nearest_feature(latitude, longitude)
+
+        if resp.status_code != 200:
+            return f"Error querying EPA API: {resp.text}"
+        if props is None:
+            return "No water features found in response."
+
+        feature = {
+            "comid": props.get("COMID") or props.get("comid"),
+            "name": props.get("GNIS_NAME", "Unnamed Stream"),
+        }
+        if feature["comid"]:
+            await cache.set_feature(latitude, longitude, feature["comid"], feature["name"])
+
+    comid = feature["comid"]
+    streamcat_data = None
+    if comid:
+        streamcat_data = await cache.get_streamcat(comid)
+        if streamcat_data is None:
+            client = client or get_epa_client()
+            streamcat_data = await client.get_streamcat(comid)
+            if streamcat_data is not None:
+                await cache.set_streamcat(comid, streamcat_data)
+
+    return format_water_data(feature, streamcat_data)
+
+
+def format_water_data(feature, streamcat_data):
+    comid = feature["comid"]
+    output_parts = [f"Found nearby water feature: {feature['name']} (COMID: {comid})"]
+    if comid:
+        if streamcat_data is not None:
+            output_parts.append(f"Watershed Metrics: {str(streamcat_data)[:500]}...")  # Truncate for now
+        else:
+            output_parts.append("Could not retrieve StreamCat data.")
+    return "\n".join(output_parts)
@@ -0,0 +1,190 @@
+"""
+Background evaluation queue.
+
+/chat used to await the GPT-4o evaluator before returning, roughly doubling
+the user-facing latency. Now it enqueues a job here and returns straight away.
+
+The queue runs its own asyncio loop on a daemon thread (Flask gives every
+request a fresh loop, so nothing request-scoped could own it). A fixed number
+of workers pull jobs, pass through a token-bucket rate limiter, retry with
+backoff, and hand the result to `on_result` so the caller can write it back to
+the log. Recent job states are kept for the /evaluation/<id> endpoint.
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+from evaluator import EVAL_MODEL, evaluate_response, usage_fields
+import pipeline_tracing
+from usage_accounting import UsageCollector
+
+EVAL_CONCURRENCY = int(os.environ.get("ECOBOT_EVAL_CONCURRENCY", "4"))
+EVAL_RATE_PER_SEC = float(os.environ.get("ECOBOT_EVAL_RATE_PER_SEC", "2"))
+EVAL_MAX_RETRIES = int(os.environ.get("ECOBOT_EVAL_MAX_RETRIES", "3"))
+EVAL_MAX_QUEUE = int(os.environ.get("ECOBOT_EVAL_MAX_QUEUE", "500"))
+EVAL_RESULTS_KEPT = 1000
+
+
+class RateLimiter:
+    """Async token bucket: `rate` acquisitions per second with bursts up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class EvaluationQueue:
+    def __init__(self, on_result, client_factory, concurrency=EVAL_CONCURRENCY,
+                 rate_per_sec=EVAL_RATE_PER_SEC, max_retries=EVAL_MAX_RETRIES, max_queue=EVAL_MAX_QUEUE):
+        """
+        on_result(job_id, evaluation) is called in a worker thread (asyncio.to_thread,
+        so its I/O doesn't stall the queue's loop) once a job finishes
+        (evaluation has an "error" key if it ultimately failed).
+        client_factory() builds the AsyncOpenAI client used by the workers.
+        """
+        self.on_result = on_result
+        self.client_factory = client_factory
+        self.concurrency = concurrency
+        self.rate_per_sec = rate_per_sec
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+
+        self._jobs = OrderedDict()  # job_id -> {"status", "evaluation", ...}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="evaluation-queue", daemon=True)
+            self._thread.start()
+        self._started.wait()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._client = self.client_factory()
+        self._limiter = RateLimiter(self.rate_per_sec)
+        for _ in range(self.concurrency):
+            self._loop.create_task(self._worker())
+        self._started.set()
+        self._loop.run_forever()
+
+    def stop(self, drain_timeout=10):
+        """
+        Give queued evaluations up to drain_timeout seconds to finish, then
+        close the client and stop the loop (asgi.py calls this on shutdown).
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+
+        async def shutdown():
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"Evaluation queue stopped with {self._pending} jobs unfinished")
+            close = getattr(self._client, "close", None)
+            if close is not None:
+                await close()
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(drain_timeout + 5)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            thread.join(5)
+            self._started.clear()
+
+    def submit(self, job_id, query, response, metrics=None):
+        """
+        Queue an evaluation. `metrics` (cost, latency, ...) are merged into the
+        final evaluation. Returns False if the queue is full and the job was skipped.
+        """
+        self.start()
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self._set(job_id, status="skipped", evaluation={**(metrics or {}), "error": "Evaluation queue full"})
+                return False
+            self._pending += 1
+            self._set(job_id, status="pending", evaluation=dict(metrics or {}))
+
+        job = {"id": job_id, "query": query, "response": response, "metrics": metrics or {}}
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return True
+
+    def _set(self, job_id, **state):
+        # Caller holds self._lock
+        self._jobs[job_id] = {**self._jobs.get(job_id, {}), **state, "updated_at": time.time()}
+        self._jobs.move_to_end(job_id)
+        while len(self._jobs) > EVAL_RESULTS_KEPT:
+            self._jobs.popitem(last=False)
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {"pending": self._pending, "concurrency": self.concurrency, "jobs": counts}
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                with pipeline_tracing.request_trace("evaluation", endpoint="evaluation_queue"):
+                    evaluation = await self._evaluate(job)
+                    status = "failed" if evaluation.get("error") else "done"
+                    try:
+                        # Blocking SQLite/CSV writes; keep them off the queue's loop
+                        await asyncio.to_thread(self.on_result, job["id"], evaluation)
+                    except Exception as e:
+                        print(f"Saving evaluation failed: {e}")
+                with self._lock:
+                    self._set(job["id"], status=status, evaluation=evaluation)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                self._queue.task_done()
+
+    async def _evaluate(self, job):
+        last_error = None
+        usage = UsageCollector()
+        for attempt in range(self.max_retries + 1):
+            await self._limiter.acquire()
+            try:
+                with pipeline_tracing.span("evaluator", model=EVAL_MODEL):
+                    evaluation = await evaluate_response(self._client, job["query"], job["response"], usage=usage)
+                return {**evaluation, **job["metrics"], **usage_fields(usage)}
+            except Exception as e:
+                last_error = e
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(30, 2 ** attempt))
+        print(f"Evaluation failed: {last_error}")
+        return {**job["metrics"], "error": "Evaluation failed"}
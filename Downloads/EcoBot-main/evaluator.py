@@ -0,0 +1,76 @@
+"""
+GPT-4o response evaluator shared by /chat (via the background queue) and /run_eval.
+"""
+import json
+
+EVAL_MODEL = "gpt-4o"
+
+# /chat scores on 0-100, the manual /run_eval button on 1-5
+PERCENT_PROMPT = """
+            You are an AI evaluator. Evaluate the following response to the user query.
+
+            User Query: {query}
+            Bot Response: {response}
+
+            Evaluate on:
+            1. Fairness (0-100): Is the response unbiased?
+            2. Accuracy (0-100): Does it seem factually sound based on the context?
+            3. Compliance (Yes/No): Did it follow instructions (citations, brevity, etc.)?
+
+            Return JSON format:
+            {{
+                "fairness_score": int,
+                "accuracy_score": int,
+                "compliance": "string",
+                "explanation": "string"
+            }}
+            """
+
+FIVE_POINT_PROMPT = """
+        You are an AI evaluator. Evaluate the following response to the user query.
+
+        User Query: {query}
+        Bot Response: {response}
+
+        Evaluate on:
+        1. Fairness (1-5): Is the response unbiased?
+        2. Accuracy (1-5): Does it seem factually sound based on the context?
+        3. Compliance (Yes/No): Did it follow instructions (e.g. was it brief if it was supposed to be)?
+
+        Return JSON format:
+        {{
+            "fairness_score": float,
+            "accuracy_score": float,
+            "compliance": "string",
+            "explanation": "string"
+        }}
+        """
+
+PROMPTS = {"percent": PERCENT_PROMPT, "five_point": FIVE_POINT_PROMPT}
+
+
+async def evaluate_response(client, query, response, scale="percent", usage=None):
+    """
+    Score a bot response for fairness, accuracy and compliance. Returns the parsed JSON,
+    with the scale it was scored on under "scale" so the log store can normalize it.
+    Pass a usage_accounting.UsageCollector as `usage` to record the tokens it cost.
+    """
+    eval_prompt = PROMPTS[scale].format(query=query, response=response)
+
+    completion = await client.chat.completions.create(
+        model=EVAL_MODEL,
+        messages=[{"role": "user", "content": eval_prompt}],
+        response_format={"type": "json_object"}
+    )
+    if usage is not None:
+        usage.add_completion("Evaluator", EVAL_MODEL, completion)
+
+    evaluation = json.loads(completion.choices[0].message.content)
+    evaluation["scale"] = scale
+    return evaluation
+
+
+def usage_fields(usage):
+    """Evaluator token/cost fields to merge into a stored evaluation."""
+    totals = usage.as_dict()
+    return {"evaluator_cost": f"${totals['cost']:.6f}", "evaluator_tokens": totals["total_tokens"]}
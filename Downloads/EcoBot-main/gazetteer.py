@@ -0,0 +1,213 @@
+"""
+Local geocoding for the water agent.
+
+The water agent used to spend a whole web_search_preview round trip finding
+the latitude and longitude of the user's city before it could call
+get_epa_water_data. Place names now resolve against a gazetteer held in
+memory:
+
+    data/gazetteer.csv     seed list: large US cities, state capitals, the
+                           Nebraska towns most of our users come from
+    ECOBOT_GAZETTEER_EXTRA optional GeoNames dump(s) for full coverage, e.g.
+                           cities1000.txt from https://download.geonames.org/export/dump/
+                           (comma-separated paths)
+
+Lookups take "City, State, Country" the way location verification writes it
+("Omaha, NE, USA", "Omaha, Nebraska, United States", "Omaha NE") and pick the
+most populous match for that city/state/country. Results, misses included,
+are kept in an LRU keyed on the normalized string
+(ECOBOT_GEOCODE_CACHE_SIZE, default 5000).
+
+run_workflow geocodes the extracted location and hands the water agent its
+coordinates up front; the geocode_location tool in test.py covers any other
+place the user mentions.
+"""
+import os
+import re
+import csv
+import threading
+import unicodedata
+
+from water_cache import TTLCache
+from emission_factors import US_STATES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GAZETTEER_FILE = os.environ.get("ECOBOT_GAZETTEER", os.path.join(BASE_DIR, 'data', 'gazetteer.csv'))
+GAZETTEER_EXTRA = [p for p in os.environ.get("ECOBOT_GAZETTEER_EXTRA", "").split(",") if p.strip()]
+GEOCODE_CACHE_SIZE = int(os.environ.get("ECOBOT_GEOCODE_CACHE_SIZE", "5000"))
+
+STATE_CODES = set(US_STATES.values())
+
+COUNTRIES = {
+    "us": "US", "usa": "US", "u.s.": "US", "u.s.a.": "US", "united states": "US",
+    "united states of america": "US", "america": "US",
+    "canada": "CA", "mexico": "MX", "uk": "GB", "united kingdom": "GB", "england": "GB",
+    "great britain": "GB", "france": "FR", "germany": "DE", "india": "IN", "japan": "JP",
+    "australia": "AU", "china": "CN", "brazil": "BR",
+}
+
+_ABBREVIATIONS = [(re.compile(r"\bst\b\.?"), "saint"), (re.compile(r"\bft\b\.?"), "fort"),
+                  (re.compile(r"\bmt\b\.?"), "mount")]
+_NON_WORD = re.compile(r"[^a-z0-9 ]+")
+_SPACES = re.compile(r"\s+")
+
+_MISS = {"found": False}
+
+# Common names the gazetteer doesn't carry as rows, tried after the exact name
+CITY_ALIASES = {"nyc": "new york", "new york city": "new york", "washington dc": "washington", "dc": "washington"}
+
+
+def normalize_name(name):
+    """'St. Louis' -> 'saint louis', 'Montréal' -> 'montreal'."""
+    name = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode("ascii").lower()
+    for pattern, replacement in _ABBREVIATIONS:
+        name = pattern.sub(replacement, name)
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", name)).strip()
+
+
+def name_variants(city):
+    """
+    Normalized names to try for a city, exact name first.
+
+    >>> name_variants("new york city")
+    ['new york city', 'new york']
+    >>> name_variants("kansas city")
+    ['kansas city', 'kansas']
+    """
+    variants = [city]
+    if city in CITY_ALIASES:
+        variants.append(CITY_ALIASES[city])
+    # "Carson City" is a row of its own, so this only runs after the exact name misses
+    if city.endswith(" city") and city[:-5] not in variants:
+        variants.append(city[:-5])
+    return variants
+
+
+def parse_location(text):
+    """(city, admin1, country) from 'Omaha, NE, USA'-style text; admin1/country may be ''."""
+    parts = [part.strip() for part in (text or "").split(",") if part.strip()]
+    if not parts:
+        return "", "", ""
+    city, admin1, country = parts[0], "", ""
+    if len(parts) == 1:
+        # "Omaha NE" / "Omaha Nebraska"
+        words = city.split()
+        if len(words) > 1 and (words[-1].upper() in STATE_CODES or words[-1].lower() in US_STATES):
+            city, parts = " ".join(words[:-1]), [city, words[-1]]
+    for part in parts[1:]:
+        lowered = part.lower()
+        if lowered in COUNTRIES:
+            country = COUNTRIES[lowered]
+        elif part.upper() in STATE_CODES and len(part) == 2:
+            admin1 = part.upper()
+        elif lowered in US_STATES:
+            admin1 = US_STATES[lowered]
+        elif not admin1:
+            admin1 = part
+    if admin1 in STATE_CODES and not country:
+        country = "US"
+    return normalize_name(city), admin1, country
+
+
+class Gazetteer:
+    def __init__(self, paths=None, cache_size=GEOCODE_CACHE_SIZE):
+        # normalized name -> places, most populous first
+        self.places = {}
+        self.cache = TTLCache(cache_size, float("inf"))
+        self._lock = threading.Lock()
+        self.found = 0
+        self.not_found = 0
+        for path in paths if paths is not None else [GAZETTEER_FILE, *GAZETTEER_EXTRA]:
+            try:
+                self.load(path)
+            except OSError as e:
+                print(f"Couldn't load gazetteer {path}: {e}")
+        for places in self.places.values():
+            places.sort(key=lambda place: place["population"], reverse=True)
+
+    def add(self, name, admin1, country, latitude, longitude, population=0, source="gazetteer"):
+        place = {"name": name, "admin1": admin1 or "", "country": country or "", "latitude": float(latitude),
+                 "longitude": float(longitude), "population": int(population or 0), "source": source}
+        self.places.setdefault(normalize_name(name), []).append(place)
+
+    def load(self, path):
+        if path.endswith(".txt"):
+            self._load_geonames(path)
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                self.add(row["name"], row.get("admin1"), row.get("country"), row["latitude"], row["longitude"],
+                         row.get("population"), source="gazetteer.csv")
+
+    def _load_geonames(self, path):
+        # Tab-separated GeoNames dump: name at 1, asciiname 2, lat/lon 4-5,
+        # country 8, admin1 10, population 14
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) < 15:
+                    continue
+                for name in {cols[1], cols[2]}:
+                    self.add(name, cols[10], cols[8], cols[4], cols[5], cols[14] or 0, source="geonames")
+
+    def _lookup(self, city, admin1, country):
+        for name in name_variants(city):
+            place = self._lookup_name(name, admin1, country)
+            if place:
+                return place
+        return None
+
+    def _lookup_name(self, city, admin1, country):
+        candidates = self.places.get(city, [])
+        if country:
+            candidates = [place for place in candidates if place["country"] == country]
+        if admin1:
+            in_admin1 = [place for place in candidates
+                         if place["admin1"].upper() == admin1.upper() or normalize_name(place["admin1"]) == normalize_name(admin1)]
+            # Only US states are reliably codes; elsewhere a name that doesn't match is ignored
+            if in_admin1 or admin1 in STATE_CODES:
+                candidates = in_admin1
+        return candidates[0] if candidates else None
+
+    def geocode(self, location):
+        """
+        {"latitude", "longitude", "name", "admin1", "country", ...} for a place, or None.
+
+        >>> get_gazetteer().geocode("New York City, NY, USA")["name"]
+        'New York'
+        >>> get_gazetteer().geocode("Kansas City, MO")["name"]
+        'Kansas City'
+        """
+        city, admin1, country = parse_location(location)
+        if not city:
+            return None
+        key = f"{city}, {admin1}, {country}"
+        cached = self.cache.get(key)
+        if cached is None:
+            place = self._lookup(city, admin1, country)
+            cached = {"found": True, **place} if place else _MISS
+            self.cache.set(key, cached)
+            with self._lock:
+                if place:
+                    self.found += 1
+                else:
+                    self.not_found += 1
+        return cached if cached["found"] else None
+
+    def stats(self):
+        with self._lock:
+            found, not_found = self.found, self.not_found
+        return {"names": len(self.places), "found": found, "not_found": not_found, "cache": self.cache.stats()}
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer()
+    return _gazetteer
@@ -0,0 +1,244 @@
+"""
+Conversation history compaction for run_workflow.
+
+Every agent used to get the whole conversation_history, including tool calls
+and the 2048-token specialist answers from every earlier turn. This module
+builds a smaller view per agent:
+
+  - a sliding window of the most recent turns (a turn starts at a user message)
+  - older turns folded into one rolling summary item at the top of the history
+  - tool-call items dropped from every turn except the current one
+  - a token budget; if the window is still too big, more turns are folded
+
+Pre-routing agents (location verification, topic classifier) get a minimal
+view: the summary plus the user messages and their earlier structured answers.
+
+Everything works on the plain dict items run_workflow already keeps.
+"""
+import os
+import json
+
+COMPACTION_ENABLED = os.environ.get("ECOBOT_COMPACTION", "1") != "0"
+SPECIALIST_TOKEN_BUDGET = int(os.environ.get("ECOBOT_SPECIALIST_TOKEN_BUDGET", "6000"))
+SPECIALIST_WINDOW_TURNS = int(os.environ.get("ECOBOT_SPECIALIST_WINDOW_TURNS", "3"))
+PREROUTING_TOKEN_BUDGET = int(os.environ.get("ECOBOT_PREROUTING_TOKEN_BUDGET", "800"))
+PREROUTING_WINDOW_TURNS = int(os.environ.get("ECOBOT_PREROUTING_WINDOW_TURNS", "3"))
+# Turns kept verbatim in the history we hand back for the session; older ones
+# only live on in the summary
+STORED_WINDOW_TURNS = int(os.environ.get("ECOBOT_STORED_WINDOW_TURNS", "10"))
+SUMMARY_MAX_LINES = int(os.environ.get("ECOBOT_SUMMARY_MAX_LINES", "12"))
+SUMMARY_SNIPPET_CHARS = 200
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+# Fields of LocationVerificationSchema / TopicClassifierAgentSchema in test.py
+PREROUTING_KEYS = {"location", "classifier", "scores"}
+
+TOOL_ITEM_TYPES = {
+    "function_call", "function_call_output", "web_search_call", "file_search_call",
+    "computer_call", "computer_call_output", "reasoning",
+}
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # Same rough 1 token ~= 4 chars rule app.py uses
+    return (len(text) + 3) // 4
+
+
+def item_text(item):
+    content = item.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+    if "output" in item:
+        return str(item["output"])
+    return ""
+
+
+def item_tokens(item):
+    if item.get("type") in TOOL_ITEM_TYPES:
+        return count_tokens(json.dumps(item, default=str))
+    # A few tokens of per-message overhead
+    return count_tokens(item_text(item)) + 4
+
+
+def history_tokens(items):
+    return sum(item_tokens(item) for item in items)
+
+
+def is_user_message(item):
+    return item.get("role") == "user"
+
+
+def is_tool_item(item):
+    return item.get("type") in TOOL_ITEM_TYPES
+
+
+def is_summary_item(item):
+    return item.get("role") == "system" and item_text(item).startswith(SUMMARY_PREFIX)
+
+
+def is_prerouting_output(item):
+    """
+    Structured answers from the location/classifier agents, e.g. {"location": "Omaha, NE, USA"}
+    or {"classifier": "water", "scores": {...}}.
+
+    >>> is_prerouting_output({"role": "assistant", "content": '{"classifier": "water", "scores": {"water": 0.9}}'})
+    True
+    >>> is_prerouting_output({"role": "assistant", "content": '{"chart": {"type": "bar"}}'})
+    False
+    """
+    if item.get("role") != "assistant":
+        return False
+    text = item_text(item).strip()
+    if not text.startswith("{"):
+        return False
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(parsed, dict) and set(parsed) <= PREROUTING_KEYS
+
+
+def split_turns(items):
+    """Returns (summary_lines, preamble, turns) where each turn starts at a user message."""
+    summary_lines = []
+    preamble = []
+    turns = []
+    for item in items:
+        if is_summary_item(item):
+            summary_lines.extend(line for line in item_text(item)[len(SUMMARY_PREFIX):].splitlines() if line)
+        elif is_user_message(item):
+            turns.append([item])
+        elif turns:
+            turns[-1].append(item)
+        else:
+            preamble.append(item)
+    return summary_lines, preamble, turns
+
+
+def _snippet(text):
+    text = " ".join(text.split())
+    if len(text) > SUMMARY_SNIPPET_CHARS:
+        text = text[:SUMMARY_SNIPPET_CHARS].rstrip() + "..."
+    return text
+
+
+def summarize_turn(turn):
+    """One summary line per turn: what the user asked and how the answer started."""
+    user_text = _snippet(item_text(turn[0]))
+    answer = ""
+    for item in reversed(turn):
+        if item.get("role") == "assistant" and not is_prerouting_output(item):
+            answer = item_text(item)
+            break
+    location = ""
+    for item in turn:
+        if is_prerouting_output(item):
+            parsed = json.loads(item_text(item))
+            location = parsed.get("location") or location
+    line = f"- User: {user_text}"
+    if location:
+        line += f" [location: {location}]"
+    if answer:
+        # The first sentence or so is usually the direct-answer summary
+        line += f" | EcoBot: {_snippet(answer.split(chr(10))[0])}"
+    return line
+
+
+def summary_item(lines):
+    lines = lines[-SUMMARY_MAX_LINES:]
+    return {
+        "role": "system",
+        "content": [{"type": "input_text", "text": SUMMARY_PREFIX + "\n".join(lines)}]
+    }
+
+
+def compact(items, window_turns, token_budget):
+    """
+    Keep the last `window_turns` turns, fold the rest into the rolling summary,
+    drop tool items from all but the current turn, then fold further turns
+    (never the current one) until the view fits `token_budget`.
+    """
+    summary_lines, preamble, turns = split_turns(items)
+    if not turns:
+        return list(items)
+
+    window_turns = max(1, window_turns)
+    older, recent = turns[:-window_turns], turns[-window_turns:]
+    summary_lines = summary_lines + [summarize_turn(turn) for turn in older]
+
+    recent = [[item for item in turn if not is_tool_item(item)] for turn in recent[:-1]] + [recent[-1]]
+
+    def build():
+        head = [summary_item(summary_lines)] if summary_lines else []
+        return head + preamble + [item for turn in recent for item in turn]
+
+    view = build()
+    while len(recent) > 1 and history_tokens(view) > token_budget:
+        summary_lines.append(summarize_turn(recent.pop(0)))
+        view = build()
+    return view
+
+
+def prerouting_view(items, window_turns=PREROUTING_WINDOW_TURNS, token_budget=PREROUTING_TOKEN_BUDGET):
+    """Summary + recent user/system messages and earlier location/classifier answers only."""
+    view = compact(items, window_turns, token_budget)
+    kept = [
+        item for item in view
+        if is_summary_item(item) or item.get("role") in ("user", "system") or is_prerouting_output(item)
+    ]
+    return kept
+
+
+class CompactionReport:
+    """Tokens before/after compaction for every agent call in one request."""
+
+    def __init__(self):
+        self.calls = {}
+
+    def record(self, agent_name, before_items, after_items):
+        before = history_tokens(before_items)
+        after = history_tokens(after_items)
+        self.calls[agent_name] = {"tokens_before": before, "tokens_after": after}
+
+    @property
+    def tokens_saved(self):
+        return sum(c["tokens_before"] - c["tokens_after"] for c in self.calls.values())
+
+    def as_dict(self):
+        return {"calls": self.calls, "tokens_saved": self.tokens_saved}
+
+
+def specialist_input(items, report=None, agent_name="specialist"):
+    if not COMPACTION_ENABLED:
+        return list(items)
+    view = compact(items, SPECIALIST_WINDOW_TURNS, SPECIALIST_TOKEN_BUDGET)
+    if report is not None:
+        report.record(agent_name, items, view)
+    return view
+
+
+def prerouting_input(items, report=None, agent_name="prerouting"):
+    if not COMPACTION_ENABLED:
+        return list(items)
+    view = prerouting_view(items)
+    if report is not None:
+        report.record(agent_name, items, view)
+    return view
+
+
+def stored_history(items):
+    """History to keep in the session: recent turns verbatim, everything older in the summary."""
+    if not COMPACTION_ENABLED:
+        return list(items)
+    return compact(items, STORED_WINDOW_TURNS, float("inf"))
@@ -0,0 +1,187 @@
+"""
+Session-sticky location and a cache for free-text locations.
+
+The location verification agent (gpt-4.1) used to run on every turn, even on
+"yes please", although the location rarely changes within a session. Now:
+
+  - the session remembers the last extracted location (app.py stores it next to
+    last_topic)
+  - `might_mention_place` is a cheap local check for whether the new message
+    could name a place at all (place prepositions, "live"/"moved", state names
+    or abbreviations, ZIP codes, capitalized words, cities we've seen before)
+  - if it can't, the remembered location is reused and the agent is skipped
+  - if it can, the place phrase ("in omaha nebraska") is looked up in a cache
+    of phrases the agent has already normalized to "City, State, Country"
+  - only otherwise does the agent run; its answer is cached under the phrase
+
+Without a remembered location the agent still runs, so first turns behave as
+before.
+"""
+import os
+import re
+import threading
+
+import topic_classifier
+from water_cache import TTLCache
+
+LOCATION_CACHE_ENABLED = os.environ.get("ECOBOT_LOCATION_CACHE", "1") != "0"
+LOCATION_CACHE_TTL = float(os.environ.get("ECOBOT_LOCATION_CACHE_TTL", str(30 * 24 * 3600)))
+LOCATION_CACHE_MAX = int(os.environ.get("ECOBOT_LOCATION_CACHE_MAX", "5000"))
+
+US_STATES = {
+    "AL": "alabama", "AK": "alaska", "AZ": "arizona", "AR": "arkansas", "CA": "california",
+    "CO": "colorado", "CT": "connecticut", "DE": "delaware", "FL": "florida", "GA": "georgia",
+    "HI": "hawaii", "ID": "idaho", "IL": "illinois", "IN": "indiana", "IA": "iowa",
+    "KS": "kansas", "KY": "kentucky", "LA": "louisiana", "ME": "maine", "MD": "maryland",
+    "MA": "massachusetts", "MI": "michigan", "MN": "minnesota", "MS": "mississippi",
+    "MO": "missouri", "MT": "montana", "NE": "nebraska", "NV": "nevada", "NH": "new hampshire",
+    "NJ": "new jersey", "NM": "new mexico", "NY": "new york", "NC": "north carolina",
+    "ND": "north dakota", "OH": "ohio", "OK": "oklahoma", "OR": "oregon", "PA": "pennsylvania",
+    "RI": "rhode island", "SC": "south carolina", "SD": "south dakota", "TN": "tennessee",
+    "TX": "texas", "UT": "utah", "VT": "vermont", "VA": "virginia", "WA": "washington",
+    "WV": "west virginia", "WI": "wisconsin", "WY": "wyoming", "DC": "district of columbia",
+}
+STATE_NAMES = set(US_STATES.values())
+
+# Words that introduce a place; "in" is too common on its own ("in a week"),
+# so it only counts when followed by something that isn't a filler word
+PLACE_CUES = re.compile(
+    r"\b(live|living|lives|moved|moving|relocat\w*|located|city|town|state|country|zip|postcode|"
+    r"near|based)\b"
+)
+PLACE_PHRASE = re.compile(
+    r"\b(?:in|from|near)\s+(?!(?:a|an|the|my|our|your|his|her|their|this|that|total|general|"
+    r"order|case|summer|winter|spring|fall|addition|detail|details|mind|terms|kg|lbs?|miles?|km|"
+    r"\d)\b)([a-z][a-z .'-]{1,40}?(?:,\s*[a-z][a-z .'-]{1,30}?){0,2})"
+    r"(?=\s*(?:[.!?;:]|$|\b(?:and|but|with|for|every|each|per|about|how|what|i|we|my|now|today|instead|too)\b))"
+)
+ZIP_CODE = re.compile(r"\b\d{5}(?:-\d{4})?\b")
+# Two-letter abbreviations only after a comma ("Omaha, NE"); on their own they're words like "IN"/"OK"
+STATE_ABBREV = re.compile(r",\s*(" + "|".join(US_STATES) + r")\b")
+SENTENCE_START = re.compile(r"(?:^|[.!?]\s+)([A-Z][a-z]+)")
+CAPITALIZED = re.compile(r"\b[A-Z][a-z]+\b")
+# Capitalized words that aren't places
+NOT_PLACES = {"I", "Im", "Yes", "No", "Ok", "Okay", "Please", "Thanks", "What", "How", "Why", "CO"}
+# "emissions from beef", "in my car": topic words after a preposition aren't places
+TOPIC_WORDS = {word for words in topic_classifier.SEED_KEYWORDS.values() for word in words}
+
+
+def normalize_phrase(phrase):
+    return " ".join(re.findall(r"[a-z0-9]+", (phrase or "").lower()))
+
+
+def place_phrase(text):
+    """The free-text place in a message, e.g. "omaha nebraska" from "i live in Omaha, Nebraska", or None."""
+    for match in PLACE_PHRASE.finditer((text or "").lower()):
+        phrase = normalize_phrase(match.group(1))
+        if phrase and not set(phrase.split()) & TOPIC_WORDS:
+            return phrase
+    return None
+
+
+class LocationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.agent_calls = 0
+        self.sticky_hits = 0
+        self.phrase_hits = 0
+
+    def record(self, source):
+        with self._lock:
+            if source == "sticky":
+                self.sticky_hits += 1
+            elif source == "cache":
+                self.phrase_hits += 1
+            else:
+                self.agent_calls += 1
+
+    def snapshot(self):
+        with self._lock:
+            total = self.agent_calls + self.sticky_hits + self.phrase_hits
+            return {
+                "agent_calls": self.agent_calls,
+                "sticky_hits": self.sticky_hits,
+                "phrase_hits": self.phrase_hits,
+                "agent_skip_rate": round((total - self.agent_calls) / total, 4) if total else 0.0,
+            }
+
+
+class LocationCache:
+    def __init__(self, maxsize=LOCATION_CACHE_MAX, ttl=LOCATION_CACHE_TTL):
+        # normalized place phrase -> "City, State, Country"
+        self.phrases = TTLCache(maxsize, ttl)
+        # Lowercased city names we've resolved, so "back in omaha" counts as a place
+        self._cities = set()
+        self._lock = threading.Lock()
+        self.stats = LocationStats()
+
+    def known_city_in(self, text):
+        words = f" {normalize_phrase(text)} "
+        with self._lock:
+            return any(f" {city} " in words for city in self._cities)
+
+    def might_mention_place(self, text):
+        text = text or ""
+        lowered = text.lower()
+        if ZIP_CODE.search(text) or PLACE_CUES.search(lowered) or place_phrase(text):
+            return True
+        if STATE_ABBREV.search(text) or any(f" {name} " in f" {normalize_phrase(lowered)} " for name in STATE_NAMES):
+            return True
+        # Proper nouns anywhere except the start of a sentence
+        starts = {m.start(1) for m in SENTENCE_START.finditer(text)}
+        for match in CAPITALIZED.finditer(text):
+            if match.start() not in starts and match.group() not in NOT_PLACES:
+                return True
+        return self.known_city_in(text)
+
+    def lookup(self, text):
+        phrase = place_phrase(text)
+        return self.phrases.get(phrase) if phrase else None
+
+    def remember(self, text, location):
+        """Cache the agent's answer under the message's place phrase if the two agree."""
+        location = (location or "").strip()
+        if not location:
+            return
+        city = normalize_phrase(location.split(",")[0])
+        if city:
+            with self._lock:
+                self._cities.add(city)
+        phrase = place_phrase(text)
+        # Only trust the mapping if the phrase actually names that city
+        if phrase and city and city in phrase:
+            self.phrases.set(phrase, location)
+
+    def resolve(self, text, previous_location=None):
+        """
+        Returns the location to use without calling the agent, or None if the
+        agent needs to run: the cached normalization of the place phrase, or the
+        session's location when the message can't contain a new place.
+        """
+        if not LOCATION_CACHE_ENABLED:
+            return None
+        if self.might_mention_place(text):
+            cached = self.lookup(text)
+            if cached:
+                self.stats.record("cache")
+            return cached
+        if previous_location:
+            self.stats.record("sticky")
+            return previous_location
+        return None
+
+    def snapshot(self):
+        return {**self.stats.snapshot(), "phrases": self.phrases.stats()}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_location_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LocationCache()
+    return _cache
@@ -0,0 +1,544 @@
+"""
+Indexed storage for conversation logs.
+
+Interactions live in a SQLite database (WAL mode) keyed by a unique record id,
+with an index on timestamp. Evaluation updates are single-row point writes
+instead of re-parsing and rewriting conversations.jsonl, and SQLite's own
+locking keeps concurrent writers (threads or gunicorn workers) from losing data.
+
+The numbers the /evaluations dashboard filters and aggregates on (scores,
+compliance, fallback, latency, cost) are pulled out of the evaluation JSON into
+their own columns, and per-day/per-topic rollups plus a latency histogram are
+kept up to date on every write. Dashboard aggregates over topic/date read the
+rollups, so they don't grow with the number of interactions.
+
+logs/conversations.jsonl is still appended to as a raw, append-only record of
+every interaction (the local topic classifier trains from it), but evaluations
+are only stored here. Existing JSONL entries are imported on first start.
+"""
+import os
+import json
+import uuid
+import base64
+import bisect
+import sqlite3
+import threading
+from datetime import date, timedelta
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_FILE = os.path.join(BASE_DIR, 'logs', 'conversations.jsonl')
+LOG_DB = os.environ.get("ECOBOT_LOG_DB", os.path.join(BASE_DIR, 'logs', 'conversations.sqlite3'))
+
+SCHEMA_VERSION = "4"
+
+# Upper bounds (ms) of the latency histogram buckets; one extra bucket catches the rest
+LATENCY_BUCKETS_MS = [250, 500, 1000, 2000, 3000, 5000, 7500, 10000, 15000, 20000, 30000, 45000, 60000, 90000, 120000]
+
+ENTRY_COLUMNS = ("id", "timestamp", "session_id", "topic", "user_message", "bot_response", "evaluation", "chart")
+# Multiplier that takes each evaluator scale (evaluator.PROMPTS) to 0-100
+SCORE_SCALES = {"percent": 1, "five_point": 20}
+# Recorded at chat time; evaluations without them came from the old /run_eval
+CHAT_METRIC_KEYS = ("latency", "cost")
+
+DERIVED_COLUMNS = ("fairness", "accuracy", "compliance", "fallback", "latency_ms", "cost")
+
+
+@contextmanager
+def locked_append(path, **open_kwargs):
+    """Open a file for appending under an exclusive advisory lock (shared across processes)."""
+    with open(path, 'a', **open_kwargs) as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield f
+            f.flush()
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _number(value, strip=""):
+    if value is None or value == "":
+        return None
+    try:
+        return float(str(value).strip().strip(strip))
+    except ValueError:
+        return None
+
+
+def evaluation_scale(evaluation):
+    """
+    The scale an evaluation was scored on. Evaluations from before the scale
+    was stored: /chat ones carry the chat metrics and scored on 0-100, the
+    manual /run_eval ones replaced the whole evaluation and scored on 1-5.
+
+    >>> evaluation_scale({"fairness_score": 4.5, "scale": "five_point"})
+    'five_point'
+    >>> evaluation_scale({"fairness_score": 90, "latency": "2.1s", "cost": "$0.01"})
+    'percent'
+    >>> evaluation_scale({"fairness_score": 4.5, "accuracy_score": 4.0, "compliance": "Yes"})
+    'five_point'
+    """
+    if evaluation.get("scale"):
+        return evaluation["scale"]
+    if any(key in evaluation for key in CHAT_METRIC_KEYS):
+        return "percent"
+    return "five_point"
+
+
+def derive(evaluation):
+    """Pull the filterable/aggregatable fields out of an evaluation dict."""
+    evaluation = evaluation or {}
+    scored = not evaluation.get("error")
+
+    # /run_eval scores on 1-5, /chat on 0-100; store everything as 0-100
+    factor = SCORE_SCALES.get(evaluation_scale(evaluation), 1)
+
+    def score(key):
+        value = _number(evaluation.get(key)) if scored else None
+        return value * factor if value is not None else None
+
+    compliance = str(evaluation.get("compliance") or "").strip().lower() if scored else ""
+    if compliance.startswith("yes"):
+        compliance = "yes"
+    elif compliance.startswith("no"):
+        compliance = "no"
+
+    return {
+        "fairness": score("fairness_score"),
+        "accuracy": score("accuracy_score"),
+        "compliance": compliance or None,
+        "fallback": evaluation.get("fallback") or None,
+        "latency_ms": _number(evaluation.get("latency"), "ms"),
+        "cost": _number(evaluation.get("cost"), "$"),
+    }
+
+
+def latency_bucket(latency_ms):
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+
+
+def encode_cursor(entry):
+    raw = json.dumps([entry["timestamp"], entry["id"]]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """(timestamp, record id) from an encode_cursor() string; ValueError if it isn't one."""
+    try:
+        timestamp, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if not isinstance(timestamp, str) or not isinstance(record_id, str):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return timestamp, record_id
+
+
+def _until_bound(until):
+    """A bare date as the upper bound includes that whole day."""
+    if len(until) == 10:
+        return "timestamp < ?", (date.fromisoformat(until) + timedelta(days=1)).isoformat()
+    return "timestamp <= ?", until
+
+
+class LogStore:
+    def __init__(self, path=LOG_DB, jsonl_path=LOG_FILE):
+        self.path = path
+        self.jsonl_path = jsonl_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS interactions (
+                id TEXT PRIMARY KEY,
+                timestamp TEXT NOT NULL,
+                session_id TEXT,
+                topic TEXT,
+                user_message TEXT,
+                bot_response TEXT,
+                evaluation TEXT
+            );
+            CREATE INDEX IF NOT EXISTS interactions_timestamp ON interactions (timestamp);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS daily_rollups (
+                day TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                interactions INTEGER NOT NULL DEFAULT 0,
+                cost_total REAL NOT NULL DEFAULT 0,
+                fairness_n INTEGER NOT NULL DEFAULT 0,
+                fairness_sum REAL NOT NULL DEFAULT 0,
+                accuracy_n INTEGER NOT NULL DEFAULT 0,
+                accuracy_sum REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, topic)
+            );
+            CREATE TABLE IF NOT EXISTS latency_histogram (
+                day TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, topic, bucket)
+            );
+        """)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(interactions)")}
+        for column, kind in (("fairness", "REAL"), ("accuracy", "REAL"), ("compliance", "TEXT"),
+                             ("fallback", "TEXT"), ("latency_ms", "REAL"), ("cost", "REAL"),
+                             ("chart", "TEXT")):
+            if column not in existing:
+                conn.execute(f"ALTER TABLE interactions ADD COLUMN {column} {kind}")
+        conn.executescript("""
+            CREATE INDEX IF NOT EXISTS interactions_topic ON interactions (topic, timestamp);
+            CREATE INDEX IF NOT EXISTS interactions_session ON interactions (session_id, timestamp);
+        """)
+        conn.commit()
+        self._import_jsonl()
+        self._migrate()
+
+    def _conn(self):
+        # One connection per thread; SQLite connections shouldn't be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_jsonl(self):
+        """One-off import of conversations.jsonl from before the store existed."""
+        conn = self._conn()
+        with conn:
+            # BEGIN IMMEDIATE so two workers starting together don't both import
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'jsonl_imported'").fetchone():
+                return
+            if os.path.exists(self.jsonl_path):
+                with open(self.jsonl_path, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        entry.setdefault("id", uuid.uuid4().hex)
+                        self._insert(conn, entry)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('jsonl_imported', '1')")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (SCHEMA_VERSION,))
+
+    def _migrate(self):
+        """Fill the derived columns and rollups for databases created before they existed."""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+            if row and row[0] == SCHEMA_VERSION:
+                return
+            for record in conn.execute("SELECT id, evaluation FROM interactions").fetchall():
+                derived = derive(json.loads(record["evaluation"]) if record["evaluation"] else None)
+                conn.execute(
+                    f"UPDATE interactions SET {', '.join(f'{c} = ?' for c in DERIVED_COLUMNS)} WHERE id = ?",
+                    (*derived.values(), record["id"])
+                )
+            self._rebuild_rollups(conn)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (SCHEMA_VERSION,))
+
+    def _rebuild_rollups(self, conn):
+        conn.execute("DELETE FROM daily_rollups")
+        conn.execute("DELETE FROM latency_histogram")
+        for record in conn.execute(f"SELECT timestamp, topic, {', '.join(DERIVED_COLUMNS)} FROM interactions").fetchall():
+            self._apply_rollup(conn, record["timestamp"], record["topic"], dict(record), 1)
+
+    @staticmethod
+    def _apply_rollup(conn, timestamp, topic, derived, sign):
+        day, topic = timestamp[:10], topic or ""
+        fairness, accuracy = derived.get("fairness"), derived.get("accuracy")
+        conn.execute("INSERT OR IGNORE INTO daily_rollups (day, topic) VALUES (?, ?)", (day, topic))
+        conn.execute(
+            "UPDATE daily_rollups SET interactions = interactions + ?, cost_total = cost_total + ?,"
+            " fairness_n = fairness_n + ?, fairness_sum = fairness_sum + ?,"
+            " accuracy_n = accuracy_n + ?, accuracy_sum = accuracy_sum + ?"
+            " WHERE day = ? AND topic = ?",
+            (
+                sign, sign * (derived.get("cost") or 0),
+                sign * (fairness is not None), sign * (fairness or 0),
+                sign * (accuracy is not None), sign * (accuracy or 0),
+                day, topic,
+            )
+        )
+        if derived.get("latency_ms") is not None:
+            bucket = latency_bucket(derived["latency_ms"])
+            conn.execute(
+                "INSERT OR IGNORE INTO latency_histogram (day, topic, bucket) VALUES (?, ?, ?)", (day, topic, bucket)
+            )
+            conn.execute(
+                "UPDATE latency_histogram SET count = count + ? WHERE day = ? AND topic = ? AND bucket = ?",
+                (sign, day, topic, bucket)
+            )
+
+    def _insert(self, conn, entry):
+        evaluation = entry.get("evaluation")
+        derived = derive(evaluation)
+        conn.execute(
+            f"INSERT INTO interactions ({', '.join(ENTRY_COLUMNS + DERIVED_COLUMNS)})"
+            f" VALUES ({', '.join('?' * (len(ENTRY_COLUMNS) + len(DERIVED_COLUMNS)))})",
+            (
+                entry["id"], entry["timestamp"], entry.get("session_id"), entry.get("topic"),
+                entry.get("user_message"), entry.get("bot_response"),
+                json.dumps(evaluation) if evaluation is not None else None,
+                json.dumps(entry["chart"]) if entry.get("chart") else None,
+                *derived.values(),
+            )
+        )
+        self._apply_rollup(conn, entry["timestamp"], entry.get("topic"), derived, 1)
+
+    def _set_evaluation(self, conn, row, evaluation):
+        """Replace a row's evaluation, moving its rollup contribution from the old values to the new."""
+        derived = derive(evaluation)
+        self._apply_rollup(conn, row["timestamp"], row["topic"], {c: row[c] for c in DERIVED_COLUMNS}, -1)
+        self._apply_rollup(conn, row["timestamp"], row["topic"], derived, 1)
+        conn.execute(
+            f"UPDATE interactions SET evaluation = ?, {', '.join(f'{c} = ?' for c in DERIVED_COLUMNS)} WHERE id = ?",
+            (json.dumps(evaluation), *derived.values(), row["id"])
+        )
+
+    @staticmethod
+    def _to_entry(row):
+        entry = {c: row[c] for c in ENTRY_COLUMNS}
+        entry["evaluation"] = json.loads(entry["evaluation"]) if entry["evaluation"] else None
+        entry["chart"] = json.loads(entry["chart"]) if entry["chart"] else None
+        return entry
+
+    def append(self, entry):
+        """Store a new interaction. Assigns entry["id"] if missing and returns it."""
+        entry.setdefault("id", uuid.uuid4().hex)
+        conn = self._conn()
+        with conn:
+            self._insert(conn, entry)
+
+        with locked_append(self.jsonl_path) as f:
+            f.write(json.dumps(entry) + '\n')
+        return entry["id"]
+
+    def get(self, record_id):
+        row = self._conn().execute("SELECT * FROM interactions WHERE id = ?", (record_id,)).fetchone()
+        return self._to_entry(row) if row else None
+
+    def find_by_timestamp(self, timestamp):
+        row = self._conn().execute("SELECT * FROM interactions WHERE timestamp = ?", (timestamp,)).fetchone()
+        return self._to_entry(row) if row else None
+
+    def update_evaluation(self, record_id, evaluation):
+        """Point update by record id. Returns the updated entry or None."""
+        conn = self._conn()
+        with conn:
+            row = conn.execute("SELECT * FROM interactions WHERE id = ?", (record_id,)).fetchone()
+            if row is None:
+                return None
+            self._set_evaluation(conn, row, evaluation)
+        return self.get(record_id)
+
+    def update_evaluations(self, updates):
+        """Apply {record id: evaluation} in one transaction. Returns the updated entries."""
+        conn = self._conn()
+        updated_ids = []
+        with conn:
+            for record_id, evaluation in updates.items():
+                row = conn.execute("SELECT * FROM interactions WHERE id = ?", (record_id,)).fetchone()
+                if row is not None:
+                    self._set_evaluation(conn, row, evaluation)
+                    updated_ids.append(row["id"])
+        return [self.get(record_id) for record_id in updated_ids]
+
+    def select_for_eval(self, since=None, until=None, topic=None, session_id=None, unevaluated_only=False, limit=None):
+        """Interactions for a batch re-score, oldest first; unevaluated = no fairness score yet."""
+        clauses, params = self._where(topic=topic, session_id=session_id, since=since, until=until)
+        clauses.append("COALESCE(user_message, '') != '' AND COALESCE(bot_response, '') != ''")
+        if unevaluated_only:
+            clauses.append("fairness IS NULL")
+        sql = f"SELECT * FROM interactions WHERE {' AND '.join(clauses)} ORDER BY timestamp, id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self._to_entry(row) for row in self._conn().execute(sql, params).fetchall()]
+
+    def all(self):
+        """Every interaction, oldest first."""
+        rows = self._conn().execute("SELECT * FROM interactions ORDER BY timestamp").fetchall()
+        return [self._to_entry(row) for row in rows]
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM interactions").fetchone()[0]
+
+    @staticmethod
+    def _where(topic=None, session_id=None, since=None, until=None, fallback=None, compliance=None):
+        clauses, params = [], []
+        if topic:
+            clauses.append("topic = ?")
+            params.append(topic)
+        if session_id:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clause, bound = _until_bound(until)
+            clauses.append(clause)
+            params.append(bound)
+        if fallback:
+            clauses.append("fallback = ?")
+            params.append(fallback)
+        if compliance:
+            clauses.append("compliance = ?")
+            params.append(compliance.lower())
+        return clauses, params
+
+    def query(self, cursor=None, limit=50, **filters):
+        """
+        One page of interactions, newest first. Returns (entries, next_cursor);
+        next_cursor is None on the last page.
+        """
+        clauses, params = self._where(**filters)
+        if cursor:
+            timestamp, record_id = decode_cursor(cursor)
+            clauses.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+            params.extend([timestamp, timestamp, record_id])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT * FROM interactions {where} ORDER BY timestamp DESC, id DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+        entries = [self._to_entry(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(entries[-1]) if len(rows) > limit else None
+        return entries, next_cursor
+
+    def aggregates(self, **filters):
+        """
+        Per-topic and overall interaction count, mean fairness/accuracy (0-100),
+        total cost and latency p50/p95/p99 (ms).
+
+        Topic + whole-day date ranges are answered from the daily rollups.
+        Anything finer (session, fallback, compliance, timestamps) goes to the
+        indexed rows instead.
+
+        The checked-in log mixes 1-5 /run_eval scores with 0-100 /chat ones;
+        re-deriving it keeps the per-topic means the dashboard showed before:
+
+        >>> import tempfile
+        >>> store = LogStore(os.path.join(tempfile.mkdtemp(), "check.sqlite3"), jsonl_path=LOG_FILE)
+        >>> by_topic = store.aggregates(until="2026-02-13")["by_topic"]
+        >>> {topic: (a["mean_fairness"], a["mean_accuracy"]) for topic, a in by_topic.items()}
+        {'unknown': (60.0, 20.0), 'energy': (90.0, 80.0), 'food': (89.29, 83.61), 'transport': (90.0, 76.25), 'water': (100.0, 95.0)}
+        """
+        since, until = filters.get("since"), filters.get("until")
+        row_filters = any(filters.get(k) for k in ("session_id", "fallback", "compliance"))
+        if row_filters or (since and len(since) != 10) or (until and len(until) != 10):
+            return self._aggregates_from_rows(**filters)
+        return self._aggregates_from_rollups(filters.get("topic"), since, until)
+
+    def _aggregates_from_rollups(self, topic=None, since=None, until=None):
+        clauses, params = [], []
+        if topic:
+            clauses.append("topic = ?")
+            params.append(topic)
+        if since:
+            clauses.append("day >= ?")
+            params.append(since)
+        if until:
+            clauses.append("day <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        conn = self._conn()
+
+        totals = {}
+        for row in conn.execute(
+            "SELECT topic, SUM(interactions), SUM(cost_total), SUM(fairness_n), SUM(fairness_sum),"
+            f" SUM(accuracy_n), SUM(accuracy_sum) FROM daily_rollups {where} GROUP BY topic", params
+        ):
+            totals[row[0]] = list(row[1:])
+        histograms = {}
+        for row in conn.execute(
+            f"SELECT topic, bucket, SUM(count) FROM latency_histogram {where} GROUP BY topic, bucket", params
+        ):
+            histograms.setdefault(row[0], {})[row[1]] = row[2]
+
+        def summarize(t, hist):
+            n, cost, fair_n, fair_sum, acc_n, acc_sum = t
+            return {
+                "interactions": n,
+                "mean_fairness": round(fair_sum / fair_n, 2) if fair_n else None,
+                "mean_accuracy": round(acc_sum / acc_n, 2) if acc_n else None,
+                "cost_total": round(cost, 6),
+                **{f"latency_p{q}": _histogram_percentile(hist, q) for q in (50, 95, 99)},
+            }
+
+        by_topic = {}
+        overall_totals, overall_hist = [0] * 6, {}
+        for t, values in sorted(totals.items()):
+            if not values[0]:
+                continue
+            hist = histograms.get(t, {})
+            by_topic[t or "unknown"] = summarize(values, hist)
+            overall_totals = [a + b for a, b in zip(overall_totals, values)]
+            for bucket, count in hist.items():
+                overall_hist[bucket] = overall_hist.get(bucket, 0) + count
+        return {"source": "rollups", "by_topic": by_topic, "overall": summarize(overall_totals, overall_hist)}
+
+    def _aggregates_from_rows(self, **filters):
+        clauses, params = self._where(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        conn = self._conn()
+
+        def percentiles(extra_clause, extra_params):
+            conds = clauses + ["latency_ms IS NOT NULL"] + ([extra_clause] if extra_clause else [])
+            cond = " AND ".join(conds)
+            values = (*params, *extra_params)
+            n = conn.execute(f"SELECT COUNT(*) FROM interactions WHERE {cond}", values).fetchone()[0]
+            result = {}
+            for q in (50, 95, 99):
+                if not n:
+                    result[f"latency_p{q}"] = None
+                    continue
+                offset = min(n - 1, int(round(q / 100 * (n - 1))))
+                result[f"latency_p{q}"] = conn.execute(
+                    f"SELECT latency_ms FROM interactions WHERE {cond} ORDER BY latency_ms LIMIT 1 OFFSET ?",
+                    (*values, offset)
+                ).fetchone()[0]
+            return result
+
+        def summarize(row, extra_clause="", extra_params=()):
+            return {
+                "interactions": row[0],
+                "mean_fairness": round(row[1], 2) if row[1] is not None else None,
+                "mean_accuracy": round(row[2], 2) if row[2] is not None else None,
+                "cost_total": round(row[3] or 0, 6),
+                **percentiles(extra_clause, extra_params),
+            }
+
+        select = "SELECT COUNT(*), AVG(fairness), AVG(accuracy), SUM(cost)"
+        by_topic = {}
+        for row in conn.execute(f"{select}, topic FROM interactions {where} GROUP BY topic ORDER BY topic", params).fetchall():
+            topic = row[4]
+            clause = "topic = ?" if topic is not None else "topic IS NULL"
+            by_topic[topic or "unknown"] = summarize(row, clause, (topic,) if topic is not None else ())
+        overall = conn.execute(f"{select} FROM interactions {where}", params).fetchone()
+        return {"source": "index", "by_topic": by_topic, "overall": summarize(overall)}
+
+
+def _histogram_percentile(hist, q):
+    """Upper bound of the bucket holding the q-th percentile (the last bound for the overflow bucket)."""
+    total = sum(hist.values())
+    if not total:
+        return None
+    target = q / 100 * total
+    seen = 0
+    for bucket in sorted(hist):
+        seen += hist[bucket]
+        if seen >= target:
+            return LATENCY_BUCKETS_MS[min(bucket, len(LATENCY_BUCKETS_MS) - 1)]
+    return LATENCY_BUCKETS_MS[-1]
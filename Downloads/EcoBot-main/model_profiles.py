@@ -0,0 +1,157 @@
+"""
+Per-agent model profiles and the escalation policy for structured outputs.
+
+Every agent used to be hard-coded to gpt-4.1 with temperature 1 and
+max_tokens 2048, including location verification and the topic classifier,
+which only return a one- or two-field JSON object. Agents now take their
+model and settings from a profile:
+
+    location     small model, temperature 0, tight max_tokens
+    classifier   same, a bit more room for the per-topic scores
+    specialist   unchanged (gpt-4.1); water/food/transport/energy can
+                 override it individually
+
+Profiles are merged over DEFAULT_PROFILES from ECOBOT_MODEL_PROFILES, either
+JSON or a path to a JSON file:
+
+    ECOBOT_MODEL_PROFILES='{"classifier": {"model": "gpt-4.1-mini"}, "water": {"max_tokens": 3000}}'
+
+Small models get the JSON wrong now and then (or run out of max_tokens in
+the middle of it). run_structured() catches that and retries on the next
+model in the profile's "escalate" list, with twice the max_tokens, so the
+big model is only paid for when the small one fails. /stats "model_profiles"
+has the escalation rates; bench/model_tiers.py compares profiles on the
+logged queries.
+"""
+import os
+import json
+import threading
+
+from agents import ModelBehaviorError, ModelSettings, Runner
+
+# Keys that go into ModelSettings; the rest ("model", "escalate") are ours
+SETTINGS_KEYS = ("temperature", "top_p", "max_tokens", "store")
+
+DEFAULT_PROFILES = {
+    "specialist": {"model": "gpt-4.1", "temperature": 1, "top_p": 1, "max_tokens": 2048, "store": True},
+    "location": {"model": "gpt-4.1-nano", "temperature": 0, "top_p": 1, "max_tokens": 64, "store": True,
+                 "escalate": ["gpt-4.1-mini", "gpt-4.1"]},
+    "classifier": {"model": "gpt-4.1-nano", "temperature": 0, "top_p": 1, "max_tokens": 96, "store": True,
+                   "escalate": ["gpt-4.1-mini", "gpt-4.1"]},
+}
+
+# What every agent ran with before profiles; bench/model_tiers.py's baseline
+LEGACY_PROFILES = {
+    role: {"model": "gpt-4.1", "temperature": 1, "top_p": 1, "max_tokens": 2048, "store": True}
+    for role in ("specialist", "location", "classifier")
+}
+
+
+def load_profiles(value=None):
+    """DEFAULT_PROFILES with the overrides from JSON text or a JSON file path."""
+    profiles = {role: dict(profile) for role, profile in DEFAULT_PROFILES.items()}
+    value = os.environ.get("ECOBOT_MODEL_PROFILES", "") if value is None else value
+    if not value:
+        return profiles
+    if os.path.isfile(value):
+        with open(value, 'r') as f:
+            overrides = json.load(f)
+    else:
+        overrides = json.loads(value)
+    for role, profile in overrides.items():
+        profiles.setdefault(role, {}).update(profile)
+    return profiles
+
+
+PROFILES = load_profiles()
+
+
+def profile(role, base=None, profiles=None):
+    """Settings for a role, on top of its base role's (e.g. "water" on "specialist")."""
+    profiles = PROFILES if profiles is None else profiles
+    merged = dict(profiles.get(base, {})) if base else {}
+    merged.update(profiles.get(role, {}))
+    return merged
+
+
+def model_settings(settings):
+    return ModelSettings(**{key: settings[key] for key in SETTINGS_KEYS if key in settings})
+
+
+def agent_settings(role, base=None, profiles=None):
+    """Agent(..., **agent_settings("location")) - the model and model_settings kwargs."""
+    settings = profile(role, base, profiles)
+    return {"model": settings["model"], "model_settings": model_settings(settings)}
+
+
+def configure(agent, role, base=None, profiles=None):
+    """A clone of `agent` on another profile set (for the benchmark)."""
+    return agent.clone(**agent_settings(role, base, profiles))
+
+
+class EscalationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.roles = {}
+
+    def record(self, role, key):
+        with self._lock:
+            counts = self.roles.setdefault(role, {"calls": 0, "parse_failures": 0, "escalated": 0, "failed": 0})
+            counts[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            roles = {role: dict(counts) for role, counts in self.roles.items()}
+        for counts in roles.values():
+            counts["escalation_rate"] = round(counts["escalated"] / counts["calls"], 4) if counts["calls"] else 0.0
+        return {"roles": roles, "models": {role: settings.get("model") for role, settings in PROFILES.items()}}
+
+
+stats = EscalationStats()
+
+_escalated = {}
+_escalated_lock = threading.Lock()
+
+
+def escalation_chain(agent, role, profiles=None):
+    """The agent itself, then one clone per model in the profile's escalate list."""
+    settings = profile(role, profiles=profiles)
+    chain = [agent]
+    max_tokens = settings.get("max_tokens")
+    for model in settings.get("escalate", []):
+        max_tokens = max_tokens * 2 if max_tokens else None
+        key = (id(agent), role, model, max_tokens)
+        with _escalated_lock:
+            clone = _escalated.get(key)
+            if clone is None:
+                clone = agent.clone(model=model, model_settings=model_settings({**settings, "max_tokens": max_tokens}))
+                _escalated[key] = clone
+        chain.append(clone)
+    return chain
+
+
+async def run_structured(agent, role, input, run_config, usage=None, profiles=None):
+    """
+    Runner.run for an agent with an output_type. If its output doesn't parse,
+    retry on the next model of the escalation chain. Returns (agent that
+    answered, result) so usage gets priced at the right model. Failed
+    attempts are added to `usage` when the library reports their responses.
+    """
+    stats.record(role, "calls")
+    chain = escalation_chain(agent, role, profiles)
+    for attempt, current in enumerate(chain):
+        try:
+            result = await Runner.run(current, input=input, run_config=run_config)
+        except ModelBehaviorError as e:
+            stats.record(role, "parse_failures")
+            run_data = getattr(e, "run_data", None)
+            if usage is not None and run_data is not None:
+                usage.add_run(current, run_data)
+            if attempt == len(chain) - 1:
+                stats.record(role, "failed")
+                raise
+            print(f"{role}: {e} from {current.model}, escalating to {chain[attempt + 1].model}")
+            continue
+        if attempt:
+            stats.record(role, "escalated")
+        return current, result
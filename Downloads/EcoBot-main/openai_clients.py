@@ -0,0 +1,188 @@
+"""
+Pooled AsyncOpenAI clients shared by the agents and the evaluator.
+
+Every Runner.run used to get its own client from the agents library's default
+provider, and /run_eval built a fresh AsyncOpenAI per request, so each model
+call paid for a new connection pool and TLS handshake. Everything now goes
+through get_openai_client():
+
+    client = get_openai_client()                       # evaluator
+    RunConfig(model_provider=model_provider(), ...)    # agents (see test.py)
+
+httpx connections belong to the event loop that opened them, so like
+epa_client.py there is one client per loop. Under Flask's per-request loops
+that means one pool per request (location, classifier and specialist share
+it), and on a long-lived loop (the evaluation queue, an ASGI server) one pool
+for everything. request_scope() closes a client that was opened by the request
+itself so per-request loops don't leak sockets; close_openai_clients() closes
+the rest at shutdown.
+
+Pool settings:
+    OPENAI_MAX_CONNECTIONS   (default 50)
+    OPENAI_MAX_KEEPALIVE     (default 20)
+    OPENAI_KEEPALIVE_EXPIRY  seconds (default 60)
+    OPENAI_HTTP2             auto/1/0 - auto uses HTTP/2 when the h2 package is installed
+
+Calls are also rate limited per API key and model (admission.model_limiter).
+"""
+import os
+import json
+import atexit
+import asyncio
+import weakref
+import threading
+import importlib.util
+from contextlib import asynccontextmanager
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+import admission
+
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_HTTP2 = os.environ.get("OPENAI_HTTP2", "auto").lower()
+
+
+def http2_enabled():
+    if OPENAI_HTTP2 in ("0", "false", "no", "off"):
+        return False
+    # httpx needs the optional h2 package for HTTP/2
+    return importlib.util.find_spec("h2") is not None
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Applies admission.model_limiter to every call: waits for the (API key,
+    model) token buckets, or answers with a local 429 + Retry-After that the
+    OpenAI client handles like one from the API.
+    """
+
+    def __init__(self, transport, limiter=None):
+        self.transport = transport
+        self.limiter = limiter or admission.model_limiter
+
+    async def handle_async_request(self, request):
+        model, prompt_tokens = "", 0
+        if request.method == "POST":
+            try:
+                prompt_tokens = len(request.content) // 4  # ~4 bytes per token
+                model = json.loads(request.content).get("model") or ""
+            except (httpx.RequestNotRead, ValueError, AttributeError):
+                pass
+        if model:
+            api_key = request.headers.get("authorization", "").removeprefix("Bearer ")
+            try:
+                wait = self.limiter.reserve(api_key, model, prompt_tokens)
+            except admission.Overloaded as e:
+                return httpx.Response(429, headers={"retry-after": str(e.retry_after), "x-ecobot-local-limit": "1"},
+                                      json={"error": {"message": e.message, "type": "rate_limit_exceeded",
+                                                      "code": "local_rate_limit"}},
+                                      request=request)
+            if wait:
+                await asyncio.sleep(wait)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def create_openai_client(**kwargs):
+    """A new AsyncOpenAI with the pooled transport settings. Prefer get_openai_client()."""
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        http2=http2_enabled(),
+    )
+    http_client = DefaultAsyncHttpxClient(transport=RateLimitedTransport(transport))
+    # Base URL comes from OPENAI_BASE_URL like the agents library (bench/ uses that)
+    return AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=http_client, **kwargs)
+
+
+_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncOpenAI
+_lock = threading.Lock()
+
+
+def _current_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        # e.g. EvaluationQueue._run builds its client before run_forever()
+        return asyncio.get_event_loop()
+
+
+def get_openai_client():
+    """The pooled client for the current event loop, created on first use."""
+    loop = _current_loop()
+    with _lock:
+        client = _clients.get(loop)
+        if client is None:
+            client = create_openai_client()
+            _clients[loop] = client
+    return client
+
+
+def model_provider():
+    """Agents model provider backed by the current loop's pooled client."""
+    from agents import OpenAIProvider
+    return OpenAIProvider(openai_client=get_openai_client())
+
+
+async def aclose_openai_client():
+    """Close the current loop's client, if it has one."""
+    with _lock:
+        client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+@asynccontextmanager
+async def request_scope():
+    """
+    Wrap a request handler. If the request opened this loop's client it's
+    closed on the way out (Flask runs each async view on its own loop, which
+    is thrown away afterwards); a client that already existed belongs to a
+    long-lived loop and is left for the next request.
+    """
+    existed = asyncio.get_running_loop() in _clients
+    try:
+        yield
+    finally:
+        if not existed:
+            await aclose_openai_client()
+
+
+def close_openai_clients(timeout=5):
+    """Close every client still open; called at interpreter exit."""
+    with _lock:
+        clients = list(_clients.items())
+        _clients.clear()
+    for loop, client in clients:
+        try:
+            if loop.is_closed():
+                continue
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(client.close(), loop).result(timeout)
+            else:
+                loop.run_until_complete(client.close())
+        except Exception as e:
+            print(f"Closing OpenAI client failed: {e}")
+
+
+atexit.register(close_openai_clients)
+
+
+def pool_stats():
+    with _lock:
+        open_clients = len(_clients)
+    return {
+        "open_clients": open_clients,
+        "max_connections": OPENAI_MAX_CONNECTIONS,
+        "max_keepalive": OPENAI_MAX_KEEPALIVE,
+        "keepalive_expiry": OPENAI_KEEPALIVE_EXPIRY,
+        "http2": http2_enabled(),
+    }
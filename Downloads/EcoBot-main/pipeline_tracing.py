@@ -0,0 +1,233 @@
+"""
+Local span timing for the chat pipeline.
+
+The only timing we used to have was one latency around run_workflow, and
+anything finer depended on the hosted trace that `trace("Cameron")` exports
+to. This records a span tree per request instead:
+
+    with request_trace("chat", endpoint="/chat"):
+        with span("location_agent", model="gpt-4.1"):
+            ...
+
+Spans nest through a contextvar, so they work across `await` and inside
+asyncio.gather tasks. When a request finishes every span is observed into a
+Prometheus histogram labelled by stage, topic and model (served on /metrics
+by app.py), and requests slower than ECOBOT_SLOW_TRACE_MS, plus a random
+ECOBOT_TRACE_SAMPLE_RATE fraction, get their whole span tree appended to
+logs/slow_traces.jsonl.
+
+Hosted tools such as web search run inside the model response, so their time
+shows up in the agent's span; the number of searches is tagged on it.
+"""
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+from log_store import locked_append
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SLOW_TRACE_MS = float(os.environ.get("ECOBOT_SLOW_TRACE_MS", "20000"))
+TRACE_SAMPLE_RATE = float(os.environ.get("ECOBOT_TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.environ.get("ECOBOT_TRACE_FILE", os.path.join(BASE_DIR, 'logs', 'slow_traces.jsonl'))
+
+# Seconds; the specialist with web search routinely takes 10-30s
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_current = contextvars.ContextVar("ecobot_span", default=None)
+
+
+class Span:
+    def __init__(self, name, parent=None, **tags):
+        self.name = name
+        self.parent = parent
+        self.tags = {k: v for k, v in tags.items() if v is not None}
+        self.children = []
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.end = None
+        self.error = None
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def root(self):
+        span = self
+        while span.parent is not None:
+            span = span.parent
+        return span
+
+    @property
+    def duration(self):
+        return ((self.end or time.perf_counter()) - self.start)
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def as_dict(self):
+        offset = self.start - self.root.start
+        return {
+            "name": self.name,
+            "start_ms": round(offset * 1000, 1),
+            "duration_ms": round(self.duration * 1000, 1),
+            **({"tags": self.tags} if self.tags else {}),
+            **({"error": self.error} if self.error else {}),
+            **({"children": [child.as_dict() for child in self.children]} if self.children else {}),
+        }
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, labels, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key))
+                sep = "," if labels else ""
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {series["count"]}')
+                lines.append(f"{_series_name(self.name + '_sum', labels)} {series['sum']:.6f}")
+                lines.append(f"{_series_name(self.name + '_count', labels)} {series['count']}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                labels = ",".join(f'{name}="{_escape(v)}"' for name, v in zip(self.labels, key))
+                lines.append(f"{_series_name(self.name, labels)} {value}")
+        return "\n".join(lines)
+
+
+def _series_name(name, labels):
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_duration = Histogram(
+    "ecobot_stage_duration_seconds", "Duration of each pipeline stage.", ("stage", "topic", "model")
+)
+request_duration = Histogram(
+    "ecobot_request_duration_seconds", "End-to-end duration of a traced request.", ("endpoint", "topic")
+)
+stage_errors = Counter("ecobot_stage_errors_total", "Pipeline stages that raised.", ("stage", "topic"))
+traces_written = Counter("ecobot_slow_traces_total", "Span trees written to the slow trace file.")
+
+METRICS = (stage_duration, request_duration, stage_errors, traces_written)
+
+
+@contextmanager
+def span(name, **tags):
+    """Time a stage as a child of the current span (or on its own if there isn't one)."""
+    current = Span(name, _current.get(), **tags)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current.reset(token)
+        if current.parent is None:
+            _finish(current)
+
+
+@contextmanager
+def request_trace(name, **tags):
+    """Root span for a request; same as span() but always starts a new tree."""
+    token = _current.set(None)
+    try:
+        with span(name, **tags) as root:
+            yield root
+    finally:
+        _current.reset(token)
+
+
+async def timed(name, awaitable, **tags):
+    """`await timed("classifier_agent", Runner.run(...))` - for use inside asyncio.gather."""
+    with span(name, **tags):
+        return await awaitable
+
+
+def tag_request(**tags):
+    """Tag the current request's root span, e.g. with the topic once it's known."""
+    current = _current.get()
+    if current is not None:
+        current.root.tags.update({k: v for k, v in tags.items() if v is not None})
+
+
+def tag_span(**tags):
+    current = _current.get()
+    if current is not None:
+        current.tags.update({k: v for k, v in tags.items() if v is not None})
+
+
+def _finish(root):
+    topic = root.tags.get("topic", "")
+    request_duration.observe(root.duration, endpoint=root.tags.get("endpoint", root.name), topic=topic)
+    for item in root.walk():
+        if item is root:
+            continue
+        stage_duration.observe(item.duration, stage=item.name, topic=item.tags.get("topic", topic),
+                               model=item.tags.get("model", ""))
+        if item.error:
+            stage_errors.inc(stage=item.name, topic=topic)
+
+    if root.duration * 1000 >= SLOW_TRACE_MS or (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE):
+        record = {"timestamp": datetime.fromtimestamp(root.started_at).isoformat(), **root.as_dict()}
+        try:
+            os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+            with locked_append(TRACE_FILE) as f:
+                f.write(json.dumps(record, default=str) + "\n")
+            traces_written.inc()
+        except OSError as e:
+            print(f"Writing slow trace failed: {e}")
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
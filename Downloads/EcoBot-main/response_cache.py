@@ -0,0 +1,250 @@
+"""
+Response cache for specialist answers.
+
+The log is full of the same questions ("i eat beef 3x a week") and every one
+of them used to get a fresh specialist generation with web search. Answers are
+now cached on (topic, normalized location, normalized question):
+
+  - exact tier: the normalized question text must match
+  - semantic tier (optional, ECOBOT_RESPONSE_CACHE_SEMANTIC=1): a local vector
+    index per (topic, location); the closest cached question is used if its
+    cosine similarity is above ECOBOT_RESPONSE_CACHE_SIMILARITY and it has the
+    same numbers in it ("3x a week" must not answer "5x a week")
+
+Embeddings come from a sentence-transformers model if
+ECOBOT_RESPONSE_CACHE_EMBED_MODEL is set and installed, otherwise from hashed
+word/bigram counts, which is cheap and good enough for rephrasings.
+
+Entries expire after a TTL and the least recently used ones are evicted past
+`maxsize`. A whole topic can be invalidated (e.g. after a prompt change).
+Follow-up turns that lean on the conversation ("what about chicken?", "yes
+please") are never looked up or stored.
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import topic_classifier
+
+RESPONSE_CACHE_ENABLED = os.environ.get("ECOBOT_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_TTL = float(os.environ.get("ECOBOT_RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("ECOBOT_RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_SEMANTIC = os.environ.get("ECOBOT_RESPONSE_CACHE_SEMANTIC", "0") == "1"
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("ECOBOT_RESPONSE_CACHE_SIMILARITY", "0.9"))
+RESPONSE_CACHE_EMBED_MODEL = os.environ.get("ECOBOT_RESPONSE_CACHE_EMBED_MODEL", "")
+
+HASH_DIM = 1024
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+# Words that don't change the answer; everything else (numbers included) is kept in order
+FILLER_WORDS = {
+    "i", "a", "an", "the", "please", "my", "me", "im", "am", "is", "are", "do", "does",
+    "can", "could", "would", "you", "tell", "hi", "hello", "hey", "thanks", "thank",
+    "just", "really", "so", "um", "like", "what", "s",
+}
+
+# Words that point back at earlier turns
+REFERENCE_WORDS = {"that", "it", "this", "those", "these", "them", "instead", "else", "again", "same", "also", "too"}
+FOLLOW_UP_OPENERS = ("what about", "how about", "and ", "but ", "why", "what if", "then ")
+
+LOCATION_SUFFIXES = ("united states of america", "united states", "usa", "us")
+
+
+def normalize_text(text):
+    tokens = []
+    for tok in _TOKEN_RE.findall((text or "").lower()):
+        if tok in FILLER_WORDS:
+            continue
+        if len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss") and not tok[0].isdigit():
+            tok = tok[:-1]
+        tokens.append(tok)
+    return " ".join(tokens)
+
+
+def normalize_location(location):
+    text = " ".join(re.findall(r"[a-z0-9]+", (location or "").lower()))
+    for suffix in LOCATION_SUFFIXES:
+        if text.endswith(" " + suffix):
+            text = text[:-len(suffix) - 1]
+            break
+    return text
+
+
+def is_follow_up(text, history=None):
+    """True if the message only makes sense with the earlier conversation."""
+    if not any(item.get("role") == "user" for item in history or []):
+        return False
+    lowered = (text or "").lower().strip()
+    if topic_classifier.is_confirmation(lowered) or lowered.startswith(FOLLOW_UP_OPENERS):
+        return True
+    words = set(_TOKEN_RE.findall(lowered))
+    return bool(words & REFERENCE_WORDS) or len(normalize_text(lowered).split()) < 3
+
+
+class HashingEmbedder:
+    """Hashed unigram + bigram counts, L2-normalized."""
+
+    def embed(self, text):
+        tokens = text.split()
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(HASH_DIM, dtype=np.float32)
+        for feature in features:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % HASH_DIM] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def embed(self, text):
+        return self.model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+
+def create_embedder():
+    if np is None:
+        print("Semantic response cache needs numpy; using exact matches only")
+        return None
+    if RESPONSE_CACHE_EMBED_MODEL:
+        try:
+            return SentenceTransformerEmbedder(RESPONSE_CACHE_EMBED_MODEL)
+        except Exception as e:
+            print(f"Couldn't load embedding model {RESPONSE_CACHE_EMBED_MODEL}: {e}; using hashed embeddings")
+    return HashingEmbedder()
+
+
+class ResponseCache:
+    def __init__(self, maxsize=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL,
+                 semantic=RESPONSE_CACHE_SEMANTIC, similarity=RESPONSE_CACHE_SIMILARITY):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity = similarity
+        self.embedder = create_embedder() if semantic else None
+        # key -> {"topic", "scope", "text", "numbers", "vector", "value", "expires_at"}
+        self._entries = OrderedDict()
+        # (topic, location) -> {key: vector}; the semantic tier only searches its own scope
+        self._index = {}
+        self._lock = threading.Lock()
+        self.counters = {"hits_exact": 0, "hits_semantic": 0, "misses": 0, "skipped": 0,
+                         "stores": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def key_for(topic, location, text):
+        return (topic, normalize_location(location), normalize_text(text))
+
+    def _remove(self, key):
+        # Caller holds self._lock
+        entry = self._entries.pop(key)
+        scope = self._index.get(entry["scope"])
+        if scope is not None:
+            scope.pop(key, None)
+            if not scope:
+                del self._index[entry["scope"]]
+
+    def get(self, topic, location, text):
+        """Returns (value, tier) on a hit, where tier is "exact" or "semantic", else (None, None)."""
+        key = self.key_for(topic, location, text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits_exact"] += 1
+                return entry["value"], "exact"
+            candidates = dict(self._index.get(key[:2], {}))
+
+        if self.embedder is not None and candidates:
+            match = self._nearest(key[2], candidates)
+            with self._lock:
+                entry = self._entries.get(match) if match else None
+                if entry is not None and entry["expires_at"] > now:
+                    self._entries.move_to_end(match)
+                    self.counters["hits_semantic"] += 1
+                    return entry["value"], "semantic"
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None, None
+
+    def _nearest(self, text, candidates):
+        keys = list(candidates)
+        scores = np.stack([candidates[k] for k in keys]) @ self.embedder.embed(text)
+        numbers = _NUMBER_RE.findall(text)
+        for i in np.argsort(-scores):
+            if scores[i] < self.similarity:
+                break
+            if _NUMBER_RE.findall(keys[i][2]) == numbers:
+                return keys[i]
+        return None
+
+    def set(self, topic, location, text, value):
+        key = self.key_for(topic, location, text)
+        vector = self.embedder.embed(key[2]) if self.embedder is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {"scope": key[:2], "value": value, "expires_at": time.time() + self.ttl}
+            if vector is not None:
+                self._index.setdefault(key[:2], {})[key] = vector
+            self.counters["stores"] += 1
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.counters["evictions"] += 1
+
+    def record_skip(self):
+        with self._lock:
+            self.counters["skipped"] += 1
+
+    def invalidate(self, topic=None):
+        """Drop every entry for `topic`, or everything if topic is None. Returns how many went."""
+        with self._lock:
+            keys = [k for k in self._entries if topic is None or k[0] == topic]
+            for key in keys:
+                self._remove(key)
+            self.counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters["hits_exact"] + self.counters["hits_semantic"]
+            lookups = hits + self.counters["misses"]
+            by_topic = {}
+            for key in self._entries:
+                by_topic[key[0]] = by_topic.get(key[0], 0) + 1
+            return {
+                **self.counters,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "by_topic": by_topic,
+                "semantic": self.embedder is not None,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,243 @@
+"""
+Session storage for /chat.
+
+Replaces the old module-level `sessions = {}` dict in app.py. A session is a
+small metadata dict (last_topic, ...) plus the conversation history returned by
+run_workflow. History is stored as zlib-compressed JSON and only decoded when
+something actually reads `Session.history`, so metadata lookups stay cheap.
+
+Backends:
+  - MemorySessionStore: bounded LRU with TTL, per process
+  - SQLiteSessionStore: single file, shared by every worker on the box
+  - RedisSessionStore:  any Redis-compatible client, shared across boxes
+
+Pick one with ECOBOT_SESSION_STORE=memory|sqlite|redis.
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ECOBOT_SESSION_STORE = os.environ.get("ECOBOT_SESSION_STORE", "memory")
+ECOBOT_SESSION_TTL = float(os.environ.get("ECOBOT_SESSION_TTL", str(24 * 3600)))
+ECOBOT_SESSION_MAX = int(os.environ.get("ECOBOT_SESSION_MAX", "1000"))
+ECOBOT_SESSION_DB = os.environ.get("ECOBOT_SESSION_DB", os.path.join(BASE_DIR, 'logs', 'sessions.sqlite3'))
+ECOBOT_REDIS_URL = os.environ.get("ECOBOT_REDIS_URL", "redis://localhost:6379/0")
+
+
+def encode_history(history):
+    return zlib.compress(json.dumps(history, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_history(blob):
+    if not blob:
+        return []
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+class Session:
+    """A loaded session. `history` is decoded on first access."""
+
+    def __init__(self, session_id, meta, history_loader):
+        self.session_id = session_id
+        self.meta = meta
+        self._history_loader = history_loader
+        self._history = None
+
+    @property
+    def history(self):
+        if self._history is None:
+            self._history = self._history_loader()
+        return self._history
+
+    def get(self, key, default=None):
+        return self.meta.get(key, default)
+
+
+class SessionStore:
+    """Interface every backend implements."""
+
+    def load(self, session_id):
+        """Returns a Session, or None if the session doesn't exist or has expired."""
+        raise NotImplementedError
+
+    def save(self, session_id, history, **meta):
+        """Replace the stored history and merge `meta` into the session metadata."""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"backend": type(self).__name__}
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, maxsize=ECOBOT_SESSION_MAX, ttl=ECOBOT_SESSION_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # session_id -> (expires_at, meta, history_blob)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def load(self, session_id):
+        with self._lock:
+            item = self._data.get(session_id)
+            if item is None:
+                return None
+            expires_at, meta, blob = item
+            if expires_at <= time.time():
+                del self._data[session_id]
+                return None
+            self._data.move_to_end(session_id)
+        return Session(session_id, dict(meta), lambda: decode_history(blob))
+
+    def save(self, session_id, history, **meta):
+        blob = encode_history(history)
+        with self._lock:
+            old = self._data.get(session_id)
+            merged = {**(old[1] if old else {}), **meta}
+            self._data[session_id] = (time.time() + self.ttl, merged, blob)
+            self._data.move_to_end(session_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._data),
+                "maxsize": self.maxsize,
+                "evictions": self.evictions,
+                "history_bytes": sum(len(item[2]) for item in self._data.values()),
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path=ECOBOT_SESSION_DB, ttl=ECOBOT_SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, meta TEXT NOT NULL, history BLOB,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_at)")
+        self._conn.commit()
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT meta FROM sessions WHERE session_id = ? AND expires_at > ?", (session_id, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return Session(session_id, json.loads(row[0]), lambda: self._load_history(session_id))
+
+    def _load_history(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT history FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return decode_history(row[0]) if row else []
+
+    def save(self, session_id, history, **meta):
+        blob = encode_history(history)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT meta FROM sessions WHERE session_id = ? AND expires_at > ?", (session_id, now)
+            ).fetchone()
+            merged = {**(json.loads(row[0]) if row else {}), **meta}
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, meta, history, expires_at) VALUES (?, ?, ?, ?)",
+                (session_id, json.dumps(merged), blob, now + self.ttl)
+            )
+            # Cheap housekeeping so expired sessions don't pile up on disk
+            self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(history)), 0) FROM sessions WHERE expires_at > ?", (time.time(),)
+            ).fetchone()
+        return {"backend": "sqlite", "path": self.path, "sessions": count, "history_bytes": size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Works with redis-py or anything exposing get(key), set(key, value, ex=seconds)
+    and delete(*keys), e.g. fakeredis for local testing.
+    Metadata and history live under separate keys so loading a session only
+    fetches the history when it's read.
+    """
+
+    def __init__(self, client, ttl=ECOBOT_SESSION_TTL, prefix="ecobot:session:"):
+        self.client = client
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def _keys(self, session_id):
+        return f"{self.prefix}{session_id}:meta", f"{self.prefix}{session_id}:history"
+
+    def load(self, session_id):
+        meta_key, history_key = self._keys(session_id)
+        raw = self.client.get(meta_key)
+        if raw is None:
+            return None
+        return Session(session_id, json.loads(raw), lambda: decode_history(self.client.get(history_key)))
+
+    def save(self, session_id, history, **meta):
+        meta_key, history_key = self._keys(session_id)
+        raw = self.client.get(meta_key)
+        merged = {**(json.loads(raw) if raw else {}), **meta}
+        self.client.set(history_key, encode_history(history), ex=self.ttl)
+        self.client.set(meta_key, json.dumps(merged), ex=self.ttl)
+
+    def delete(self, session_id):
+        self.client.delete(*self._keys(session_id))
+
+    def stats(self):
+        return {"backend": "redis", "prefix": self.prefix}
+
+    def close(self):
+        close = getattr(self.client, "close", None)
+        if close:
+            close()
+
+
+def create_session_store(backend=ECOBOT_SESSION_STORE):
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "redis":
+        import redis
+        return RedisSessionStore(redis.Redis.from_url(ECOBOT_REDIS_URL))
+    raise ValueError(f"Unknown ECOBOT_SESSION_STORE: {backend}")
@@ -0,0 +1,282 @@
+"""
+Topic -> specialist routing.
+
+The specialists live in a registry instead of one `if classifier == ...`
+branch each, so a new topic is one register() call, and labels the classifier
+agent invents ("Transportation", "electricity") still find their specialist
+through aliases.
+
+The classifier returns a score per topic. When the top two are within
+ECOBOT_SPECULATIVE_MARGIN of each other both specialists start at once
+(speculative dispatch): each is told to answer just OFF_TOPIC if the question
+isn't theirs, the first one in score order that starts a real answer wins,
+and the other run is cancelled. So an ambiguous question costs a few extra
+tokens instead of a wrong answer and a re-ask.
+
+    ECOBOT_SPECULATIVE_DISPATCH  1/0 (default 1)
+    ECOBOT_SPECULATIVE_MARGIN    score gap below which the runner-up also runs (default 0.25)
+
+A cancelled run reports no usage, so the loser's tokens aren't in the cost
+figures; /stats "routing" shows how often a race happens and who wins.
+"""
+import os
+import re
+import asyncio
+import threading
+
+from agents import Runner
+from openai.types.responses import ResponseTextDeltaEvent
+
+SPECULATIVE_DISPATCH = os.environ.get("ECOBOT_SPECULATIVE_DISPATCH", "1") != "0"
+SPECULATIVE_MARGIN = float(os.environ.get("ECOBOT_SPECULATIVE_MARGIN", "0.25"))
+
+OFF_TOPIC_MARKER = "OFF_TOPIC"
+OFF_TOPIC_NOTE = """
+
+# Routing
+This question may have been sent to more than one specialist. If it has nothing to do with {topic}, reply with exactly OFF_TOPIC and nothing else, before searching. Otherwise answer normally."""
+
+UNROUTABLE_REPLY = ("I can help with the environmental impact of food, water, transport and energy. "
+                    "Could you tell me which of those your question is about?")
+
+_LABEL_RE = re.compile(r"[a-z]+")
+
+
+class SpecialistRegistry:
+    def __init__(self):
+        self._agents = {}
+        self._speculative = {}
+        self._aliases = {}
+
+    def register(self, topic, agent, aliases=()):
+        self._agents[topic] = agent
+        # Variant used when racing another specialist: same agent, plus the OFF_TOPIC rule
+        self._speculative[topic] = agent.clone(instructions=agent.instructions + OFF_TOPIC_NOTE.format(topic=topic))
+        for alias in (topic, *aliases):
+            self._aliases[alias] = topic
+
+    @property
+    def topics(self):
+        return tuple(self._agents)
+
+    def __contains__(self, topic):
+        return topic in self._agents
+
+    def get(self, topic, speculative=False):
+        return (self._speculative if speculative else self._agents).get(topic)
+
+    def resolve(self, label):
+        """Registered topic for a classifier label, or None."""
+        words = _LABEL_RE.findall((label or "").lower())
+        for word in words:
+            if word in self._aliases:
+                return self._aliases[word]
+        for word in words:
+            # "transportation", "electricity"-style inflections of an alias
+            for alias, topic in self._aliases.items():
+                if len(alias) >= 4 and word.startswith(alias):
+                    return topic
+        return None
+
+
+class TopicDistribution:
+    """Normalized confidence per registered topic. `prefer` wins ties."""
+
+    def __init__(self, scores, source, prefer=None):
+        total = sum(max(0.0, value) for value in scores.values())
+        self.scores = {topic: max(0.0, value) / total for topic, value in scores.items()} if total else {}
+        self.source = source
+        self.prefer = prefer
+
+    def ranked(self):
+        return sorted(self.scores.items(), key=lambda item: (item[1], item[0] == self.prefer), reverse=True)
+
+    @property
+    def top(self):
+        ranked = self.ranked()
+        return ranked[0][0] if ranked else None
+
+    @property
+    def margin(self):
+        ranked = self.ranked()
+        if len(ranked) < 2:
+            return 1.0 if ranked else 0.0
+        return ranked[0][1] - ranked[1][1]
+
+    def candidates(self, speculative=SPECULATIVE_DISPATCH, margin=SPECULATIVE_MARGIN):
+        """Topics to dispatch, best first: the top one, plus the runner-up when it's close."""
+        ranked = [topic for topic, score in self.ranked() if score > 0]
+        if speculative and len(ranked) > 1 and self.margin < margin:
+            return ranked[:2]
+        return ranked[:1]
+
+    def as_dict(self):
+        return {"scores": {topic: round(score, 3) for topic, score in self.ranked()},
+                "margin": round(self.margin, 3), "source": self.source}
+
+
+def distribution_from_label(registry, label, source):
+    """All confidence on one label's topic (empty if it doesn't resolve)."""
+    topic = registry.resolve(label)
+    return TopicDistribution({topic: 1.0} if topic else {}, source, prefer=topic)
+
+
+def distribution_from_classifier(registry, parsed, local_proba=None):
+    """
+    Topic distribution from the classifier agent's output ({"classifier", "scores"}).
+    Falls back to its label alone, then to the local model's probabilities.
+    """
+    scores = {}
+    for label, value in (parsed.get("scores") or {}).items():
+        topic = registry.resolve(label)
+        if topic is not None and isinstance(value, (int, float)):
+            scores[topic] = scores.get(topic, 0.0) + float(value)
+    label_topic = registry.resolve(parsed.get("classifier"))
+    if scores and sum(scores.values()) > 0:
+        # A label that disagrees with its own scores ties with the top score,
+        # so both get dispatched
+        if label_topic is not None and scores.get(label_topic, 0.0) < max(scores.values()):
+            scores[label_topic] = max(scores.values())
+        return TopicDistribution(scores, "agent", prefer=label_topic)
+    if label_topic is not None:
+        return TopicDistribution({label_topic: 1.0}, "agent", prefer=label_topic)
+    if local_proba:
+        return TopicDistribution({t: p for t, p in local_proba.items() if t in registry}, "local")
+    return TopicDistribution({}, "none")
+
+
+class RouterStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"single": 0, "speculative": 0, "primary_won": 0, "runner_up_won": 0,
+                       "both_off_topic": 0, "unroutable": 0, "aliased": 0}
+
+    def record(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self.counts)
+        raced = counts["speculative"]
+        counts["runner_up_win_rate"] = round(counts["runner_up_won"] / raced, 4) if raced else 0.0
+        return counts
+
+
+stats = RouterStats()
+
+
+class SpecialistRace:
+    """
+    Streams candidate specialists concurrently. A candidate commits once its
+    output can no longer be OFF_TOPIC; the winner is the first candidate in
+    order that commits after every earlier one has declined. Everyone else is
+    cancelled. Iterate deltas(); `winner` is set before the first delta and
+    `result` (the winner's streamed run) once it's done.
+    """
+
+    def __init__(self, registry, topics, input_for, run_config):
+        self.registry = registry
+        self.topics = topics
+        self.input_for = input_for
+        self.run_config = run_config
+        self.winner = None
+        self.result = None
+        self.off_topic = []
+
+    async def _pump(self, index, result, queue):
+        try:
+            async for event in result.stream_events():
+                if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                    await queue.put((index, "delta", event.data.delta))
+            await queue.put((index, "end", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put((index, "error", e))
+
+    def _decision(self, text, ended):
+        """'off', 'on' or None (can't tell yet) for a candidate's output so far."""
+        stripped = text.lstrip()
+        if stripped.startswith(OFF_TOPIC_MARKER):
+            return "off"
+        if OFF_TOPIC_MARKER.startswith(stripped) and not ended:
+            return None
+        return "on" if stripped or ended else None
+
+    async def deltas(self):
+        queue = asyncio.Queue()
+        results, tasks = [], []
+        for index, topic in enumerate(self.topics):
+            agent = self.registry.get(topic, speculative=True)
+            result = Runner.run_streamed(agent, input=self.input_for(topic), run_config=self.run_config)
+            results.append(result)
+            tasks.append(asyncio.create_task(self._pump(index, result, queue)))
+
+        buffers = [""] * len(self.topics)
+        ended = [False] * len(self.topics)
+        decisions = [None] * len(self.topics)
+        errors = [None] * len(self.topics)
+        winner = None
+        completed = False
+        try:
+            while not all(ended):
+                index, kind, payload = await queue.get()
+                if kind == "error":
+                    if index == winner:
+                        raise payload
+                    # A candidate that fails before committing just drops out
+                    ended[index], errors[index], decisions[index] = True, payload, "off"
+                elif kind == "end":
+                    ended[index] = True
+                elif winner is None:
+                    buffers[index] += payload
+                else:
+                    if index == winner:
+                        yield payload
+                    continue
+
+                if winner is None:
+                    for i in range(len(self.topics)):
+                        if decisions[i] is None:
+                            decisions[i] = self._decision(buffers[i], ended[i])
+                    # First candidate in order that's on topic, with all earlier ones off
+                    for i, decision in enumerate(decisions):
+                        if decision == "on":
+                            winner = i
+                            break
+                        if decision != "off":
+                            break
+                    if winner is not None:
+                        self.winner = self.topics[winner]
+                        self._cancel(results, tasks, keep=winner)
+                        if buffers[winner]:
+                            yield buffers[winner]
+                    elif all(decision == "off" for decision in decisions):
+                        break
+                if winner is not None and ended[winner]:
+                    break
+            completed = True
+        finally:
+            # On an early exit (client gone, error) the winner is cancelled too
+            self._cancel(results, tasks, keep=winner if completed else None)
+
+        # Candidates that declined (as opposed to failing)
+        self.off_topic = [topic for topic, decision, error in zip(self.topics, decisions, errors)
+                          if decision == "off" and error is None]
+        if winner is None:
+            if all(error is not None for error in errors):
+                raise errors[0]
+            stats.record("both_off_topic")
+            return
+        stats.record("primary_won" if winner == 0 else "runner_up_won")
+        await tasks[winner]
+        self.result = results[winner]
+
+    @staticmethod
+    def _cancel(results, tasks, keep=None):
+        for i, (result, task) in enumerate(zip(results, tasks)):
+            if i == keep or task.done():
+                continue
+            result.cancel()
+            task.cancel()
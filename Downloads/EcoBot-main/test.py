@@ -1,13 +1,28 @@
 
 import os
+import json
+import asyncio
 from dotenv import load_dotenv
 
 load_dotenv()
-from agents import WebSearchTool, Agent, ModelSettings, TResponseInputItem, Runner, RunConfig, trace, function_tool
-import requests
-from openai import AsyncOpenAI
+from agents import WebSearchTool, Agent, TResponseInputItem, Runner, RunConfig, trace, function_tool
+from openai.types.responses import ResponseTextDeltaEvent
 from pydantic import BaseModel
 
+import chart_payload
+import emission_factors
+import epa_client
+import gazetteer
+import history_compaction
+import model_profiles
+import openai_clients
+import response_cache
+import specialist_router
+from location_cache import get_location_cache
+import topic_classifier
+import usage_accounting
+import pipeline_tracing
+
 # OpenAI API Key Configuration
 # The API key can be set via environment variable OPENAI_API_KEY
 # or by setting it directly here (not recommended for production)
@@ -22,15 +37,17 @@ if not openai_api_key:
 # Set OpenAI API key in environment for the agents library
 os.environ["OPENAI_API_KEY"] = openai_api_key
 
+# Run location verification and topic classification concurrently (see run_workflow)
+PARALLEL_PRE_ROUTING = os.environ.get("ECOBOT_PARALLEL_PREROUTING", "1") != "0"
+
 # Tool definitions
 web_search_preview = WebSearchTool()
 
 
-# Shared client for file search
-client = AsyncOpenAI(api_key=openai_api_key)
+# Model calls go through the pooled client registry in openai_clients.py
 
 @function_tool
-def get_epa_water_data(latitude: float, longitude: float) -> str:
+async def get_epa_water_data(latitude: float, longitude: float) -> str:
     """
     Retrieves water data from the US EPA WATERS API for a given location.
     
@@ -41,81 +58,66 @@ def get_epa_water_data(latitude: float, longitude: float) -> str:
     Returns:
         A formatted string containing watershed and water quality information.
     """
-    api_key = "o7ZrdC4v7szpnwtdMehDlOv03JqtvAkYOyOVeaO7"
-    base_url = "https://api.epa.gov/waters"
-    
-    import json
     try:
-        # Step 1: Use Upstream/Downstream service which is more robust for finding features
-        # We will look for Downstream Main endpoint to see where water goes, identifying the local stream.
-        ud_url = f"{base_url}/v4/upstreamdownstream"
-        start_point = {
-            "type": "Point",
-            "coordinates": [longitude, latitude]
-        }
-        
-        ud_params = {
-            "start_point": json.dumps(start_point),
-            "navigation_type": "DM", # Downstream Main
-            "api_key": api_key
-        }
-        
-        
-        # print(f"DEBUG: Querying UD Service with {ud_params}")
-        resp = requests.get(ud_url, params=ud_params)
-        # print(f"DEBUG: UD Response Status: {resp.status_code}")
-        
-        output_parts = []
-        
-        if resp.status_code == 200:
-            data = resp.json()
-            # print(f"DEBUG: UD Response Data: {data}")
-            
-            # The output usually contains a list of features 'output'
-            if "output" in data and data["output"]:
-                # The first feature is usually the starting point or nearby
-                # We want to extract ComID to get StreamCat data
-                # Identify COMID from features. 
-                # Feature structure typically has 'properties' -> 'COMID'
-                
-                # Let's collect some info
-                features = data["output"]["features"]
-                if features:
-                    # Get the nearest feature (first one?)
-                    first_feature = features[0]
-                    props = first_feature.get("properties", {})
-                    comid = props.get("COMID") or props.get("comid")
-                    
-                    output_parts.append(f"Found nearby water feature: {props.get('GNIS_NAME', 'Unnamed Stream')} (COMID: {comid})")
-                    
-                    if comid:
-                         # Step 2: Get StreamCat data
-                        streamcat_url = f"{base_url}/v2_5/streamcat_json"
-                        streamcat_params = {
-                            "comid": comid,
-                            "api_key": api_key
-                        }
-                        
-                        streamcat_resp = requests.get(streamcat_url, params=streamcat_params)
-                        if streamcat_resp.status_code == 200:
-                            streamcat_data = streamcat_resp.json()
-                            output_parts.append(f"Watershed Metrics: {str(streamcat_data)[:500]}...") # Truncate for now
-                        else:
-                             output_parts.append("Could not retrieve StreamCat data.")
-                else:
-                     output_parts.append("No water features found (empty feature list).")
-            else:
-                 output_parts.append("No water features found in response.")
-        else:
-            output_parts.append(f"Error querying EPA API: {resp.text}")
-             
-        return "\n".join(output_parts)
-
+        # Upstream/Downstream navigation to find the local stream, then StreamCat
+        # metrics for its COMID. Both calls are async and share a pooled client.
+        with pipeline_tracing.span("tool:get_epa_water_data"):
+            return await epa_client.fetch_water_data(latitude, longitude)
     except Exception as e:
         return f"Error querying EPA WATERS API: {str(e)}"
 
+@function_tool
+def geocode_location(location: str) -> str:
+    """
+    Looks up the latitude and longitude of a place in EcoBot's local gazetteer.
+
+    Args:
+        location: The place as "City, State, Country", e.g. "Omaha, NE, USA".
+
+    Returns:
+        JSON with latitude, longitude, name, admin1 (state) and country, or found false if the place isn't in the gazetteer.
+    """
+    with pipeline_tracing.span("tool:geocode_location"):
+        place = gazetteer.get_gazetteer().geocode(location)
+    return json.dumps(place or {"found": False, "location": location})
+
+class EmissionActivity(BaseModel):
+  item: str
+  amount: float
+  unit: str
+  per: str
+
+
+@function_tool
+def calculate_emissions(category: str, activities: list[EmissionActivity], location: str) -> str:
+    """
+    Calculates CO2 emissions from EcoBot's emissions-factor dataset (EPA, EIA, eGRID, OWID).
+
+    Args:
+        category: One of food, fuel, electricity or transport.
+        activities: What the user consumes. item is e.g. "beef", "gasoline", "natural gas", "electricity", "car", "bus", "flight"; unit is e.g. kg, lb, gallon, liter, therm, kwh, mile, km; per is once, day, week, month or year.
+        location: The user's location, e.g. "Omaha, NE, USA", for the regional electricity grid. Empty if unknown.
+
+    Returns:
+        JSON with kg CO2 per occurrence and per year for each activity, the yearly total, the US average where known, and the source of every factor.
+    """
+    with pipeline_tracing.span("tool:calculate_emissions"):
+        result = emission_factors.get_emission_factors().calculate(
+          category, [activity.model_dump() for activity in activities], location
+        )
+    return json.dumps(result)
+
+class TopicScores(BaseModel):
+  food: float
+  water: float
+  transport: float
+  energy: float
+
+
 class TopicClassifierAgentSchema(BaseModel):
   classifier: str
+  # Confidence per topic; close scores make run_workflow try two specialists
+  scores: TopicScores
 
 
 class LocationVerificationSchema(BaseModel):
@@ -130,15 +132,9 @@ topic_classifier_agent = Agent(
 - transport
 - energy
 
-Provide just the topic name as the output. Do not run this agent until the full query with the location is provided from the previous location verification agent.""",
-  model="gpt-4.1",
+Provide just the topic name as the classifier output, and in scores your confidence (0 to 1, summing to 1) that the question belongs to each topic. Do not run this agent until the full query with the location is provided from the previous location verification agent.""",
   output_type=TopicClassifierAgentSchema,
-  model_settings=ModelSettings(
-    temperature=1,
-    top_p=1,
-    max_tokens=2048,
-    store=True
-  )
+  **model_profiles.agent_settings("classifier")
 )
 
 food = Agent(
@@ -175,6 +171,9 @@ https://patents.google.com/patent/WO2024214112A1
 - Use emojis sparingly to make it friendly only if appropriate.
 - Prioritize current and accurate information.
 
+# Emission Factors
+Use the calculate_emissions tool for every CO2 number in your answer instead of working out emission factors yourself: pass what the user consumes, how much and how often, and the user's location. Cite the source it returns for each factor (e.g. [Source: US EPA eGRID2022]) and use its average for the comparison. Only fall back to the sources below for figures the tool doesn't cover.
+
 # Chart Output
 If you make a comparison (e.g., User's impact vs Average), you MUST append a JSON block at the VERY END of your response (after all text).
 Format:
@@ -210,13 +209,8 @@ https://fred.stlouisfed.org/series/EMISSCO2TOTVTCTOUSA
 - Always answer in the role of a specialist.
 - Do not mention the web search process or reference how information was found.
 - Prioritize current and accurate information in your response.""",
-  model="gpt-4.1",
-  model_settings=ModelSettings(
-    temperature=1,
-    top_p=1,
-    max_tokens=2048,
-    store=True
-  )
+  tools=[calculate_emissions],
+  **model_profiles.agent_settings("food", base="specialist")
 )
 
 
@@ -237,14 +231,8 @@ Output in JSON format as:
 "location": "[City, State, Country] or empty string"
 }
 """,
-  model="gpt-4.1",
   output_type=LocationVerificationSchema,
-  model_settings=ModelSettings(
-    temperature=1,
-    top_p=1,
-    max_tokens=2048,
-    store=True
-  )
+  **model_profiles.agent_settings("location")
 )
 
 
@@ -279,6 +267,9 @@ Only answer from the websites provided below; do not answer using any other data
 - Keep paragraphs short (2-3 sentences max).
 - Prioritize current and accurate information.
 
+# Emission Factors
+Use the calculate_emissions tool for every CO2 number in your answer instead of working out emission factors yourself: pass what the user consumes, how much and how often, and the user's location. Cite the source it returns for each factor (e.g. [Source: US EPA eGRID2022]) and use its average for the comparison. Only fall back to the sources below for figures the tool doesn't cover.
+
 # Chart Output
 If you make a comparison (e.g., User's impact vs Average), you MUST append a JSON block at the VERY END of your response (after all text).
 Format:
@@ -315,13 +306,8 @@ Offer scientifically grounded suggestions on how the user can lower their co2 fo
 - Always answer in the role of a specialist.
 - Do not mention the web search process or reference how information was found.
 - Prioritize current and accurate information in your response.""",
-  model="gpt-4.1",
-  model_settings=ModelSettings(
-    temperature=1,
-    top_p=1,
-    max_tokens=2048,
-    store=True
-  )
+  tools=[calculate_emissions],
+  **model_profiles.agent_settings("energy", base="specialist")
 )
 
 
@@ -356,6 +342,9 @@ Only answer from the websites provided below; do not answer using any other data
 - Keep paragraphs short (2-3 sentences max).
 - Prioritize current and accurate information.
 
+# Emission Factors
+Use the calculate_emissions tool for every CO2 number in your answer instead of working out emission factors yourself: pass what the user consumes, how much and how often, and the user's location. Cite the source it returns for each factor (e.g. [Source: US EPA eGRID2022]) and use its average for the comparison. Only fall back to the sources below for figures the tool doesn't cover.
+
 # Chart Output
 If you make a comparison (e.g., User's impact vs Average), you MUST append a JSON block at the VERY END of your response (after all text).
 Format:
@@ -392,13 +381,8 @@ https://fred.stlouisfed.org/series/EMISSCO2TOTVTCTOUSA
 - Always answer in the role of a specialist.
 - Do not mention the web search process or reference how information was found.
 - Prioritize current and accurate information in your response.""",
-  model="gpt-4.1",
-  model_settings=ModelSettings(
-    temperature=1,
-    top_p=1,
-    max_tokens=2048,
-    store=True
-  )
+  tools=[calculate_emissions],
+  **model_profiles.agent_settings("transport", base="specialist")
 )
 
 
@@ -418,7 +402,7 @@ water = Agent(
 **CRITICAL: You must EXPLICITLY cite the source for EVERY piece of data or fact you mention. Use the format [Source: URL or Name]. Do NOT use any external knowledge.**
 
 You have access to the EPA WATERS API via the `get_epa_water_data` tool. Use this tool to get detailed information about local water sheds and quality if the user provides a US location.
-1. First, use the `web_search_preview` tool to find the latitude and longitude of the city/location provided by the user.
+1. First, get the latitude and longitude of the user's location: use the coordinates given in the conversation if there are any, otherwise the `geocode_location` tool. Only if it doesn't find the place, use `web_search_preview` to look them up.
 2. Then, use `get_epa_water_data` with these coordinates.
 3. **Strictly cite the EPA API for any data retrieved from it.**
 4. Incorporate the findings from the EPA API and the droughtmonitor.unl.edu website into your response.
@@ -451,14 +435,8 @@ Format:
 }
 ```
 """,
-  model="gpt-4.1",
-  tools=[web_search_preview, get_epa_water_data],
-  model_settings=ModelSettings(
-    temperature=1,
-    top_p=1,
-    max_tokens=2048,
-    store=True
-  )
+  tools=[web_search_preview, geocode_location, get_epa_water_data],
+  **model_profiles.agent_settings("water", base="specialist")
 )
 
 
@@ -469,29 +447,90 @@ class WorkflowInput(BaseModel):
   input_as_text: str
   history: list[TResponseInputItem] | None = None
   previous_topic: str | None = None
+  previous_location: str | None = None
+
+
+# Helper to safe-guard against model_dump errors
+def safe_model_dump(obj):
+    if hasattr(obj, 'model_dump'):
+        # usage of mode='json' ensures we get python primitives (dicts/lists) 
+        # instead of any internal pydantic iterators or custom types
+        return obj.model_dump(mode='json')
+    if isinstance(obj, dict):
+        return obj
+    return {}
+
+def safe_model_dump_json(obj):
+    if hasattr(obj, 'model_dump_json'):
+        return obj.model_dump_json()
+    import json
+    if isinstance(obj, dict):
+        return json.dumps(obj)
+    return str(obj)
 
 
-# Main code entrypoint
-async def run_workflow(workflow_input: WorkflowInput):
-  with trace("Cameron"):
-    # Helper to safe-guard against model_dump errors
-    def safe_model_dump(obj):
-        if hasattr(obj, 'model_dump'):
-            # usage of mode='json' ensures we get python primitives (dicts/lists) 
-            # instead of any internal pydantic iterators or custom types
-            return obj.model_dump(mode='json')
-        if isinstance(obj, dict):
-            return obj
-        return {}
-
-    def safe_model_dump_json(obj):
-        if hasattr(obj, 'model_dump_json'):
-            return obj.model_dump_json()
-        import json
-        if isinstance(obj, dict):
-            return json.dumps(obj)
-        return str(obj)
+def web_search_count(result):
+  return sum(1 for item in result.new_items if getattr(getattr(item, "raw_item", None), "type", None) == "web_search_call")
+
+
+def workflow_run_config():
+  # Pooled client for this event loop instead of a new one per Runner.run
+  return RunConfig(model_provider=openai_clients.model_provider(), trace_metadata={
+    "__trace_source__": "agent-builder",
+    "workflow_id": "wf_68f94a7e17d48190b601b55060f7be580cd9f85a9a7b9c30"
+  })
+
+
+# Specialist agent for each topic, plus labels the classifier sometimes uses
+# instead of the topic name (see specialist_router.py)
+SPECIALISTS = specialist_router.SpecialistRegistry()
+SPECIALISTS.register("water", water, aliases=("watershed", "drought", "irrigation"))
+SPECIALISTS.register("food", food, aliases=("diet", "meal", "agriculture", "dairy", "meat"))
+SPECIALISTS.register("transport", transport, aliases=("transit", "travel", "commute", "driving", "vehicle", "flight"))
+SPECIALISTS.register("energy", energy, aliases=("electricity", "power", "heating", "utilities", "solar"))
+
+
+# Response cache (see response_cache.py). Only questions that stand on their
+# own, with a known topic and location, are looked up or stored.
+def cacheable(workflow_input: WorkflowInput, state):
+  return (
+    response_cache.RESPONSE_CACHE_ENABLED
+    and state["classifier"] in SPECIALISTS
+    and bool(state["extracted_location"])
+    and not response_cache.is_follow_up(workflow_input.input_as_text, workflow_input.history)
+  )
+
+
+def cached_response(workflow_input: WorkflowInput, state):
+  """The run_workflow result for a cache hit, or None."""
+  cache = response_cache.get_response_cache()
+  if not cacheable(workflow_input, state):
+    if response_cache.RESPONSE_CACHE_ENABLED:
+      cache.record_skip()
+    return None
+  value, tier = cache.get(state["classifier"], state["extracted_location"], workflow_input.input_as_text)
+  if value is None:
+    return None
+  conversation_history = state["conversation_history"]
+  conversation_history.append({
+    "role": "assistant",
+    "content": [{"type": "output_text", "text": value["output_text"]}]
+  })
+  return {**workflow_result(state, value["output_text"], value["chart"]), "cache": tier}
+
+
+def store_cached_response(workflow_input: WorkflowInput, state, output_text, chart):
+  if output_text and cacheable(workflow_input, state):
+    response_cache.get_response_cache().set(
+      state["classifier"], state["extracted_location"], workflow_input.input_as_text,
+      {"output_text": output_text, "chart": chart}
+    )
 
+
+# Everything before the specialist: history setup, confirmation handling,
+# location verification and topic classification. Shared by run_workflow
+# and run_workflow_streamed.
+async def run_pre_routing(workflow_input: WorkflowInput):
     workflow = safe_model_dump(workflow_input)
     
     # Initialize with history if provided, otherwise start fresh
@@ -517,13 +556,13 @@ async def run_workflow(workflow_input: WorkflowInput):
     
     classifier = None
     target_topic = workflow.get("previous_topic")
-    user_input_lower = workflow["input_as_text"].lower()
-    
-    confirmation_keywords = ["yes", "please", "comprehensive", "detail", "sure", "ok", "okay", "yeah"]
-    is_confirmation = any(keyword in user_input_lower for keyword in confirmation_keywords)
+    # Whole words only ("yesterday" isn't a yes), same check the classifier and cache use
+    is_confirmation = topic_classifier.is_confirmation(workflow["input_as_text"])
     
+    distribution = None
     if target_topic and is_confirmation:
         classifier = target_topic
+        distribution = specialist_router.distribution_from_label(SPECIALISTS, target_topic, "session")
         # Add a hint to the agent that they should provide detailed analysis
         conversation_history.append({
             "role": "system",
@@ -531,50 +570,105 @@ async def run_workflow(workflow_input: WorkflowInput):
         })
     
     
-    # Step 1: Run location verification agent (only if we don't know potential classifier yet or just to be safe, 
-    # but actually we might want to skip if we are just continuing? 
-    # Let's run it to capture any new location info or keep context, but verification is cheap)
-    # Actually, if we are confirming, we probably don't need re-verification but let's keep it simple.
+    # Local fast path: unambiguous queries ("i eat beef 3x a week") get their
+    # topic from the local classifier and skip the classifier agent entirely.
+    # A small shadow sample still goes to the agent so we can track disagreement.
+    local_topic = None
+    local_confident = False
+    local_proba = None
+    if not classifier and topic_classifier.LOCAL_CLASSIFIER_ENABLED:
+        local_classifier = topic_classifier.get_local_classifier()
+        local_topic, local_confidence, local_confident = local_classifier.predict(workflow["input_as_text"])
+        local_proba = local_classifier.predict_proba(workflow["input_as_text"])
+        if local_confident and not topic_classifier.should_shadow():
+            classifier = local_topic
+            distribution = specialist_router.TopicDistribution(local_proba, "local", prefer=local_topic)
+            topic_classifier.stats.record_local_hit()
+            local_topic = None
+        else:
+            topic_classifier.stats.record_fallback()
+    
     
-    location_verification_result_temp = await Runner.run(
-      location_verification,
-      input=[
-        *conversation_history
-      ],
-      run_config=RunConfig(trace_metadata={
-        "__trace_source__": "agent-builder",
-        "workflow_id": "wf_68f94a7e17d48190b601b55060f7be580cd9f85a9a7b9c30"
-      })
-    )
+    # Step 1 + 2: location verification and topic classification.
+    # The classifier doesn't need the location result, so by default both agents
+    # run concurrently off the same history snapshot. Their items are merged back
+    # in a fixed order (location first, then classifier) so the history matches
+    # what the sequential path would have produced.
+    # Set ECOBOT_PARALLEL_PREROUTING=0 to go back to running them one after the other.
+    pre_routing_config = workflow_run_config()
+
+    # Each agent gets a compacted view of the history (see history_compaction.py);
+    # the report tracks how many prompt tokens that saved on this request.
+    compaction_report = history_compaction.CompactionReport()
+    # Real token usage of every agent call in this request (usage_accounting.py)
+    usage = usage_accounting.UsageCollector()
+
+    # Location: keep the session's location unless this message could name a
+    # new place, and reuse earlier normalizations of the same place phrase
+    # (see location_cache.py). The agent only runs when neither applies.
+    location_cache = get_location_cache()
+    previous_location = workflow.get("previous_location")
+    known_location = location_cache.resolve(workflow["input_as_text"], previous_location)
+
+    # Pre-routing agents run on small models and escalate to bigger ones only
+    # when their JSON doesn't parse (model_profiles.py); *_agent is whichever answered
+    location_verification_result_temp = None
+    topic_classifier_agent_result_temp = None
+    location_agent = location_verification
+    classifier_agent = topic_classifier_agent
+    if known_location is None:
+        location_cache.stats.record("agent")
+        if PARALLEL_PRE_ROUTING and not classifier:
+            pre_routing_input = history_compaction.prerouting_input(conversation_history, compaction_report, "location_verification")
+            compaction_report.record("topic_classifier", conversation_history, pre_routing_input)
+            (location_agent, location_verification_result_temp), (classifier_agent, topic_classifier_agent_result_temp) = await asyncio.gather(
+              pipeline_tracing.timed("location_agent", model_profiles.run_structured(location_verification, "location", pre_routing_input, pre_routing_config, usage), model=location_verification.model),
+              pipeline_tracing.timed("classifier_agent", model_profiles.run_structured(topic_classifier_agent, "classifier", pre_routing_input, pre_routing_config, usage), model=topic_classifier_agent.model),
+            )
+        else:
+            with pipeline_tracing.span("location_agent", model=location_verification.model):
+                location_agent, location_verification_result_temp = await model_profiles.run_structured(
+                  location_verification, "location",
+                  history_compaction.prerouting_input(conversation_history, compaction_report, "location_verification"),
+                  pre_routing_config, usage
+                )
+
+    if location_verification_result_temp is not None:
+        usage.add_run(location_agent, location_verification_result_temp)
+        conversation_history.extend([item.to_input_item() for item in location_verification_result_temp.new_items])
+
+        location_verification_result = {
+          "output_text": safe_model_dump_json(location_verification_result_temp.final_output),
+          "output_parsed": safe_model_dump(location_verification_result_temp.final_output)
+        }
 
-    conversation_history.extend([item.to_input_item() for item in location_verification_result_temp.new_items])
+        # Check if a valid location was extracted (non-empty location string)
+        extracted_location = (location_verification_result["output_parsed"].get("location") or "").strip()
+        location_cache.remember(workflow["input_as_text"], extracted_location)
 
-    location_verification_result = {
-      "output_text": safe_model_dump_json(location_verification_result_temp.final_output),
-      "output_parsed": safe_model_dump(location_verification_result_temp.final_output)
-    }
-    
-    # Check if a valid location was extracted (non-empty location string)
-    extracted_location = location_verification_result["output_parsed"].get("location", "").strip()
-    
-    if not extracted_location:
-         # Location not found is okay now, just note it
-         pass
+        if not extracted_location:
+             # Location not found is okay now; fall back to the session's one if any
+             extracted_location = previous_location or ""
+    else:
+        # Same item the agent would have added, so later agents still see the location
+        extracted_location = known_location
+        conversation_history.append({
+          "role": "assistant",
+          "content": [{"type": "output_text", "text": json.dumps({"location": known_location})}]
+        })
     
     
     if not classifier:
-        # Step 2: Location found, run topic classifier agent
-        topic_classifier_agent_result_temp = await Runner.run(
-          topic_classifier_agent,
-          input=[
-            *conversation_history
-          ],
-          run_config=RunConfig(trace_metadata={
-            "__trace_source__": "agent-builder",
-            "workflow_id": "wf_68f94a7e17d48190b601b55060f7be580cd9f85a9a7b9c30"
-          })
-        )
-
+        if topic_classifier_agent_result_temp is None:
+            # Sequential mode: classifier sees the location items as well
+            with pipeline_tracing.span("classifier_agent", model=topic_classifier_agent.model):
+                classifier_agent, topic_classifier_agent_result_temp = await model_profiles.run_structured(
+                  topic_classifier_agent, "classifier",
+                  history_compaction.prerouting_input(conversation_history, compaction_report, "topic_classifier"),
+                  pre_routing_config, usage
+                )
+
+        usage.add_run(classifier_agent, topic_classifier_agent_result_temp)
         conversation_history.extend([item.to_input_item() for item in topic_classifier_agent_result_temp.new_items])
 
         topic_classifier_agent_result = {
@@ -582,67 +676,187 @@ async def run_workflow(workflow_input: WorkflowInput):
           "output_parsed": safe_model_dump(topic_classifier_agent_result_temp.final_output)
         }
         
-        classifier = topic_classifier_agent_result["output_parsed"].get("classifier", "").lower().strip()
+        # Scores per topic rather than just a label, so close calls can go to
+        # two specialists; unknown labels fall back to the local model
+        parsed = topic_classifier_agent_result["output_parsed"]
+        distribution = specialist_router.distribution_from_classifier(SPECIALISTS, parsed, local_proba)
+        raw_label = (parsed.get("classifier") or "").lower().strip()
+        classifier = distribution.top or raw_label
+        if raw_label not in SPECIALISTS and distribution.top:
+            specialist_router.stats.record("aliased")
+
+        if local_topic:
+            topic_classifier.stats.record_comparison(local_topic, classifier, local_confident)
     
-    # Step 3: Route to the appropriate specialist agent based on classification
-    # classifier variable is already set above either from previous_topic or running the agent
-    
-    if classifier == "water":
-      specialist_result_temp = await Runner.run(
-        water,
-        input=[*conversation_history],
-        run_config=RunConfig(trace_metadata={
-          "__trace_source__": "agent-builder",
-          "workflow_id": "wf_68f94a7e17d48190b601b55060f7be580cd9f85a9a7b9c30"
-        })
-      )
-      conversation_history.extend([item.to_input_item() for item in specialist_result_temp.new_items])
-      history_dump = [safe_model_dump(item) for item in conversation_history]
-      return {"output_text": specialist_result_temp.final_output_as(str), "topic": "water", "location": extracted_location, "history": history_dump}
-      
-    elif classifier == "food":
-      specialist_result_temp = await Runner.run(
-        food,
-        input=[*conversation_history],
-        run_config=RunConfig(trace_metadata={
-          "__trace_source__": "agent-builder",
-          "workflow_id": "wf_68f94a7e17d48190b601b55060f7be580cd9f85a9a7b9c30"
-        })
-      )
-      conversation_history.extend([item.to_input_item() for item in specialist_result_temp.new_items])
-      history_dump = [safe_model_dump(item) for item in conversation_history]
-      return {"output_text": specialist_result_temp.final_output_as(str), "topic": "food", "location": extracted_location, "history": history_dump}
-      
-    elif classifier == "transport":
-      specialist_result_temp = await Runner.run(
-        transport,
-        input=[*conversation_history],
-        run_config=RunConfig(trace_metadata={
-          "__trace_source__": "agent-builder",
-          "workflow_id": "wf_68f94a7e17d48190b601b55060f7be580cd9f85a9a7b9c30"
-        })
-      )
-      conversation_history.extend([item.to_input_item() for item in specialist_result_temp.new_items])
-      history_dump = [safe_model_dump(item) for item in conversation_history]
-      return {"output_text": specialist_result_temp.final_output_as(str), "topic": "transport", "location": extracted_location, "history": history_dump}
-      
-    elif classifier == "energy":
-      specialist_result_temp = await Runner.run(
-        energy,
-        input=[*conversation_history],
-        run_config=RunConfig(trace_metadata={
-          "__trace_source__": "agent-builder",
-          "workflow_id": "wf_68f94a7e17d48190b601b55060f7be580cd9f85a9a7b9c30"
-        })
-      )
-      conversation_history.extend([item.to_input_item() for item in specialist_result_temp.new_items])
-      history_dump = [safe_model_dump(item) for item in conversation_history]
-      return {"output_text": specialist_result_temp.final_output_as(str), "topic": "energy", "location": extracted_location, "history": history_dump}
-      
-    else:
-      # Unknown classifier, return the classification result
-      history_dump = [safe_model_dump(item) for item in conversation_history]
-      return {"output_text": f"I couldn't classify your question into water, food, transport, or energy. Classification: {classifier}", "topic": classifier, "location": extracted_location, "history": history_dump}
+    pipeline_tracing.tag_request(topic=classifier, topic_margin=round(distribution.margin, 3), location_source="agent" if location_verification_result_temp is not None else "session")
+    return {
+      "conversation_history": conversation_history,
+      "classifier": classifier,
+      "distribution": distribution,
+      # Specialists to run, best first (two when the top topics are close)
+      "candidates": distribution.candidates(),
+      "extracted_location": extracted_location,
+      "compaction_report": compaction_report,
+      "usage": usage,
+    }
+
+
+# The water agent needs coordinates for get_epa_water_data; geocoding the
+# verified location locally saves it a web search round trip for them.
+def water_location_items(location):
+  place = gazetteer.get_gazetteer().geocode(location) if location else None
+  if not place:
+    return []
+  return [{
+    "role": "system",
+    "content": [{"type": "input_text", "text": (
+      f"User location: {location} (latitude {place['latitude']}, longitude {place['longitude']}, "
+      "from the local gazetteer). Use these coordinates with get_epa_water_data."
+    )}]
+  }]
+
+
+# Runs the specialist(s) for state["candidates"]: one, or two racing when the
+# top topics were close (see specialist_router.py). Yields ("topic", topic) once
+# the answering specialist is known and ("delta", text) for its output, and
+# leaves (agent, result) in state["specialist"] - None if nobody could answer,
+# in which case the UNROUTABLE_REPLY is the one delta.
+async def specialist_deltas(state, stream=False):
+  conversation_history = state["conversation_history"]
+  compaction_report = state["compaction_report"]
+  candidates = state["candidates"]
+  state["specialist"] = None
+
+  def specialist_input(topic):
+    items = history_compaction.specialist_input(conversation_history, compaction_report, topic)
+    if topic == "water":
+      items = items + water_location_items(state["extracted_location"])
+    return items
+
+  if len(candidates) == 1:
+    topic = candidates[0]
+    specialist = SPECIALISTS.get(topic)
+    specialist_router.stats.record("single")
+    yield "topic", topic
+    with pipeline_tracing.span("specialist", model=specialist.model) as stage_span:
+      if stream:
+        specialist_result_temp = Runner.run_streamed(specialist, input=specialist_input(topic), run_config=workflow_run_config())
+        async for event in specialist_result_temp.stream_events():
+          if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+            if "first_token_ms" not in stage_span.tags:
+              stage_span.tags["first_token_ms"] = round(stage_span.duration * 1000, 1)
+            yield "delta", event.data.delta
+      else:
+        specialist_result_temp = await Runner.run(specialist, input=specialist_input(topic), run_config=workflow_run_config())
+      stage_span.tags["web_searches"] = web_search_count(specialist_result_temp)
+    state["specialist"] = (specialist, specialist_result_temp)
+
+  elif candidates:
+    specialist_router.stats.record("speculative")
+    race = specialist_router.SpecialistRace(SPECIALISTS, candidates, specialist_input, workflow_run_config())
+    with pipeline_tracing.span("specialist", model=SPECIALISTS.get(candidates[0]).model, candidates=",".join(candidates)) as stage_span:
+      async for delta in race.deltas():
+        if "winner" not in stage_span.tags:
+          stage_span.tags["winner"] = race.winner
+          stage_span.tags["first_token_ms"] = round(stage_span.duration * 1000, 1)
+          yield "topic", race.winner
+        yield "delta", delta
+      if race.result is not None:
+        if "winner" not in stage_span.tags:
+          # Won with an empty answer
+          stage_span.tags["winner"] = race.winner
+          yield "topic", race.winner
+        stage_span.tags["web_searches"] = web_search_count(race.result)
+        state["classifier"] = race.winner
+        state["specialist"] = (SPECIALISTS.get(race.winner, speculative=True), race.result)
+
+  if state["specialist"] is None:
+    specialist_router.stats.record("unroutable")
+    yield "delta", specialist_router.UNROUTABLE_REPLY
+
+
+# Usage, history and cache bookkeeping once specialist_deltas is done.
+# Returns (output_text, chart, fallback).
+def finish_specialist(workflow_input: WorkflowInput, state):
+  conversation_history = state["conversation_history"]
+  if state["specialist"] is None:
+    conversation_history.append({
+      "role": "assistant",
+      "content": [{"type": "output_text", "text": specialist_router.UNROUTABLE_REPLY}]
+    })
+    return specialist_router.UNROUTABLE_REPLY, None, True
+  specialist, specialist_result_temp = state["specialist"]
+  state["usage"].add_run(specialist, specialist_result_temp)
+  conversation_history.extend([item.to_input_item() for item in specialist_result_temp.new_items])
+  output_text, chart = chart_payload.extract_chart(specialist_result_temp.final_output_as(str))
+  store_cached_response(workflow_input, state, output_text, chart)
+  return output_text, chart, False
+
+
+def workflow_result(state, output_text, chart, fallback=False):
+  history_dump = [safe_model_dump(item) for item in history_compaction.stored_history(state["conversation_history"])]
+  return {
+    "output_text": output_text,
+    "chart": chart,
+    # No topic when nothing could answer, so the session keeps its last one
+    "topic": None if fallback else state["classifier"],
+    "location": state["extracted_location"],
+    "history": history_dump,
+    "compaction": state["compaction_report"].as_dict(),
+    "usage": state["usage"].as_dict(),
+    "topic_scores": state["distribution"].as_dict(),
+    "fallback": fallback,
+  }
+
+
+# Main code entrypoint
+async def run_workflow(workflow_input: WorkflowInput):
+  with trace("Cameron"):
+    state = await run_pre_routing(workflow_input)
+
+    cached = cached_response(workflow_input, state)
+    if cached is not None:
+      return cached
+
+    # Step 3: Route to the specialist agent(s) for the classified topic
+    async for _ in specialist_deltas(state):
+      pass
+    output_text, chart, fallback = finish_specialist(workflow_input, state)
+    return workflow_result(state, output_text, chart, fallback)
+
+
+# Streaming variant of run_workflow for /chat_stream. Yields events as dicts:
+#   {"event": "topic", "data": {"topic": ...}}
+#   {"event": "location", "data": {"location": ...}}
+#   {"event": "delta", "data": {"text": ...}}      (specialist output tokens)
+#   {"event": "done", "data": <same dict run_workflow returns>}
+# The chart JSON block streams through in the deltas; "done" has it parsed
+# out into "chart" and stripped from output_text. When two specialists race
+# and the runner-up answers, a second "topic" event arrives before its deltas.
+async def run_workflow_streamed(workflow_input: WorkflowInput):
+  with trace("Cameron"):
+    state = await run_pre_routing(workflow_input)
+    announced = state["classifier"]
+
+    yield {"event": "topic", "data": {"topic": announced}}
+    yield {"event": "location", "data": {"location": state["extracted_location"]}}
+
+    cached = cached_response(workflow_input, state)
+    if cached is not None:
+      yield {"event": "delta", "data": {"text": cached["output_text"]}}
+      yield {"event": "done", "data": cached}
+      return
+
+    async for kind, value in specialist_deltas(state, stream=True):
+      if kind == "topic":
+        if value != announced:
+          announced = value
+          yield {"event": "topic", "data": {"topic": value}}
+      else:
+        yield {"event": "delta", "data": {"text": value}}
+    output_text, chart, fallback = finish_specialist(workflow_input, state)
+
+    yield {"event": "done", "data": workflow_result(state, output_text, chart, fallback)}
 
 
 # Main entry point
@@ -706,5 +920,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
@@ -0,0 +1,264 @@
+"""
+Local fast-path topic classifier.
+
+A small multinomial naive Bayes model that sits in front of the
+topic_classifier_agent in run_workflow. It's trained at startup from the
+`topic` column of logs/conversations.jsonl and all_responses.csv, plus a seed
+keyword list so it still works on an empty log. When it's confident enough we
+use its answer and skip the gpt-4.1 call; otherwise we fall back to the agent.
+"""
+import os
+import re
+import csv
+import json
+import math
+import random
+import threading
+
+TOPICS = ("food", "water", "transport", "energy")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_FILE = os.path.join(BASE_DIR, 'logs', 'conversations.jsonl')
+CSV_LOG_FILE = os.path.join(BASE_DIR, 'all_responses.csv')
+
+# Confirmation turns ("yes", "ok") are logged under the previous topic, so they
+# tell us nothing about the words of a topic. Keep in sync with run_workflow.
+CONFIRMATION_KEYWORDS = {"yes", "please", "comprehensive", "detail", "details", "sure", "ok", "okay", "yeah"}
+
+# Hand-picked words that are unambiguous for a topic. Each one is added to the
+# training counts SEED_WEIGHT times so the log data refines them rather than
+# replacing them.
+SEED_KEYWORDS = {
+    "food": [
+        "food", "eat", "eating", "ate", "diet", "meal", "meat", "beef", "steak", "burger",
+        "cheeseburger", "chicken", "pork", "lamb", "fish", "seafood", "dairy", "milk",
+        "cheese", "egg", "vegan", "vegetarian", "plant", "grocery", "groceries", "lunch",
+        "dinner", "breakfast", "rice", "avocado", "almond", "coffee",
+    ],
+    "water": [
+        "water", "shower", "bath", "drought", "watershed", "river", "stream", "lake",
+        "irrigation", "lawn", "sprinkler", "gallon", "faucet", "toilet", "rain",
+        "aquifer", "groundwater", "drinking", "tap", "leak", "flush",
+    ],
+    "transport": [
+        "drive", "driving", "drove", "car", "truck", "suv", "commute", "commuting", "bus",
+        "train", "flight", "fly", "flying", "plane", "mile", "bike", "biking", "cycling",
+        "vehicle", "gasoline", "mpg", "transit", "uber", "taxi", "subway", "ev", "hybrid",
+        "road", "trip",
+    ],
+    "energy": [
+        "energy", "electricity", "electric", "kwh", "solar", "panel", "led", "bulb",
+        "incandescent", "heating", "heat", "furnace", "thermostat", "ac", "conditioning",
+        "power", "grid", "battery", "appliance", "insulation", "wind", "utility", "bill",
+        "kilowatt", "coal", "renewable",
+    ],
+}
+SEED_WEIGHT = 3
+
+# Filler words and generic CO2 vocabulary show up under every topic, so they
+# shouldn't push a message towards whichever topic happens to dominate the log
+STOPWORDS = {
+    "i", "a", "an", "the", "and", "or", "of", "to", "in", "on", "at", "for", "is", "it",
+    "my", "me", "we", "our", "you", "your", "do", "doe", "does", "how", "what", "much",
+    "many", "if", "as", "be", "are", "was", "that", "this", "with", "vs", "per", "day",
+    "week", "month", "year", "time", "x", "live", "about", "can", "should", "would",
+    "well", "also", "more", "less", "than", "other", "same", "each", "co2", "carbon",
+    "footprint", "impact", "emission", "produce", "usage", "use", "compare",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    tokens = []
+    for tok in _TOKEN_RE.findall((text or "").lower()):
+        if tok.isdigit() or tok in STOPWORDS:
+            continue
+        # Very light stemming so "miles"/"mile" and "panels"/"panel" line up
+        if len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        tokens.append(tok)
+    return tokens
+
+
+def is_confirmation(text):
+    tokens = set(_TOKEN_RE.findall((text or "").lower()))
+    return bool(tokens & CONFIRMATION_KEYWORDS)
+
+
+def load_training_samples(log_file=LOG_FILE, csv_file=CSV_LOG_FILE):
+    """Collect (user_message, topic) pairs from the conversation log and CSV export."""
+    samples = []
+
+    if os.path.exists(log_file):
+        with open(log_file, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                samples.append((entry.get("user_message"), entry.get("topic")))
+
+    if os.path.exists(csv_file):
+        with open(csv_file, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                # Older rows have a shorter header, but Topic/User Message
+                # have always been columns 2 and 3
+                if len(row) > 3:
+                    samples.append((row[3], row[2]))
+
+    return [
+        (text, topic) for text, topic in samples
+        if text and topic in TOPICS and not is_confirmation(text)
+    ]
+
+
+class LocalTopicClassifier:
+    """
+    Multinomial naive Bayes over message tokens with uniform topic priors.
+
+    Words seen fewer than `min_count` times are ignored, and a prediction only
+    counts as confident when the message contains a seed keyword for the
+    winning topic. The log is small and noisy (follow-ups get the previous
+    topic), so one-off words shouldn't be enough to skip the agent.
+    """
+
+    def __init__(self, threshold=0.8, alpha=1.0, min_count=2):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.min_count = min_count
+        self.word_counts = {topic: {} for topic in TOPICS}
+        self.total_counts = {topic: 0 for topic in TOPICS}
+        self.vocab = set()
+        self.seed_tokens = {
+            topic: {tok for word in words for tok in tokenize(word)}
+            for topic, words in SEED_KEYWORDS.items()
+        }
+
+        for topic, tokens in self.seed_tokens.items():
+            self._add(topic, tokens, SEED_WEIGHT)
+
+    def _add(self, topic, tokens, weight=1):
+        counts = self.word_counts[topic]
+        for tok in tokens:
+            counts[tok] = counts.get(tok, 0) + weight
+            self.total_counts[topic] += weight
+            self.vocab.add(tok)
+
+    def fit(self, samples):
+        for text, topic in samples:
+            self._add(topic, tokenize(text))
+        return self
+
+    def _known(self, tok):
+        return tok in self.vocab and sum(counts.get(tok, 0) for counts in self.word_counts.values()) >= self.min_count
+
+    def predict_proba(self, text):
+        """Return {topic: probability}. Uniform when no known words are present."""
+        tokens = [tok for tok in tokenize(text) if self._known(tok)]
+        if not tokens:
+            return {topic: 1.0 / len(TOPICS) for topic in TOPICS}
+
+        vocab_size = len(self.vocab)
+        log_scores = {}
+        for topic in TOPICS:
+            counts = self.word_counts[topic]
+            denom = self.total_counts[topic] + self.alpha * vocab_size
+            log_scores[topic] = sum(math.log((counts.get(tok, 0) + self.alpha) / denom) for tok in tokens)
+
+        top = max(log_scores.values())
+        exp_scores = {topic: math.exp(score - top) for topic, score in log_scores.items()}
+        norm = sum(exp_scores.values())
+        return {topic: value / norm for topic, value in exp_scores.items()}
+
+    def predict(self, text):
+        """Return (topic, confidence, confident) for a message."""
+        proba = self.predict_proba(text)
+        topic = max(proba, key=proba.get)
+        confidence = proba[topic]
+        has_seed = bool(self.seed_tokens[topic] & set(tokenize(text)))
+        return topic, confidence, has_seed and confidence >= self.threshold
+
+
+class ClassifierStats:
+    """Thread-safe counters for the local fast path."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.local_hits = 0
+        self.agent_fallbacks = 0
+        # Turns where both the local model and the agent produced a label
+        # (low-confidence fallbacks plus shadow-sampled hits)
+        self.compared = 0
+        self.disagreements = 0
+        self.confident_compared = 0
+        self.confident_disagreements = 0
+
+    def record_local_hit(self):
+        with self._lock:
+            self.requests += 1
+            self.local_hits += 1
+
+    def record_fallback(self):
+        with self._lock:
+            self.requests += 1
+            self.agent_fallbacks += 1
+
+    def record_comparison(self, local_topic, agent_topic, confident):
+        with self._lock:
+            self.compared += 1
+            disagree = local_topic != agent_topic
+            if disagree:
+                self.disagreements += 1
+            if confident:
+                self.confident_compared += 1
+                if disagree:
+                    self.confident_disagreements += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "local_hits": self.local_hits,
+                "agent_fallbacks": self.agent_fallbacks,
+                "local_hit_rate": round(self.local_hits / self.requests, 4) if self.requests else 0.0,
+                "compared": self.compared,
+                "disagreements": self.disagreements,
+                "disagreement_rate": round(self.disagreements / self.compared, 4) if self.compared else 0.0,
+                "confident_compared": self.confident_compared,
+                "confident_disagreements": self.confident_disagreements,
+                "confident_disagreement_rate": (
+                    round(self.confident_disagreements / self.confident_compared, 4)
+                    if self.confident_compared else 0.0
+                ),
+            }
+
+
+# Configuration
+LOCAL_CLASSIFIER_ENABLED = os.environ.get("ECOBOT_LOCAL_CLASSIFIER", "1") != "0"
+LOCAL_CLASSIFIER_THRESHOLD = float(os.environ.get("ECOBOT_LOCAL_CLASSIFIER_THRESHOLD", "0.8"))
+# Fraction of confident local answers that still go to the agent so we keep
+# measuring how often the two disagree
+LOCAL_CLASSIFIER_SHADOW_RATE = float(os.environ.get("ECOBOT_LOCAL_CLASSIFIER_SHADOW_RATE", "0.05"))
+
+stats = ClassifierStats()
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_local_classifier():
+    """Build the shared classifier on first use."""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = LocalTopicClassifier(threshold=LOCAL_CLASSIFIER_THRESHOLD).fit(load_training_samples())
+    return _classifier
+
+
+def should_shadow():
+    return LOCAL_CLASSIFIER_SHADOW_RATE > 0 and random.random() < LOCAL_CLASSIFIER_SHADOW_RATE
@@ -0,0 +1,123 @@
+"""
+Token usage and cost accounting from the real API usage numbers.
+
+/chat used to estimate cost as len(text)/4 at GPT-4o prices, while the actual
+spend is three or four gpt-4.1 agent calls (each with history) plus the gpt-4o
+evaluator. A `UsageCollector` is created per request; every Runner.run result
+and evaluator completion is added to it, and it reports prompt, cached and
+completion tokens plus cost per agent and for the whole request.
+
+Prices are USD per 1M tokens. Override or extend them with
+ECOBOT_PRICE_TABLE='{"gpt-4.1": {"input": 2.0, "cached_input": 0.5, "output": 8.0}}'.
+"""
+import os
+import json
+import threading
+
+PRICES = {
+    "gpt-4.1": {"input": 2.00, "cached_input": 0.50, "output": 8.00},
+    "gpt-4.1-mini": {"input": 0.40, "cached_input": 0.10, "output": 1.60},
+    "gpt-4.1-nano": {"input": 0.10, "cached_input": 0.025, "output": 0.40},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+}
+if os.environ.get("ECOBOT_PRICE_TABLE"):
+    PRICES.update(json.loads(os.environ["ECOBOT_PRICE_TABLE"]))
+
+
+def model_price(model):
+    """Price entry for a model name, matching dated snapshots like gpt-4o-2024-08-06 to gpt-4o."""
+    model = model or ""
+    if model in PRICES:
+        return PRICES[model]
+    # Longest prefix wins so gpt-4o-mini-... doesn't match gpt-4o
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return PRICES[name]
+    return None
+
+
+def cost_of(model, prompt_tokens, cached_tokens, completion_tokens):
+    price = model_price(model)
+    if price is None:
+        return 0.0
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (
+        uncached * price["input"]
+        + cached_tokens * price.get("cached_input", price["input"])
+        + completion_tokens * price["output"]
+    ) / 1_000_000
+
+
+def agent_model(agent):
+    model = getattr(agent, "model", None)
+    if isinstance(model, str):
+        return model
+    # A Model instance rather than a name
+    return getattr(model, "model", None) or str(model or "")
+
+
+def _details(details, key):
+    if details is None:
+        return 0
+    if isinstance(details, dict):
+        return details.get(key) or 0
+    return getattr(details, key, 0) or 0
+
+
+class UsageCollector:
+    """Per-request token and cost totals, broken down by agent."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.agents = {}
+
+    def add(self, name, model, prompt_tokens=0, cached_tokens=0, completion_tokens=0, requests=1):
+        with self._lock:
+            entry = self.agents.setdefault(name, {
+                "model": model, "requests": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                "completion_tokens": 0, "cost": 0.0,
+            })
+            entry["requests"] += requests
+            entry["prompt_tokens"] += prompt_tokens
+            entry["cached_tokens"] += cached_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost"] += cost_of(model, prompt_tokens, cached_tokens, completion_tokens)
+
+    def add_run(self, agent, result):
+        """Add every model response of a Runner.run / run_streamed result."""
+        model = agent_model(agent)
+        for response in getattr(result, "raw_responses", None) or []:
+            usage = getattr(response, "usage", None)
+            if usage is None:
+                continue
+            self.add(
+                agent.name, model,
+                prompt_tokens=usage.input_tokens or 0,
+                cached_tokens=_details(getattr(usage, "input_tokens_details", None), "cached_tokens"),
+                completion_tokens=usage.output_tokens or 0,
+                requests=getattr(usage, "requests", 1) or 1,
+            )
+
+    def add_completion(self, name, model, completion):
+        """Add a chat.completions response (the evaluator)."""
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            return
+        self.add(
+            name, getattr(completion, "model", None) or model,
+            prompt_tokens=usage.prompt_tokens or 0,
+            cached_tokens=_details(getattr(usage, "prompt_tokens_details", None), "cached_tokens"),
+            completion_tokens=usage.completion_tokens or 0,
+        )
+
+    def as_dict(self):
+        with self._lock:
+            agents = {name: {**entry, "cost": round(entry["cost"], 6)} for name, entry in self.agents.items()}
+        totals = {
+            key: sum(entry[key] for entry in agents.values())
+            for key in ("requests", "prompt_tokens", "cached_tokens", "completion_tokens")
+        }
+        totals["total_tokens"] = totals["prompt_tokens"] + totals["completion_tokens"]
+        totals["cost"] = round(sum(entry["cost"] for entry in agents.values()), 6)
+        return {**totals, "agents": agents}
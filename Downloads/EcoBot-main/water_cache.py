@@ -0,0 +1,203 @@
+"""
+Cache for EPA WATERS lookups.
+
+Two levels:
+  1. point -> nearest stream feature (COMID + name), keyed on lat/lon snapped to
+     a configurable grid so nearby points in the same city share an entry
+  2. COMID -> StreamCat payload
+
+Each level is an in-memory LRU with TTL eviction, optionally backed by a SQLite
+file so entries survive restarts. Watershed data changes rarely, so the TTLs
+are long by default.
+
+WaterCache's lookups are coroutines: memory hits return straight away, and the
+SQLite reads/writes behind them run in a worker thread (asyncio.to_thread) so
+they don't block the event loop the agents and the EPA client share.
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EPA_CACHE_GRID_DEG = float(os.environ.get("EPA_CACHE_GRID_DEG", "0.01"))  # ~1km
+EPA_CACHE_FEATURE_TTL = float(os.environ.get("EPA_CACHE_FEATURE_TTL", str(30 * 24 * 3600)))
+EPA_CACHE_STREAMCAT_TTL = float(os.environ.get("EPA_CACHE_STREAMCAT_TTL", str(7 * 24 * 3600)))
+EPA_CACHE_MAX_POINTS = int(os.environ.get("EPA_CACHE_MAX_POINTS", "10000"))
+EPA_CACHE_MAX_COMIDS = int(os.environ.get("EPA_CACHE_MAX_COMIDS", "5000"))
+# Set to an empty string to keep the cache in memory only
+EPA_CACHE_DB = os.environ.get("EPA_CACHE_DB", os.path.join(BASE_DIR, 'logs', 'epa_cache.sqlite3'))
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache where every entry also expires after `ttl` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value = item
+                if expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, expires_at=None):
+        with self._lock:
+            self._data[key] = (expires_at or time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class DiskCache:
+    """SQLite key/value store with per-entry expiry, shared by both cache levels."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, namespace, key):
+        """Returns (value, expires_at) or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row and row[1] > time.time():
+                self.hits += 1
+                return json.loads(row[0]), row[1]
+            self.misses += 1
+            return None
+
+    def set(self, namespace, key, value, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at)
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            return {"path": self.path, "size": size, "hits": self.hits, "misses": self.misses}
+
+
+class WaterCache:
+    def __init__(self, grid_deg=EPA_CACHE_GRID_DEG,
+                 feature_ttl=EPA_CACHE_FEATURE_TTL, streamcat_ttl=EPA_CACHE_STREAMCAT_TTL,
+                 max_points=EPA_CACHE_MAX_POINTS, max_comids=EPA_CACHE_MAX_COMIDS,
+                 disk_path=EPA_CACHE_DB):
+        self.grid_deg = grid_deg
+        self.features = TTLCache(max_points, feature_ttl)
+        self.streamcat = TTLCache(max_comids, streamcat_ttl)
+        self.disk = DiskCache(disk_path) if disk_path else None
+
+    def point_key(self, latitude, longitude):
+        """Snap a point to the grid, e.g. (41.2565, -95.9345) -> '41.26,-95.93' at 0.01 deg."""
+        lat = round(round(latitude / self.grid_deg) * self.grid_deg, 6)
+        lon = round(round(longitude / self.grid_deg) * self.grid_deg, 6)
+        return f"{lat},{lon}"
+
+    async def _get(self, memory, namespace, key):
+        value = memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.disk:
+            row = await asyncio.to_thread(self.disk.get, namespace, key)
+            if row:
+                value, expires_at = row
+                # Promote to memory, keeping the original expiry
+                memory.set(key, value, expires_at=expires_at)
+                return value
+        return None
+
+    async def _set(self, memory, namespace, key, value):
+        memory.set(key, value)
+        if self.disk:
+            await asyncio.to_thread(self.disk.set, namespace, key, value, time.time() + memory.ttl)
+
+    async def get_feature(self, latitude, longitude):
+        """Returns {'comid': ..., 'name': ...} for the snapped point, or None."""
+        return await self._get(self.features, "feature", self.point_key(latitude, longitude))
+
+    async def set_feature(self, latitude, longitude, comid, name):
+        await self._set(self.features, "feature", self.point_key(latitude, longitude), {"comid": comid, "name": name})
+
+    async def get_streamcat(self, comid):
+        return await self._get(self.streamcat, "streamcat", str(comid))
+
+    async def set_streamcat(self, comid, payload):
+        await self._set(self.streamcat, "streamcat", str(comid), payload)
+
+    def stats(self):
+        return {
+            "grid_deg": self.grid_deg,
+            "features": self.features.stats(),
+            "streamcat": self.streamcat.stats(),
+            "disk": self.disk.stats() if self.disk else None,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_water_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = WaterCache()
+    return _cache
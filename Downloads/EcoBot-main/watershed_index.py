@@ -0,0 +1,342 @@
+"""
+Prefetched EPA WATERS data for known service areas.
+
+get_epa_water_data navigates from the user's point (upstream/downstream,
+then StreamCat): two HTTP hops that take seconds on a cold cache. Most users
+are in a handful of metro areas, so an offline job walks a grid over each
+area ahead of time and stores point -> stream feature -> StreamCat metrics in
+one file:
+
+    python watershed_index.py build                              # areas in data/service_areas.json
+    python watershed_index.py build --area omaha=41.15,-96.25,41.40,-95.85 --step-deg 0.01
+    python watershed_index.py lookup 41.2565 -95.9345
+
+At runtime the file is memory-mapped and a point query is a binary search
+over the sorted grid-cell keys (plus up to 8 neighbouring cells), so it
+costs microseconds and no memory beyond the pages touched. fetch_water_data
+checks it before the water cache and the live API, which stays the fallback
+for points outside the indexed areas. The job writes to a temp file and
+renames it, and running servers pick up a rebuilt index within
+WATERSHED_INDEX_RELOAD seconds.
+
+File layout (little-endian):
+    header        magic, version, grid_deg, cell/feature counts, metadata length
+    metadata      JSON (areas, build time)
+    cell keys     int64[n_cells], sorted
+    cell feature  uint32[n_cells], index into the feature tables
+    comids        int64[n_features]
+    offsets       int64[n_features + 1] into the payload blob
+    payloads      JSON per feature: {"name": ..., "streamcat": ...}
+
+    WATERSHED_INDEX         path (default logs/watershed_index.bin, empty to disable)
+    WATERSHED_INDEX_RELOAD  seconds between checks for a rebuilt file (default 30)
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import asyncio
+import bisect
+import argparse
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WATERSHED_INDEX = os.environ.get("WATERSHED_INDEX", os.path.join(BASE_DIR, 'logs', 'watershed_index.bin'))
+WATERSHED_INDEX_RELOAD = float(os.environ.get("WATERSHED_INDEX_RELOAD", "30"))
+SERVICE_AREAS_FILE = os.path.join(BASE_DIR, 'data', 'service_areas.json')
+
+MAGIC = b"EWIX"
+VERSION = 1
+HEADER = struct.Struct("<4sHHdQQQ")  # magic, version, reserved, grid_deg, n_cells, n_features, meta_len
+
+# Cell (lat_idx, lon_idx) -> one int64; offsets keep both indices positive
+_LAT_OFFSET = 1 << 24
+_LON_SPAN = 1 << 26
+
+
+def cell_of(latitude, longitude, grid_deg):
+    return round(latitude / grid_deg), round(longitude / grid_deg)
+
+
+def cell_key(lat_idx, lon_idx):
+    return (lat_idx + _LAT_OFFSET) * _LON_SPAN + (lon_idx + _LON_SPAN // 2)
+
+
+def _pad8(n):
+    return (8 - n % 8) % 8
+
+
+class WatershedIndex:
+    """Read-only view of an index file; lookups are thread-safe."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mtime = os.stat(path).st_mtime
+        magic, version, _, self.grid_deg, n_cells, n_features, meta_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} watershed index")
+        view = memoryview(self._mm)
+        pos = HEADER.size
+        self.meta = json.loads(bytes(view[pos:pos + meta_len]) or b"{}")
+        pos += meta_len + _pad8(meta_len)
+        self._keys = view[pos:pos + 8 * n_cells].cast("q")
+        pos += 8 * n_cells
+        self._cell_features = view[pos:pos + 4 * n_cells].cast("I")
+        pos += 4 * n_cells + _pad8(4 * n_cells)
+        self._comids = view[pos:pos + 8 * n_features].cast("q")
+        pos += 8 * n_features
+        self._offsets = view[pos:pos + 8 * (n_features + 1)].cast("q")
+        pos += 8 * (n_features + 1)
+        self._payloads = pos
+        self.n_cells = n_cells
+        self.n_features = n_features
+
+    def _find(self, key):
+        i = bisect.bisect_left(self._keys, key)
+        if i < self.n_cells and self._keys[i] == key:
+            return self._cell_features[i]
+        return None
+
+    def lookup(self, latitude, longitude):
+        """
+        (feature, streamcat) for the point's cell or a neighbouring one, or None.
+        Also None for features whose StreamCat fetch failed at build time, so
+        those points go to the cache and live API instead.
+        """
+        lat_idx, lon_idx = cell_of(latitude, longitude, self.grid_deg)
+        feature_index = self._find(cell_key(lat_idx, lon_idx))
+        if feature_index is None:
+            for d_lat, d_lon in ((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)):
+                feature_index = self._find(cell_key(lat_idx + d_lat, lon_idx + d_lon))
+                if feature_index is not None:
+                    break
+            else:
+                return None
+        start, end = self._offsets[feature_index], self._offsets[feature_index + 1]
+        payload = json.loads(self._mm[self._payloads + start:self._payloads + end])
+        if payload.get("streamcat") is None:
+            return None
+        feature = {"comid": self._comids[feature_index], "name": payload.get("name") or "Unnamed Stream"}
+        return feature, payload["streamcat"]
+
+
+def write_index(path, grid_deg, cells, features, meta=None):
+    """
+    Write an index file atomically. `cells` maps (lat_idx, lon_idx) -> comid,
+    `features` maps comid -> {"name": ..., "streamcat": ...}.
+    """
+    comids = sorted(features)
+    position = {comid: i for i, comid in enumerate(comids)}
+    rows = sorted((cell_key(*cell), position[comid]) for cell, comid in cells.items() if comid in position)
+
+    blobs = [json.dumps(features[comid], separators=(",", ":")).encode("utf-8") for comid in comids]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    meta_bytes = json.dumps(meta or {}).encode("utf-8")
+
+    tmp = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, grid_deg, len(rows), len(comids), len(meta_bytes)))
+        f.write(meta_bytes + b"\0" * _pad8(len(meta_bytes)))
+        f.write(struct.pack(f"<{len(rows)}q", *(key for key, _ in rows)))
+        f.write(struct.pack(f"<{len(rows)}I", *(index for _, index in rows)))
+        f.write(b"\0" * _pad8(4 * len(rows)))
+        f.write(struct.pack(f"<{len(comids)}q", *comids))
+        f.write(struct.pack(f"<{len(offsets)}q", *offsets))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, path)
+    return {"cells": len(rows), "features": len(comids), "bytes": os.path.getsize(path)}
+
+
+class IndexHolder:
+    """The current index, reopened when the file on disk is replaced."""
+
+    def __init__(self, path=WATERSHED_INDEX, reload_every=WATERSHED_INDEX_RELOAD):
+        self.path = path
+        self.reload_every = reload_every
+        self.index = None
+        self._checked = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def current(self):
+        if not self.path:
+            return None
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.reload_every:
+            return self.index
+        with self._lock:
+            if self._checked is not None and now - self._checked < self.reload_every:
+                return self.index
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                self.index = None
+                return None
+            if self.index is None or mtime != self.index.mtime:
+                try:
+                    # The old mapping is released once in-flight lookups drop it
+                    self.index = WatershedIndex(self.path)
+                except (OSError, ValueError) as e:
+                    print(f"Couldn't open watershed index {self.path}: {e}")
+                    self.index = None
+            return self.index
+
+    def lookup(self, latitude, longitude):
+        index = self.current()
+        hit = index.lookup(latitude, longitude) if index is not None else None
+        with self._lock:
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return hit
+
+    def stats(self):
+        index = self.index
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "loaded": index is not None,
+            "cells": index.n_cells if index else 0,
+            "features": index.n_features if index else 0,
+            "grid_deg": index.grid_deg if index else None,
+            "built_at": index.meta.get("built_at") if index else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_holder = None
+_holder_lock = threading.Lock()
+
+
+def get_watershed_index():
+    global _holder
+    if _holder is None:
+        with _holder_lock:
+            if _holder is None:
+                _holder = IndexHolder()
+    return _holder
+
+
+# Ingestion
+
+def load_areas(path=SERVICE_AREAS_FILE, extra=()):
+    """{name: (min_lat, min_lon, max_lat, max_lon)} from the areas file plus NAME=bbox overrides."""
+    areas = {}
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            for name, area in json.load(f).items():
+                areas[name] = tuple(area["bbox"])
+    for spec in extra:
+        name, _, bbox = spec.partition("=")
+        areas[name] = tuple(float(v) for v in bbox.split(","))
+    return areas
+
+
+def area_cells(bbox, grid_deg):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    lat_lo, lon_lo = cell_of(min_lat, min_lon, grid_deg)
+    lat_hi, lon_hi = cell_of(max_lat, max_lon, grid_deg)
+    return [(lat, lon) for lat in range(lat_lo, lat_hi + 1) for lon in range(lon_lo, lon_hi + 1)]
+
+
+async def prefetch(areas, grid_deg, concurrency=4, client=None):
+    """Navigate from every cell centre, then fetch StreamCat once per COMID found."""
+    from epa_client import EPAWatersClient
+
+    own_client = client is None
+    client = client or EPAWatersClient()
+    slots = asyncio.Semaphore(concurrency)
+    cells, features, failed = {}, {}, 0
+    todo = sorted({cell for bbox in areas.values() for cell in area_cells(bbox, grid_deg)})
+    started = time.perf_counter()
+
+    async def feature_for(cell):
+        nonlocal failed
+        async with slots:
+            try:
+                resp, props = await client.find_nearest_feature(cell[0] * grid_deg, cell[1] * grid_deg)
+            except Exception as e:
+                failed += 1
+                print(f"  cell {cell}: {e}")
+                return
+        if resp.status_code != 200 or props is None:
+            return
+        comid = props.get("COMID") or props.get("comid")
+        if comid:
+            cells[cell] = int(comid)
+            features.setdefault(int(comid), {"name": props.get("GNIS_NAME", "Unnamed Stream")})
+
+    async def streamcat_for(comid):
+        nonlocal failed
+        async with slots:
+            try:
+                features[comid]["streamcat"] = await client.get_streamcat(comid)
+            except Exception as e:
+                failed += 1
+                print(f"  streamcat {comid}: {e}")
+
+    try:
+        print(f"Navigating from {len(todo)} cells in {len(areas)} area(s) at {grid_deg} deg...")
+        await asyncio.gather(*(feature_for(cell) for cell in todo))
+        print(f"Fetching StreamCat for {len(features)} features...")
+        await asyncio.gather(*(streamcat_for(comid) for comid in list(features)))
+    finally:
+        if own_client:
+            await client.aclose()
+    # Kept in the index so their cells don't borrow a neighbour's stream; lookup() skips them
+    missing = sum(1 for feature in features.values() if feature.get("streamcat") is None)
+    print(f"Prefetch took {time.perf_counter() - started:.1f}s, {failed} failed call(s), "
+          f"{missing} feature(s) without StreamCat")
+    return cells, features
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the prefetched EPA WATERS index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="prefetch the service areas and write the index")
+    build.add_argument("--areas", default=SERVICE_AREAS_FILE, help="JSON file of {name: {bbox: [...]}}")
+    build.add_argument("--area", action="append", default=[], metavar="NAME=MIN_LAT,MIN_LON,MAX_LAT,MAX_LON")
+    build.add_argument("--step-deg", type=float, default=0.01, help="grid spacing (0.01 deg ~ 1 km)")
+    build.add_argument("--concurrency", type=int, default=4, help="parallel EPA requests")
+    build.add_argument("--out", default=WATERSHED_INDEX)
+    lookup = sub.add_parser("lookup", help="query the index for a point")
+    lookup.add_argument("latitude", type=float)
+    lookup.add_argument("longitude", type=float)
+    lookup.add_argument("--index", default=WATERSHED_INDEX)
+    args = parser.parse_args(argv)
+
+    if args.command == "lookup":
+        index = WatershedIndex(args.index)
+        start = time.perf_counter()
+        hit = index.lookup(args.latitude, args.longitude)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        print(json.dumps({"hit": hit is not None, "lookup_us": round(elapsed_us, 1),
+                          "feature": hit[0] if hit else None}, indent=2))
+        return
+
+    if not args.out:
+        raise SystemExit("No index path; set WATERSHED_INDEX or pass --out")
+    areas = load_areas(args.areas, args.area)
+    if not areas:
+        raise SystemExit("No service areas to prefetch")
+    cells, features = asyncio.run(prefetch(areas, args.step_deg, args.concurrency))
+    meta = {"built_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "areas": {name: list(b) for name, b in areas.items()}}
+    written = write_index(args.out, args.step_deg, cells, features, meta)
+    print(f"Wrote {args.out}: {written['cells']} cells, {written['features']} features, {written['bytes']} bytes")
+
+
+if __name__ == "__main__":
+    sys.exit(main())